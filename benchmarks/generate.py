@@ -0,0 +1,266 @@
+#!/usr/bin/env python3
+
+import argparse
+import csv
+import io
+import json
+import os
+import random
+import zipfile
+
+# Data volumes per size. metadata_rows is per organism and fsis_rows per fiscal year.
+# Every fiscal year the FSIS downloader requests is generated, FY2014-FY2024.
+SIZES = {
+    "small": {"organisms": 2, "metadata_rows": 20000, "fsis_rows": 2000, "narms_rows": 2000},
+    "medium": {"organisms": 4, "metadata_rows": 250000, "fsis_rows": 25000, "narms_rows": 20000},
+    "production": {"organisms": 4, "metadata_rows": 2000000, "fsis_rows": 200000, "narms_rows": 100000},
+}
+
+ORGANISMS = ["Salmonella", "Listeria", "Campylobacter", "Escherichia_coli_Shigella"]
+FSIS_YEARS = list(range(2024, 2013, -1))
+NARMS_PATH = "media/93325/download"
+
+SEROVARS = ["Kentucky", "Infantis", "Enteritidis", "Typhimurium", "Schwarzengrund", "Reading", "Heidelberg"]
+SOURCES = ["chicken breast", "ground turkey", "chicken carcass", "ground beef", "pork chop", "feces", "missing"]
+HOSTS = ["Gallus gallus", "Meleagris gallopavo", "Bos taurus", "Sus scrofa", "Homo sapiens", "missing"]
+LOCATIONS = ["USA", "USA:CA", "USA:GA", "USA:NC", "USA:TX", "Canada", "Mexico"]
+CENTERS = ["FDA-CFSAN", "USDA-FSIS", "CDC", "PHE", "Wadsworth Center"]
+PRODUCTS = ["Chicken Breast", "Chicken Legs", "Chicken Wings", "Ground Turkey", "Comminuted Chicken"]
+GENES = ["blaTEM-1", "tet(A)", "sul1", "aph(6)-Id", "aadA1", "fosA7", "mdsA", "gyrA_S83F"]
+
+# Isolates per group of pairwise SNP distances, about two pairs per isolate
+DISTANCE_GROUP = 5
+
+# Shared accession space: FSIS and NARMS records link to a fraction of the NCBI isolates
+LINKED_FRACTION = 0.4
+
+
+def _biosample(number):
+    return f"SAMN{number:08d}"
+
+
+def _run(number):
+    return f"SRR{10000000 + number}"
+
+
+def _date(rng, year=None):
+    year = year or rng.randint(2014, 2024)
+    return f"{year}-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}"
+
+
+def generate_ncbi(root, organisms, rows, seed=0):
+    """
+    Write a pathogen/Results tree with Metadata and Clusters TSVs for each organism.
+
+    Each organism gets pathogen/Results/<organism>/<PDG release>/{Metadata,Clusters} and a
+    latest_snps link to the release, as on the NCBI FTP site.
+
+    Returns:
+    - The total number of metadata rows written.
+    """
+    rng = random.Random(seed)
+    columns = [
+        "#label", "HHS_region", "LibraryLayout", "PFGE_PrimaryEnzyme_pattern", "Platform", "Run", "asm_acc",
+        "asm_level", "asm_stats_contig_n50", "asm_stats_length_bp", "asm_stats_n_contig", "assembly_method",
+        "attribute_package", "bioproject_acc", "bioproject_center", "biosample_acc", "collected_by",
+        "collection_date", "epi_type", "geo_loc_name", "host", "host_disease", "isolation_source", "lat_lon",
+        "outbreak", "sample_name", "scientific_name", "serovar", "source_type", "species_taxid", "sra_center",
+        "sra_release_date", "strain", "target_acc", "target_creation_date", "taxid", "PDS_acc", "AMR_genotypes",
+        "computed_types", "number_drugs_resistant",
+    ]
+    total = 0
+    for index, organism in enumerate(organisms):
+        release = f"PDG{index + 1:09d}.{1000 + index}"
+        organism_dir = os.path.join(root, "pathogen", "Results", organism)
+        metadata_dir = os.path.join(organism_dir, release, "Metadata")
+        clusters_dir = os.path.join(organism_dir, release, "Clusters")
+        os.makedirs(metadata_dir, exist_ok=True)
+        os.makedirs(clusters_dir, exist_ok=True)
+
+        metadata_path = os.path.join(metadata_dir, f"{release}.metadata.tsv")
+        clusters_path = os.path.join(clusters_dir, f"{release}.reference_target.cluster_list.tsv")
+        distances_path = os.path.join(clusters_dir, f"{release}.reference_target.SNP_distances.tsv")
+        with open(metadata_path, "w", newline="") as metadata, open(clusters_path, "w", newline="") as clusters, \
+                open(distances_path, "w", newline="") as distances:
+            metadata_writer = csv.writer(metadata, delimiter="\t", lineterminator="\n")
+            cluster_writer = csv.writer(clusters, delimiter="\t", lineterminator="\n")
+            distance_writer = csv.writer(distances, delimiter="\t", lineterminator="\n")
+            metadata_writer.writerow(columns)
+            cluster_writer.writerow(["target_acc", "PDS_acc", "biosample_acc", "gencoll_acc", "minsame", "mindiff"])
+            distance_writer.writerow(["target_acc_1", "target_acc_2", "delta_positions_unambiguous"])
+            group = []
+            for row in range(rows):
+                number = index * rows + row
+                target = f"PDT{number:09d}.1"
+                cluster = f"PDS{number // 25:09d}.{rng.randint(1, 9)}" if rng.random() < 0.8 else "NULL"
+                biosample = _biosample(number)
+                metadata_writer.writerow([
+                    f"{organism}|{target}", f"region {rng.randint(1, 10)}", rng.choice(["PAIRED", "SINGLE"]),
+                    "NULL", "ILLUMINA", _run(number), f"GCA_{number:09d}.1", "contig", rng.randint(50000, 500000),
+                    rng.randint(4500000, 5200000), rng.randint(20, 300), "SKESA 2.4", "Pathogen.env",
+                    f"PRJNA{rng.randint(200000, 200050)}", rng.choice(CENTERS), biosample, rng.choice(CENTERS),
+                    _date(rng), rng.choice(["environmental/other", "clinical"]), rng.choice(LOCATIONS),
+                    rng.choice(HOSTS), "NULL", rng.choice(SOURCES), "NULL", "NULL", f"sample{number}",
+                    organism.replace("_", " "), rng.choice(SEROVARS), rng.choice(["food", "animal", "human"]),
+                    28901, rng.choice(CENTERS), _date(rng), f"strain{number}", target, _date(rng), 28901, cluster,
+                    ",".join(rng.sample(GENES, rng.randint(1, 4))), f"serotype={rng.choice(SEROVARS)}",
+                    rng.randint(0, 8),
+                ])
+                cluster_writer.writerow([target, cluster, biosample, f"GCA_{number:09d}.1", rng.randint(0, 5),
+                                         rng.randint(0, 50)])
+                # Pairwise distances within groups of DISTANCE_GROUP consecutive isolates
+                group.append(target)
+                if len(group) == DISTANCE_GROUP or row == rows - 1:
+                    for first in range(len(group)):
+                        for second in range(first + 1, len(group)):
+                            distance_writer.writerow([group[first], group[second], rng.randint(0, 100)])
+                    group = []
+
+        latest = os.path.join(organism_dir, "latest_snps")
+        if not os.path.lexists(latest):
+            os.symlink(release, latest)
+        total += rows
+    return total
+
+
+def _fsis_records(rng, year, rows, linked_isolates):
+    for row in range(rows):
+        form_id = f"{year}{row:07d}"
+        organism = rng.choice(["salmonella", "campylobacter"])
+        linked = rng.random() < LINKED_FRACTION
+        number = rng.randrange(linked_isolates) if linked else None
+        primary = {
+            "form_id": form_id,
+            "collection_date": _date(rng, year),
+            "establishment_name": f"Establishment {rng.randint(1, 400)}",
+            "establishment_number": f"P{rng.randint(1, 400):05d}",
+            "state": rng.choice(["GA", "NC", "AR", "AL", "MS", "TX", "CA"]),
+            "district": f"District {rng.randint(1, 10)}",
+            "project_code": rng.choice(["HC01", "HC02", "HC04", "HC05"]),
+            "product": rng.choice(PRODUCTS),
+            "sample_source": rng.choice(["Domestic", "Import"]),
+            "salmonella_result": rng.choice(["Positive", "Negative"]),
+            "campylobacter_result": rng.choice(["Positive", "Negative", None]),
+        }
+        secondary = {"form_id": form_id, "serotype": rng.choice(SEROVARS) if organism == "salmonella" else None}
+        for other in ("salmonella", "campylobacter"):
+            secondary[f"{other}_bio_project_number"] = "PRJNA242614" if linked and other == organism else None
+            secondary[f"{other}_bio_sample_accession_number"] = (
+                _biosample(number) if linked and other == organism else None
+            )
+            secondary[f"{other}_sra_accession_number"] = _run(number) if linked and other == organism else None
+        yield primary, secondary
+        # FSIS data repeats some form_ids in the primary table
+        if row % 50 == 0:
+            yield primary, None
+
+
+def generate_fsis(root, years, rows, linked_isolates, seed=0):
+    """
+    Write one raw_poultry_sampling_data_fy<year>.zip per fiscal year under <root>/fsis.
+
+    Each archive holds a JSON document shaped like the FSIS exports: a list whose first item
+    has nested metadata plus data.primary_table_data and data.secondary_table_data record arrays.
+    The JSON is streamed into the archive so production sizes do not need to fit in memory.
+
+    Returns:
+    - The paths of the archives written.
+    """
+    fsis_dir = os.path.join(root, "fsis")
+    os.makedirs(fsis_dir, exist_ok=True)
+    paths = []
+    for year in years:
+        name = f"raw_poultry_sampling_data_fy{year}"
+        path = os.path.join(fsis_dir, f"{name}.zip")
+
+        # Records are generated twice from the same seed, once per table, instead of being held in memory
+        def records():
+            return _fsis_records(random.Random(seed * 10000 + year), year, rows, linked_isolates)
+
+        primary, secondary = next(records())
+        header = {
+            "meta": {"fiscal_year": year, "generated": f"{year}-10-01", "source": {"agency": "FSIS", "version": 2}},
+            "columns": {"primary": list(primary), "secondary": list(secondary)},
+        }
+        with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as archive:
+            with archive.open(f"{name}.json", "w") as raw:
+                out = io.TextIOWrapper(raw, encoding="utf-8")
+                out.write("[" + json.dumps(header)[:-1] + ', "data": {"primary_table_data": [')
+                count = 0
+                for primary, _ in records():
+                    out.write(("," if count else "") + json.dumps(primary))
+                    count += 1
+                out.write('], "secondary_table_data": [')
+                first = True
+                for _, secondary in records():
+                    if secondary is not None:
+                        out.write(("" if first else ",") + json.dumps(secondary))
+                        first = False
+                out.write(']}}, {"meta": {"summary": true}, "data": {"rows": %d}}]' % count)
+                out.flush()
+                out.detach()
+        paths.append(path)
+    return paths
+
+
+def generate_narms(root, rows, linked_isolates, seed=0):
+    """
+    Write a NARMS retail isolates workbook to <root>/media/93325/download, the FDA download path.
+
+    Returns:
+    - The path of the workbook.
+    """
+    from openpyxl import Workbook
+
+    rng = random.Random(seed)
+    path = os.path.join(root, NARMS_PATH)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet("Retail Isolates")
+    sheet.append(["Isolate ID", "Genus", "Serotype", "Meat Type", "State", "Year", "BioSample", "SRA",
+                  "Resistance Pattern"])
+    for row in range(rows):
+        linked = rng.random() < LINKED_FRACTION
+        number = rng.randrange(linked_isolates)
+        sheet.append([
+            f"N{row:08d}", rng.choice(["Salmonella", "Campylobacter", "Escherichia", "Enterococcus"]),
+            rng.choice(SEROVARS), rng.choice(["Chicken", "Ground Turkey", "Ground Beef", "Pork Chop"]),
+            rng.choice(["CA", "CO", "CT", "GA", "MD", "MN", "NM", "NY", "OR", "TN"]), rng.randint(2002, 2023),
+            _biosample(number) if linked else None, _run(number) if linked else None,
+            "-".join(rng.sample(["AMP", "TET", "STR", "GEN", "CIP", "NAL"], rng.randint(0, 3))) or None,
+        ])
+    workbook.save(path)
+    return path
+
+
+def generate(root, size="small", seed=0):
+    """
+    Generate the NCBI, FSIS and NARMS stand-in data for a benchmark size.
+
+    Returns:
+    - The size parameters used.
+    """
+    params = dict(SIZES[size])
+    organisms = ORGANISMS[:params["organisms"]]
+    linked_isolates = params["metadata_rows"] * len(organisms)
+    print(f"Generating {size} benchmark data in {root}")
+    generate_ncbi(root, organisms, params["metadata_rows"], seed)
+    generate_fsis(root, FSIS_YEARS, params["fsis_rows"], linked_isolates, seed)
+    generate_narms(root, params["narms_rows"], linked_isolates, seed)
+    params["organism_names"] = organisms
+    with open(os.path.join(root, "benchmark.json"), "w") as file:
+        json.dump({"size": size, "seed": seed, "params": params}, file, indent=2)
+    return params
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate synthetic NCBI, FSIS and NARMS data for benchmarks.")
+    parser.add_argument("root", help="Directory to write the data to.")
+    parser.add_argument("--size", choices=sorted(SIZES), default="small", help="Data volume. Defaults to small.")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed. Defaults to 0.")
+    args = parser.parse_args()
+    generate(args.root, args.size, args.seed)
+
+
+if __name__ == "__main__":
+    main()
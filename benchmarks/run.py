@@ -0,0 +1,245 @@
+#!/usr/bin/env python3
+
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import shutil
+import time
+
+from benchmarks.generate import SIZES, generate
+from benchmarks.server import base_url, serve
+from opentrakr import metrics
+
+STAGES = ("download", "process", "merge", "join", "convert", "link", "snp")
+
+
+def _paths(work):
+    return {
+        "ncbi": os.path.join(work, "metadata_ncbi"),
+        "ncbi_merged": os.path.join(work, "ncbi_metadata.tsv"),
+        "fsis": os.path.join(work, "metadata_fsis"),
+        "fsis_joined": "fsis_wgs.csv",
+        "narms": os.path.join(work, "metadata_narms"),
+        "linked": os.path.join(work, "linked"),
+        "snp": os.path.join(work, "snp_pairs"),
+    }
+
+
+def stage_download(config):
+    from opentrakr.fsis_wgs_download import download_files_requests
+    from opentrakr.narms_wgs_download import download_file
+    from opentrakr.ncbi_tsv_download import download_all
+
+    paths = _paths(config["work"])
+    url = config["base_url"]
+    download_all(config["organisms"], f"{url}/pathogen/Results", paths["ncbi"], workers=config["workers"], force=True)
+    download_files_requests(paths["fsis"], base_url=f"{url}/fsis/", force=True)
+    download_file(paths["narms"], "narms_retail.xlsx", url=f"{url}/media/93325/download?attachment", force=True)
+
+
+def stage_process(config):
+    from opentrakr.fsis_wgs_download import process_json_files
+
+    process_json_files(_paths(config["work"])["fsis"], streaming=config["streaming"], workers=config["workers"])
+
+
+def stage_merge(config):
+    from opentrakr.fsis_wgs_download import merge_csv_files_by_type
+    from opentrakr.ncbi_tsv_merge import merge_metadata
+
+    paths = _paths(config["work"])
+    merge_metadata(paths["ncbi"], paths["ncbi_merged"], streaming=config["streaming"])
+    merge_csv_files_by_type(paths["fsis"], streaming=config["streaming"])
+
+
+def stage_join(config):
+    from opentrakr.fsis_wgs_download import join_primary_secondary
+
+    fsis = _paths(config["work"])["fsis"]
+    join_primary_secondary(
+        os.path.join(fsis, "merged_usda_fsis_data_primary.csv"),
+        os.path.join(fsis, "merged_usda_fsis_data_secondary.csv"),
+        fsis,
+        _paths(config["work"])["fsis_joined"],
+    )
+
+
+def stage_convert(config):
+    from opentrakr.narms_wgs_download import convert_to_tab_delimited
+
+    narms = _paths(config["work"])["narms"]
+    convert_to_tab_delimited(os.path.join(narms, "narms_retail.xlsx"), os.path.join(narms, "narms_retail.txt"))
+
+
+def stage_link(config):
+    from opentrakr.linkage import link_records
+
+    paths = _paths(config["work"])
+    clusters = [
+        os.path.join(paths["ncbi"], name) for name in sorted(os.listdir(paths["ncbi"]))
+        if name.endswith(".cluster_list.tsv")
+    ]
+    link_records(
+        [os.path.join(paths["fsis"], paths["fsis_joined"]), os.path.join(paths["narms"], "narms_retail.txt")],
+        paths["ncbi_merged"],
+        paths["linked"],
+        clusters,
+    )
+
+
+def stage_snp(config):
+    from opentrakr.snp_distances import ingest_snp_distances
+
+    ingest_snp_distances(config["organisms"], f"{config['base_url']}/pathogen/Results", _paths(config["work"])["snp"],
+                         force=True)
+
+
+STAGE_FUNCTIONS = {
+    "download": stage_download,
+    "process": stage_process,
+    "merge": stage_merge,
+    "join": stage_join,
+    "convert": stage_convert,
+    "link": stage_link,
+    "snp": stage_snp,
+}
+
+
+def _mb(size):
+    return None if size is None else round(size / 2 ** 20, 1)
+
+
+def _format_mb(size):
+    # Peak RSS is not available on Windows
+    return f"{size:>9.1f} MB" if size is not None else f"{'n/a':>12}"
+
+
+def _run_stage(name, config, results):
+    if config["verbose"]:
+        metrics.configure_logging("INFO")
+    recorder = metrics.enable()
+    with recorder.stage(name) as record:
+        STAGE_FUNCTIONS[name](config)
+    results.put({
+        "seconds": round(record["seconds"], 3),
+        "peak_rss_mb": _mb(record["peak_rss_bytes"]),
+        "peak_rss_workers_mb": _mb(record["peak_rss_children_bytes"]),
+        **{counter: record[counter] for counter in metrics.COUNTERS},
+    })
+
+
+def run_stage(name, config):
+    """
+    Run one stage in a fresh process and measure its wall time, peak memory and output size.
+
+    Each stage runs in its own process so that its peak RSS is not inflated by earlier stages.
+
+    Returns:
+    - A dict with 'seconds', 'peak_rss_mb', 'peak_rss_workers_mb' (worker processes) and the
+      opentrakr.metrics counters of the stage.
+    """
+    context = multiprocessing.get_context("spawn")
+    results = context.Queue()
+    process = context.Process(target=_run_stage, args=(name, config, results))
+    process.start()
+    process.join()
+    if process.exitcode != 0:
+        raise RuntimeError(f"Stage {name} failed with exit code {process.exitcode}")
+    return results.get()
+
+
+def run_benchmarks(data, work, size="small", stages=STAGES, workers=1, streaming=False, latency=0.0, seed=0,
+                   verbose=False):
+    """
+    Generate (if needed) and serve the stand-in data, then run and measure each stage in order.
+
+    Parameters:
+    - data: Directory for the generated data; reused when it already holds data of the same size and seed.
+    - work: Working directory for downloads and outputs; emptied first.
+    - size: Data volume, one of benchmarks.generate.SIZES.
+    - stages: Stages to run, in order. Later stages need the outputs of earlier ones.
+    - workers: Worker count passed to the downloads and FSIS processing.
+    - streaming: Use the streaming FSIS processing and merges.
+    - latency: Seconds of latency the stand-in server adds to every request.
+    - seed: Random seed for the generated data.
+    - verbose: Show the output of the stages.
+
+    Returns:
+    - A dict with the run parameters and per-stage results.
+    """
+    marker = os.path.join(data, "benchmark.json")
+    params = None
+    if os.path.exists(marker):
+        with open(marker) as file:
+            existing = json.load(file)
+        if existing.get("size") == size and existing.get("seed") == seed:
+            params = existing["params"]
+    if params is None:
+        if os.path.isdir(data):
+            shutil.rmtree(data)
+        params = generate(data, size, seed)
+
+    if os.path.isdir(work):
+        shutil.rmtree(work)
+    os.makedirs(work)
+
+    server = serve(data, latency=latency)
+    config = {
+        "work": os.path.abspath(work),
+        "base_url": base_url(server),
+        "organisms": params["organism_names"],
+        "workers": workers,
+        "streaming": streaming,
+        "verbose": verbose,
+    }
+    report = {
+        "size": size,
+        "params": params,
+        "workers": workers,
+        "streaming": streaming,
+        "latency": latency,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "started": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "stages": {},
+    }
+    try:
+        for name in stages:
+            result = run_stage(name, config)
+            report["stages"][name] = result
+            print(f"{name:<10} {result['seconds']:>9.2f}s {_format_mb(result['peak_rss_mb'])} "
+                  f"{_format_mb(result['peak_rss_workers_mb'])} {result['bytes_written'] / 1e6:>10.1f} MB "
+                  f"{result['rows_written']:>12}")
+    finally:
+        server.shutdown()
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the opentrakr workflows against a local stand-in server.")
+    parser.add_argument("--size", choices=sorted(SIZES), default="small", help="Data volume. Defaults to small.")
+    parser.add_argument("--data", default="bench_data", help="Directory for the generated data. Defaults to bench_data.")
+    parser.add_argument("--work", default="bench_work", help="Working directory, emptied first. Defaults to bench_work.")
+    parser.add_argument("--stages", nargs="+", choices=STAGES, default=list(STAGES), help="Stages to run, in order.")
+    parser.add_argument("--workers", type=int, default=1, help="Worker count for downloads and processing. Defaults to 1.")
+    parser.add_argument("--streaming", action="store_true", help="Use streaming FSIS processing and merges.")
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds of latency added to every request.")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed for the generated data. Defaults to 0.")
+    parser.add_argument("--json", help="Write the results as JSON to this file.")
+    parser.add_argument("--verbose", action="store_true", help="Show the output of the stages.")
+    args = parser.parse_args()
+
+    print(f"{'stage':<10} {'wall':>10} {'peak RSS':>12} {'workers':>12} {'written':>13} {'rows':>12}")
+    report = run_benchmarks(args.data, args.work, args.size, args.stages, args.workers, args.streaming, args.latency,
+                            args.seed, args.verbose)
+    if args.json:
+        with open(args.json, "w") as file:
+            json.dump(report, file, indent=2)
+        print(f"Results written to {args.json}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+
+import argparse
+import html
+import os
+import threading
+import time
+import zlib
+from email.utils import formatdate, parsedate_to_datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import unquote, urlparse
+
+CHUNK_SIZE = 64 * 1024
+# Files sent gzip-encoded to clients that accept it, as web servers do for text
+TEXT_SUFFIXES = (".tsv", ".csv", ".txt", ".json")
+
+
+class MirrorHandler(BaseHTTPRequestHandler):
+    """
+    Serve a local directory the way the NCBI, FSIS and FDA servers serve their files.
+
+    Directories are returned as HTML listings of href links (as on the NCBI FTP site) and
+    files support ETag/Last-Modified validators, conditional requests and byte ranges,
+    so downloads can be resumed and skipped as they are against the real servers. Whole
+    text files are gzip-encoded on the fly for clients that accept it, with a weak ETag
+    (as nginx does), so an encoded response never satisfies If-Range.
+    """
+
+    protocol_version = "HTTP/1.1"
+    root = "."
+    latency = 0.0
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_HEAD(self):
+        self._serve(send_body=False)
+
+    def do_GET(self):
+        self._serve(send_body=True)
+
+    def _local_path(self):
+        path = unquote(urlparse(self.path).path)
+        local = os.path.realpath(os.path.join(self.root, path.lstrip("/")))
+        root = os.path.realpath(self.root)
+        # Symlinks such as latest_snps may point anywhere below the root, but not outside it
+        if local != root and not local.startswith(root + os.sep):
+            return None
+        return local
+
+    def _send(self, status, headers=(), body=b"", send_body=True):
+        self.send_response(status)
+        for name, value in headers:
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if send_body and body:
+            self.wfile.write(body)
+
+    def _serve(self, send_body):
+        if self.latency:
+            time.sleep(self.latency)
+        local = self._local_path()
+        if local is None or not os.path.exists(local):
+            self._send(404, body=b"Not Found", send_body=send_body)
+            return
+        if os.path.isdir(local):
+            self._send_listing(local, send_body)
+            return
+
+        stat = os.stat(local)
+        size = stat.st_size
+        etag = f'"{size:x}-{int(stat.st_mtime):x}"'
+        last_modified = formatdate(stat.st_mtime, usegmt=True)
+        validators = [("ETag", etag), ("Last-Modified", last_modified), ("Accept-Ranges", "bytes")]
+
+        if self._not_modified(etag, stat.st_mtime):
+            self._send(304, validators, send_body=False)
+            return
+
+        accept_encoding = self.headers.get("Accept-Encoding", "")
+        if (not self.headers.get("Range") and local.endswith(TEXT_SUFFIXES)
+                and "gzip" in [coding.split(";")[0].strip() for coding in accept_encoding.split(",")]):
+            self._send_gzip(local, [("ETag", f"W/{etag}")] + validators[1:], send_body)
+            return
+
+        start, end = 0, size - 1
+        status = 200
+        range_header = self.headers.get("Range")
+        if_range = self.headers.get("If-Range")
+        if range_header and (if_range is None or if_range in (etag, last_modified)):
+            try:
+                first, _, last = range_header.split("=", 1)[1].partition("-")
+                start = int(first)
+                end = min(int(last), size - 1) if last else size - 1
+            except (IndexError, ValueError):
+                start, end = 0, size - 1
+            else:
+                if start >= size:
+                    self._send(416, validators + [("Content-Range", f"bytes */{size}")], send_body=send_body)
+                    return
+                status = 206
+
+        self.send_response(status)
+        for name, value in validators:
+            self.send_header(name, value)
+        self.send_header("Content-Type", "application/octet-stream")
+        self.send_header("Content-Length", str(end - start + 1))
+        if status == 206:
+            self.send_header("Content-Range", f"bytes {start}-{end}/{size}")
+        self.end_headers()
+        if not send_body:
+            return
+        with open(local, "rb") as file:
+            file.seek(start)
+            remaining = end - start + 1
+            try:
+                while remaining > 0:
+                    chunk = file.read(min(CHUNK_SIZE, remaining))
+                    if not chunk:
+                        break
+                    self.wfile.write(chunk)
+                    remaining -= len(chunk)
+            except (BrokenPipeError, ConnectionResetError):
+                pass
+
+    def _send_gzip(self, local, headers, send_body):
+        self.send_response(200)
+        for name, value in headers:
+            self.send_header(name, value)
+        self.send_header("Content-Type", "application/octet-stream")
+        self.send_header("Content-Encoding", "gzip")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        if not send_body:
+            return
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+        try:
+            with open(local, "rb") as file:
+                for data in iter(lambda: file.read(CHUNK_SIZE), b""):
+                    self._write_chunk(compressor.compress(data))
+            self._write_chunk(compressor.flush())
+            self.wfile.write(b"0\r\n\r\n")
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    def _write_chunk(self, data):
+        if data:
+            self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+
+    def _not_modified(self, etag, mtime):
+        if_none_match = self.headers.get("If-None-Match")
+        if if_none_match is not None:
+            # Weak comparison, so the ETag of a gzip-encoded response matches too
+            return etag in [tag.strip().replace("W/", "", 1) for tag in if_none_match.split(",")]
+        if_modified_since = self.headers.get("If-Modified-Since")
+        if if_modified_since:
+            try:
+                return int(mtime) <= parsedate_to_datetime(if_modified_since).timestamp()
+            except (TypeError, ValueError):
+                return False
+        return False
+
+    def _send_listing(self, local, send_body):
+        links = []
+        for name in sorted(os.listdir(local)):
+            href = name + "/" if os.path.isdir(os.path.join(local, name)) else name
+            links.append(f'<a href="{html.escape(href)}">{html.escape(href)}</a><br>')
+        body = ("<html><body>\n" + "\n".join(links) + "\n</body></html>\n").encode()
+        self._send(200, [("Content-Type", "text/html")], body, send_body)
+
+
+def serve(root, host="127.0.0.1", port=0, latency=0.0):
+    """
+    Start a mirror server for root in a background thread.
+
+    Parameters:
+    - root: Directory laid out like the remote servers (see generate.py).
+    - host: Interface to listen on.
+    - port: Port to listen on; 0 picks a free port.
+    - latency: Seconds to wait before answering each request, to mimic a remote server.
+
+    Returns:
+    - The running ThreadingHTTPServer; its base URL is http://<host>:<server.server_port>.
+    """
+    handler = type("Handler", (MirrorHandler,), {"root": os.path.abspath(root), "latency": latency})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def base_url(server):
+    host, port = server.server_address[:2]
+    return f"http://{host}:{port}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve generated benchmark data as a stand-in for the NCBI, FSIS and FDA servers.")
+    parser.add_argument("root", help="Directory written by benchmarks.generate.")
+    parser.add_argument("--host", default="127.0.0.1", help="Interface to listen on. Defaults to 127.0.0.1.")
+    parser.add_argument("--port", type=int, default=8000, help="Port to listen on. Defaults to 8000.")
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds of latency added to every request.")
+    args = parser.parse_args()
+
+    server = serve(args.root, args.host, args.port, args.latency)
+    url = base_url(server)
+    print(f"Serving {args.root} at {url}")
+    print(f"  NCBI:  {url}/pathogen/Results")
+    print(f"  FSIS:  {url}/fsis/")
+    print(f"  NARMS: {url}/media/93325/download")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+"""
+opentrakr: download, merge and link NCBI Pathogen Detection, FSIS and NARMS metadata.
+
+The workflow functions are available from the package itself, e.g.
+
+    import opentrakr
+    opentrakr.ncbi_workflow("metadata_ncbi", "ncbi_metadata.tsv", bacteria_list=["Salmonella"])
+
+Each name is imported from its module on first use, so importing opentrakr does not load
+pandas, openpyxl or selenium until a function that needs them is used.
+"""
+
+import importlib
+
+__version__ = "0.1.0"
+
+# Public name -> (module, attribute)
+_API = {
+    # NCBI
+    "download_all": ("opentrakr.ncbi_tsv_download", "download_all"),
+    "list_available_bacteria": ("opentrakr.ncbi_tsv_download", "list_available_bacteria"),
+    "merge_metadata": ("opentrakr.ncbi_tsv_merge", "merge_metadata"),
+    "update_merged_output": ("opentrakr.ncbi_tsv_merge", "update_merged_output"),
+    "diff_releases": ("opentrakr.release_diff", "diff_releases"),
+    "ncbi_workflow": ("opentrakr.pipeline", "ncbi_workflow"),
+    "StageRunner": ("opentrakr.pipeline", "StageRunner"),
+    # FSIS
+    "complete_workflow": ("opentrakr.fsis_wgs_download", "complete_workflow"),
+    "download_files_requests": ("opentrakr.fsis_wgs_download", "download_files_requests"),
+    "process_json_files": ("opentrakr.fsis_wgs_download", "process_json_files"),
+    "merge_csv_files_by_type": ("opentrakr.fsis_wgs_download", "merge_csv_files_by_type"),
+    "join_primary_secondary": ("opentrakr.fsis_wgs_download", "join_primary_secondary"),
+    "in_memory_workflow": ("opentrakr.fsis_wgs_download", "in_memory_workflow"),
+    # NARMS
+    "download_narms": ("opentrakr.narms_wgs_download", "download_file"),
+    "convert_to_tab_delimited": ("opentrakr.narms_wgs_download", "convert_to_tab_delimited"),
+    # Linkage and lookups
+    "link_records": ("opentrakr.linkage", "link_records"),
+    "update_index": ("opentrakr.accession_index", "update_index"),
+    "lookup": ("opentrakr.accession_index", "lookup"),
+    "read_columnar": ("opentrakr.columnar", "read_columnar"),
+    # SNP distances
+    "ingest_snp_distances": ("opentrakr.snp_distances", "ingest_snp_distances"),
+    "SnpPairStore": ("opentrakr.snp_distances", "SnpPairStore"),
+    "snp_neighbors": ("opentrakr.snp_distances", "neighbors"),
+    # Shared download cache
+    "DownloadCache": ("opentrakr.download_cache", "DownloadCache"),
+    "configure_cache": ("opentrakr.download_cache", "configure"),
+    # Compressed files
+    "open_file": ("opentrakr.compression", "open_file"),
+}
+
+__all__ = sorted(_API)
+
+
+def __getattr__(name):
+    if name not in _API:
+        raise AttributeError(f"module 'opentrakr' has no attribute '{name}'")
+    module_name, attribute = _API[name]
+    value = getattr(importlib.import_module(module_name), attribute)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_API))
@@ -0,0 +1,407 @@
+#!/usr/bin/env python3
+
+import argparse
+import csv
+import json
+import logging
+import os
+import sqlite3
+import sys
+
+from opentrakr import metrics
+from opentrakr.compression import open_file, split_codec
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_DB = "ncbi_accessions.sqlite"
+BATCH_SIZE = 10000
+
+# Candidate column names for each key, in order of preference
+TARGET_COLUMNS = ("target_acc",)
+BIOSAMPLE_COLUMNS = ("biosample_acc",)
+RUN_COLUMNS = ("Run", "run", "sra_run")
+CLUSTER_COLUMNS = ("PDS_acc",)
+
+KEYS = ("biosample_acc", "target_acc", "run", "pds_acc")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sources (
+    path TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS isolates (
+    target_acc TEXT PRIMARY KEY,
+    biosample_acc TEXT,
+    type TEXT,
+    source TEXT NOT NULL,
+    metadata TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS runs (
+    run TEXT NOT NULL,
+    target_acc TEXT NOT NULL,
+    source TEXT NOT NULL,
+    PRIMARY KEY (run, target_acc)
+);
+CREATE TABLE IF NOT EXISTS clusters (
+    target_acc TEXT PRIMARY KEY,
+    pds_acc TEXT,
+    source TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS metadata_clusters (
+    target_acc TEXT PRIMARY KEY,
+    pds_acc TEXT,
+    source TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS isolates_biosample ON isolates (biosample_acc);
+CREATE INDEX IF NOT EXISTS isolates_source ON isolates (source);
+CREATE INDEX IF NOT EXISTS runs_source ON runs (source);
+CREATE INDEX IF NOT EXISTS clusters_pds ON clusters (pds_acc);
+CREATE INDEX IF NOT EXISTS clusters_source ON clusters (source);
+CREATE INDEX IF NOT EXISTS metadata_clusters_pds ON metadata_clusters (pds_acc);
+CREATE INDEX IF NOT EXISTS metadata_clusters_source ON metadata_clusters (source);
+"""
+
+# Indexes built before metadata_clusters kept the clusters of metadata files in clusters
+MIGRATE_CLUSTERS = """
+INSERT OR REPLACE INTO metadata_clusters (target_acc, pds_acc, source)
+    SELECT c.target_acc, c.pds_acc, c.source FROM clusters c JOIN sources s ON s.path = c.source
+    WHERE s.kind = 'metadata';
+DELETE FROM clusters WHERE source IN (SELECT path FROM sources WHERE kind = 'metadata');
+"""
+
+
+def connect(db_path):
+    """
+    Open (and create if needed) an accession index database.
+    """
+    connection = sqlite3.connect(db_path)
+    connection.execute("PRAGMA journal_mode=WAL")
+    connection.execute("PRAGMA synchronous=NORMAL")
+    migrate = connection.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'table' AND name IN ('clusters', 'metadata_clusters')"
+    ).fetchall() == [("clusters",)]
+    connection.executescript(SCHEMA)
+    if migrate:
+        with connection:
+            connection.executescript(MIGRATE_CLUSTERS)
+    return connection
+
+
+def _pick(columns, candidates):
+    for candidate in candidates:
+        if candidate in columns:
+            return candidate
+    return None
+
+
+def _expand(paths, suffix):
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(
+                os.path.join(path, name) for name in sorted(os.listdir(path)) if split_codec(name)[0].endswith(suffix)
+            )
+        else:
+            files.append(path)
+    return [os.path.abspath(path) for path in files]
+
+
+def _is_current(connection, path):
+    row = connection.execute("SELECT size, mtime FROM sources WHERE path = ?", (path,)).fetchone()
+    stat = os.stat(path)
+    return row is not None and row[0] == stat.st_size and row[1] == stat.st_mtime
+
+
+def _forget(connection, path):
+    for table in ("isolates", "runs", "clusters", "metadata_clusters"):
+        connection.execute(f"DELETE FROM {table} WHERE source = ?", (path,))
+    connection.execute("DELETE FROM sources WHERE path = ?", (path,))
+
+
+def _remember(connection, path, kind):
+    stat = os.stat(path)
+    connection.execute(
+        "INSERT OR REPLACE INTO sources (path, kind, size, mtime) VALUES (?, ?, ?, ?)",
+        (path, kind, stat.st_size, stat.st_mtime),
+    )
+
+
+def _load_metadata(connection, path):
+    label = os.path.basename(path).split('.')[1] if split_codec(path)[0].endswith('.metadata.tsv') else None
+    with open_file(path, "rt", newline="") as file:
+        reader = csv.DictReader(file, delimiter="\t")
+        columns = reader.fieldnames or []
+        target_column = _pick(columns, TARGET_COLUMNS)
+        if target_column is None:
+            logger.warning(f"No target_acc column in {path}; skipping.")
+            return 0
+        biosample_column = _pick(columns, BIOSAMPLE_COLUMNS)
+        run_column = _pick(columns, RUN_COLUMNS)
+        cluster_column = _pick(columns, CLUSTER_COLUMNS)
+
+        isolates, runs, clusters = [], [], []
+        count = 0
+        for row in reader:
+            target = row.get(target_column)
+            if not target:
+                continue
+            isolates.append((
+                target,
+                row.get(biosample_column) if biosample_column else None,
+                row.get("type", label),
+                path,
+                json.dumps(row, separators=(",", ":")),
+            ))
+            if run_column and row.get(run_column):
+                runs.extend((run.strip(), target, path) for run in row[run_column].split(",") if run.strip())
+            if cluster_column and row.get(cluster_column):
+                clusters.append((target, row[cluster_column], path))
+            count += 1
+            if len(isolates) >= BATCH_SIZE:
+                _insert(connection, isolates, runs, clusters, "metadata_clusters")
+                isolates, runs, clusters = [], [], []
+        _insert(connection, isolates, runs, clusters, "metadata_clusters")
+    return count
+
+
+def _load_clusters(connection, path):
+    with open_file(path, "rt", newline="") as file:
+        reader = csv.DictReader(file, delimiter="\t")
+        columns = reader.fieldnames or []
+        target_column = _pick(columns, TARGET_COLUMNS)
+        cluster_column = _pick(columns, CLUSTER_COLUMNS)
+        if target_column is None or cluster_column is None:
+            logger.warning(f"No target_acc/PDS_acc columns in {path}; skipping.")
+            return 0
+        clusters = []
+        count = 0
+        for row in reader:
+            if row.get(target_column) and row.get(cluster_column):
+                clusters.append((row[target_column], row[cluster_column], path))
+                count += 1
+            if len(clusters) >= BATCH_SIZE:
+                _insert(connection, [], [], clusters)
+                clusters = []
+        _insert(connection, [], [], clusters)
+    return count
+
+
+def _insert(connection, isolates, runs, clusters, cluster_table="clusters"):
+    # The cluster_list files are the authority on SNP clusters; the PDS_acc of metadata files
+    # is kept apart in metadata_clusters and only used for isolates missing from them
+    connection.executemany(
+        "INSERT OR REPLACE INTO isolates (target_acc, biosample_acc, type, source, metadata) VALUES (?, ?, ?, ?, ?)",
+        isolates,
+    )
+    connection.executemany("INSERT OR REPLACE INTO runs (run, target_acc, source) VALUES (?, ?, ?)", runs)
+    connection.executemany(
+        f"INSERT OR REPLACE INTO {cluster_table} (target_acc, pds_acc, source) VALUES (?, ?, ?)", clusters
+    )
+
+
+def update_index(db_path, metadata_paths=(), cluster_paths=(), prune=True):
+    """
+    Build or incrementally update the accession index.
+
+    Files that are unchanged since they were last indexed (same size and modification
+    time) are skipped; changed files have their rows replaced. With prune, rows from
+    previously indexed files that no longer exist are removed.
+
+    Parameters:
+    - db_path: Path of the SQLite index.
+    - metadata_paths: Merged metadata TSVs from ncbi_tsv_merge, *.metadata.tsv files, or directories containing them.
+    - cluster_paths: *.cluster_list.tsv files from download_cluster_tsv_files, or directories containing them.
+    - prune: Remove rows from indexed files that have been deleted.
+
+    Returns:
+    - A dict with the number of files indexed, skipped and pruned.
+    """
+    summary = {"indexed": 0, "skipped": 0, "pruned": 0}
+    connection = connect(db_path)
+    try:
+        sources = [(path, "metadata") for path in _expand(metadata_paths, ".metadata.tsv")]
+        sources += [(path, "clusters") for path in _expand(cluster_paths, ".cluster_list.tsv")]
+
+        if prune:
+            for (path,) in connection.execute("SELECT path FROM sources").fetchall():
+                if not os.path.exists(path):
+                    with connection:
+                        _forget(connection, path)
+                    summary["pruned"] += 1
+                    logger.info(f"Removed {path} from the index")
+
+        for path, kind in sources:
+            if _is_current(connection, path):
+                summary["skipped"] += 1
+                continue
+            with connection:
+                _forget(connection, path)
+                count = _load_metadata(connection, path) if kind == "metadata" else _load_clusters(connection, path)
+                _remember(connection, path, kind)
+            summary["indexed"] += 1
+            metrics.file_read(path, count)
+            logger.info(f"Indexed {count} {kind} rows from {path}")
+    finally:
+        connection.close()
+    return summary
+
+
+def detect_key(accession):
+    """
+    Guess which key an accession belongs to from its prefix.
+    """
+    prefix = accession[:3].upper()
+    if prefix == "SAM":
+        return "biosample_acc"
+    if prefix == "PDT":
+        return "target_acc"
+    if prefix == "PDS":
+        return "pds_acc"
+    if prefix in ("SRR", "ERR", "DRR"):
+        return "run"
+    return None
+
+
+_KEY_QUERIES = {
+    "target_acc": "SELECT q.acc, i.target_acc FROM query q JOIN isolates i ON i.target_acc = q.acc",
+    "biosample_acc": "SELECT q.acc, i.target_acc FROM query q JOIN isolates i ON i.biosample_acc = q.acc",
+    "run": "SELECT q.acc, r.target_acc FROM query q JOIN runs r ON r.run = q.acc",
+    "pds_acc": (
+        "SELECT q.acc, c.target_acc FROM query q JOIN clusters c ON c.pds_acc = q.acc "
+        "UNION ALL SELECT q.acc, mc.target_acc FROM query q JOIN metadata_clusters mc ON mc.pds_acc = q.acc "
+        "WHERE mc.target_acc NOT IN (SELECT target_acc FROM clusters)"
+    ),
+}
+
+
+def lookup(db_path, accessions, key=None):
+    """
+    Look up metadata and SNP cluster for a batch of accessions.
+
+    Parameters:
+    - db_path: Path of the SQLite index.
+    - accessions: Iterable of BioSample, target (PDT), SRA run or SNP cluster (PDS) accessions.
+    - key: One of 'biosample_acc', 'target_acc', 'run' or 'pds_acc'. Detected per accession if not given.
+
+    Returns:
+    - A list of dicts, one per matching isolate, holding the metadata columns plus
+      'query' (the accession looked up) and 'PDS_acc' (the SNP cluster, if any). The
+      cluster comes from the indexed cluster_list files, or from the metadata for isolates
+      they do not list.
+
+    Raises:
+    - FileNotFoundError if db_path does not exist.
+    """
+    if not os.path.exists(db_path):
+        raise FileNotFoundError(f"No accession index at {db_path}; build it with the 'build' command first.")
+    groups = {}
+    for accession in accessions:
+        accession = accession.strip()
+        if accession:
+            groups.setdefault(key or detect_key(accession), []).append(accession)
+    if None in groups:
+        logger.warning(f"Could not determine the key for {len(groups.pop(None))} accessions; use --key.")
+
+    results = []
+    connection = sqlite3.connect(db_path)
+    try:
+        connection.execute("CREATE TEMP TABLE query (acc TEXT PRIMARY KEY)")
+        for group_key, values in groups.items():
+            if group_key not in _KEY_QUERIES:
+                raise ValueError(f"Unknown key '{group_key}'. Expected one of {', '.join(KEYS)}.")
+            connection.execute("DELETE FROM query")
+            connection.executemany("INSERT OR IGNORE INTO query (acc) VALUES (?)", ((v,) for v in values))
+            sql = (
+                f"SELECT m.acc, i.metadata, COALESCE(c.pds_acc, mc.pds_acc) FROM ({_KEY_QUERIES[group_key]}) m "
+                "LEFT JOIN isolates i ON i.target_acc = m.target_acc "
+                "LEFT JOIN clusters c ON c.target_acc = m.target_acc "
+                "LEFT JOIN metadata_clusters mc ON mc.target_acc = m.target_acc"
+            )
+            for acc, metadata, pds_acc in connection.execute(sql):
+                row = json.loads(metadata) if metadata else {}
+                row["query"] = acc
+                row["PDS_acc"] = pds_acc or row.get("PDS_acc")
+                results.append(row)
+    finally:
+        connection.close()
+    return results
+
+
+def query_index(args):
+    """
+    Run the query command: look up the accessions and write the matching isolates.
+    """
+    accessions = list(args.accessions)
+    if args.file:
+        with open_file(args.file) as file:
+            accessions.extend(line.strip() for line in file)
+    rows = lookup(args.db, accessions, args.key)
+
+    columns = ["query"]
+    for row in rows:
+        columns.extend(column for column in row if column not in columns)
+    out = open_file(args.output, "wt", newline="") if args.output else sys.stdout
+    try:
+        writer = csv.DictWriter(out, fieldnames=columns, delimiter="\t", extrasaction="ignore", lineterminator="\n")
+        writer.writeheader()
+        writer.writerows(rows)
+    finally:
+        if args.output:
+            out.close()
+    if args.output:
+        metrics.file_written(args.output, len(rows))
+        logger.info(f"{len(rows)} matching isolates written to {args.output}")
+
+
+DESCRIPTION = "Build and query an accession index over merged NCBI metadata."
+
+
+def add_arguments(parser):
+    """
+    Add the command-line options of this script to parser.
+    """
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    build = subparsers.add_parser("build", help="Build or incrementally update the index.")
+    build.add_argument("--db", default=DEFAULT_DB, help=f"Path of the SQLite index. Defaults to {DEFAULT_DB}.")
+    build.add_argument("-m", "--metadata", nargs="*", default=[],
+                       help="Merged metadata TSVs, *.metadata.tsv files, or directories containing them.")
+    build.add_argument("-c", "--clusters", nargs="*", default=[],
+                       help="*.cluster_list.tsv files, or directories containing them.")
+    build.add_argument("--no_prune", action="store_true", help="Keep rows from indexed files that no longer exist.")
+
+    query = subparsers.add_parser("query", help="Look up a batch of accessions.")
+    query.add_argument("accessions", nargs="*", help="Accessions to look up.")
+    query.add_argument("--db", default=DEFAULT_DB, help=f"Path of the SQLite index. Defaults to {DEFAULT_DB}.")
+    query.add_argument("-f", "--file", help="File with one accession per line.")
+    query.add_argument("-k", "--key", choices=KEYS, help="Accession type. Detected from the prefix if not given.")
+    query.add_argument("-o", "--output", help="Tab-delimited output file. Defaults to standard output.")
+    for subparser in (build, query):
+        metrics.add_arguments(subparser)
+
+
+def run(args):
+    """
+    Run the script with arguments parsed by a parser set up with add_arguments.
+    """
+    # Query results go to standard output unless --output is given, so messages go to standard error
+    stream = sys.stderr if args.command == "query" and not args.output else sys.stdout
+    with metrics.instrumented(args, args.command, stream=stream):
+        if args.command == "build":
+            summary = update_index(args.db, args.metadata, args.clusters, prune=not args.no_prune)
+            logger.info(f"Index {args.db}: {summary['indexed']} files indexed, {summary['skipped']} unchanged, "
+                        f"{summary['pruned']} removed")
+        else:
+            query_index(args)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=DESCRIPTION)
+    add_arguments(parser)
+    run(parser.parse_args(argv))
+
+
+if __name__ == "__main__":
+    main()
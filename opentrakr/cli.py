@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+
+import argparse
+import importlib
+import sys
+
+# Subcommand -> (module, help). Modules are imported only when their subcommand runs, so that
+# 'opentrakr --help' and light subcommands do not pay for pandas, openpyxl or selenium.
+COMMANDS = {
+    "ncbi-download": ("opentrakr.ncbi_tsv_download", "Download TSV files from the NCBI FTP site."),
+    "ncbi-merge": ("opentrakr.ncbi_tsv_merge", "Merge downloaded NCBI metadata files."),
+    "ncbi-workflow": ("opentrakr.pipeline", "Download and merge NCBI metadata, skipping up-to-date stages."),
+    "fsis": ("opentrakr.fsis_wgs_download", "Download, process, merge and join FSIS data."),
+    "narms": ("opentrakr.narms_wgs_download", "Download the NARMS retail workbook and convert it to a tab-delimited file."),
+    "link": ("opentrakr.linkage", "Annotate FSIS and NARMS records with their NCBI isolate and SNP cluster."),
+    "index": ("opentrakr.accession_index", "Build and query an accession index over merged NCBI metadata."),
+    "snp": ("opentrakr.snp_distances", "Keep close pairs from NCBI SNP_distances tables and query isolate neighbors."),
+    "diff": ("opentrakr.release_diff", "List the isolates added, removed, changed and reassigned between two NCBI snapshots."),
+}
+
+
+def build_parser():
+    """
+    Return the top-level parser. Subcommand options are added by the subcommand's module when it runs.
+    """
+    parser = argparse.ArgumentParser(
+        prog="opentrakr",
+        description="Download, merge and link NCBI, FSIS and NARMS pathogen metadata.",
+        epilog="Run 'opentrakr <command> --help' for the options of a command.",
+    )
+    parser.add_argument("--version", action="version", version=f"%(prog)s {_version()}")
+    subparsers = parser.add_subparsers(dest="command", metavar="command")
+    for name, (_, help_text) in COMMANDS.items():
+        subparsers.add_parser(name, help=help_text, add_help=False)
+    return parser
+
+
+def _version():
+    from opentrakr import __version__
+
+    return __version__
+
+
+def main(argv=None):
+    """
+    Run an opentrakr subcommand.
+
+    Parameters:
+    - argv: Command-line arguments without the program name. Defaults to sys.argv[1:].
+    """
+    argv = list(sys.argv[1:] if argv is None else argv)
+    if not argv or argv[0] not in COMMANDS:
+        # Handles --help and --version and rejects unknown commands; no command at all prints the help
+        parser = build_parser()
+        parser.parse_args(argv)
+        parser.print_help()
+        return 1
+
+    command, module_name = argv[0], COMMANDS[argv[0]][0]
+    module = importlib.import_module(module_name)
+    parser = argparse.ArgumentParser(prog=f"opentrakr {command}", description=module.DESCRIPTION)
+    module.add_arguments(parser)
+    return module.run(parser.parse_args(argv[1:]))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
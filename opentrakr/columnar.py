@@ -0,0 +1,272 @@
+#!/usr/bin/env python3
+
+import os
+import shutil
+
+from opentrakr.schemas import categorical_columns
+
+FORMATS = ("parquet", "feather")
+DEFAULT_COMPRESSION = "zstd"
+
+# Low-cardinality text columns stored dictionary-encoded (categorical) in columnar output
+CATEGORICAL_COLUMNS = {"fiscal_year"} | categorical_columns()
+
+
+def _require_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.dataset
+    except ImportError as e:
+        raise ImportError(
+            "Columnar output requires pyarrow. Install it with 'pip install pyarrow' "
+            "or 'pip install opentrakr[parquet]'."
+        ) from e
+    return pyarrow
+
+
+def _file_format(ds, output_format, compression):
+    if output_format == "parquet":
+        file_format = ds.ParquetFileFormat()
+        return file_format, file_format.make_write_options(compression=compression)
+    if output_format == "feather":
+        pa = _require_pyarrow()
+        file_format = ds.IpcFileFormat()
+        return file_format, file_format.make_write_options(compression=pa.Codec(compression) if compression else None)
+    raise ValueError(f"Unknown columnar format '{output_format}'. Expected one of {', '.join(FORMATS)}.")
+
+
+def arrow_schema(columns, partition_column=None, types=None):
+    """
+    Build the Arrow schema used for columnar output.
+
+    Columns listed in CATEGORICAL_COLUMNS (and the partition column) are dictionary encoded;
+    columns in types use the given Arrow type; all other columns are stored as strings.
+
+    Parameters:
+    - columns: Column names in output order.
+    - partition_column: Optional column the dataset is partitioned by.
+    - types: Optional dict mapping column names to Arrow types.
+
+    Returns:
+    - A pyarrow.Schema.
+    """
+    pa = _require_pyarrow()
+    types = types or {}
+    fields = []
+    for column in columns:
+        if column in types:
+            fields.append(pa.field(column, types[column]))
+        elif column in CATEGORICAL_COLUMNS or column == partition_column:
+            fields.append(pa.field(column, pa.dictionary(pa.int32(), pa.string())))
+        else:
+            fields.append(pa.field(column, pa.string()))
+    return pa.schema(fields)
+
+
+def frame_schema(df, partition_column=None):
+    """
+    Derive the Arrow schema for a DataFrame, dictionary encoding low-cardinality text columns.
+
+    Numeric and datetime columns keep their pandas types; text columns listed in
+    CATEGORICAL_COLUMNS (and the partition column) are dictionary encoded.
+    """
+    pa = _require_pyarrow()
+    schema = pa.Schema.from_pandas(df, preserve_index=False)
+    for i, field in enumerate(schema):
+        if (field.name in CATEGORICAL_COLUMNS or field.name == partition_column) and (
+                pa.types.is_string(field.type) or pa.types.is_large_string(field.type)):
+            schema = schema.set(i, pa.field(field.name, pa.dictionary(pa.int32(), pa.string())))
+    return schema
+
+
+def _table(pa, chunk, schema):
+    # Columns a union merge adds to a file that lacks them hold only NaN, which pandas types as
+    # float; Arrow converts those to the schema's text type only from object columns
+    chunk = chunk.reindex(columns=schema.names)
+    for field in schema:
+        column = chunk[field.name]
+        if column.dtype.kind == "f" and not pa.types.is_floating(field.type) and column.isna().all():
+            chunk[field.name] = column.astype(object)
+    return pa.Table.from_pandas(chunk, schema=schema, preserve_index=False)
+
+
+def write_partitioned_dataset(data, output_path, partition_column, output_format="parquet",
+                              compression=DEFAULT_COMPRESSION, schema=None):
+    """
+    Write tabular data as a columnar dataset partitioned by one column.
+
+    The dataset is written as <output_path>/<partition_column>=<value>/part-*.<format>,
+    replacing any dataset previously written to output_path.
+
+    Parameters:
+    - data: A pandas DataFrame, or an iterable of DataFrame or pyarrow.Table chunks (schema is then required).
+    - output_path: Directory to write the dataset to.
+    - partition_column: Column to partition the dataset by (e.g. 'type' or 'fiscal_year').
+    - output_format: 'parquet' or 'feather'.
+    - compression: Compression codec (e.g. 'zstd', 'snappy', 'lz4') or None.
+    - schema: Optional pyarrow.Schema; derived from the DataFrame columns if not given.
+
+    Returns:
+    - The number of rows written.
+    """
+    pa = _require_pyarrow()
+    import pandas as pd
+    import pyarrow.dataset as ds
+
+    file_format, write_options = _file_format(ds, output_format, compression)
+    if isinstance(data, pd.DataFrame):
+        schema = schema or frame_schema(data, partition_column)
+        chunks = [data]
+    else:
+        if schema is None:
+            raise ValueError("A schema is required when writing an iterable of chunks.")
+        chunks = data
+
+    rows = [0]
+
+    def batches():
+        for chunk in chunks:
+            if isinstance(chunk, pa.Table):
+                rows[0] += chunk.num_rows
+                yield from chunk.select(schema.names).to_batches()
+                continue
+            rows[0] += len(chunk)
+            yield from _table(pa, chunk, schema).to_batches()
+
+    if os.path.isdir(output_path):
+        shutil.rmtree(output_path)
+    ds.write_dataset(
+        batches(),
+        output_path,
+        schema=schema,
+        format=file_format,
+        file_options=write_options,
+        partitioning=ds.partitioning(pa.schema([schema.field(partition_column)]), flavor="hive"),
+        basename_template=f"part-{{i}}.{output_format}",
+    )
+    return rows[0]
+
+
+def write_arrow_file(chunks, path, schema):
+    """
+    Write DataFrame chunks to an Arrow IPC file with the given schema.
+
+    Returns:
+    - The number of rows written.
+    """
+    pa = _require_pyarrow()
+
+    rows = 0
+    with pa.ipc.new_file(path, schema) as writer:
+        for chunk in chunks:
+            writer.write_table(_table(pa, chunk, schema))
+            rows += len(chunk)
+    return rows
+
+
+def read_arrow_file(path):
+    """
+    Memory-map an Arrow IPC file written by write_arrow_file and return it as a pyarrow.Table.
+
+    The table's buffers point into the mapped file, so no data is copied or deserialized.
+    """
+    pa = _require_pyarrow()
+
+    return pa.ipc.open_file(pa.memory_map(path)).read_all()
+
+
+def _scalar_for(field_type, value):
+    import pandas as pd
+    import pyarrow as pa
+
+    if pa.types.is_timestamp(field_type):
+        return pa.scalar(pd.Timestamp(value).to_datetime64(), type=field_type)
+    if pa.types.is_date(field_type):
+        return pa.scalar(pd.Timestamp(value).date(), type=field_type)
+    return str(value)
+
+
+def _partitioning(ds, path):
+    # Partition values are read back as strings (e.g. fiscal_year=2024 stays "2024")
+    import pyarrow as pa
+
+    names = [entry.split("=", 1)[0] for entry in sorted(os.listdir(path)) if "=" in entry]
+    if not names:
+        return None
+    return ds.partitioning(pa.schema([pa.field(names[0], pa.string())]), flavor="hive")
+
+
+def _values(value):
+    return [value] if isinstance(value, str) else list(value)
+
+
+def dataset_columns(path, output_format="parquet"):
+    """
+    Return the column names of a columnar dataset, including its partition column.
+    """
+    _require_pyarrow()
+    import pyarrow.dataset as ds
+
+    file_format = "ipc" if output_format == "feather" else output_format
+    return ds.dataset(path, format=file_format, partitioning=_partitioning(ds, path)).schema.names
+
+
+def read_columnar(path, columns=None, date_range=None, organism=None, isolation_source=None,
+                  output_format="parquet", date_column="collection_date", organism_column="scientific_name",
+                  isolation_source_column="isolation_source", match=None, release=None, release_column="type"):
+    """
+    Read a columnar dataset, loading only the requested columns and matching rows.
+
+    Filters are pushed down to the dataset scanner, so partitions and row groups that
+    cannot match are skipped instead of being loaded and filtered in pandas.
+
+    Parameters:
+    - path: Dataset directory written by write_partitioned_dataset.
+    - columns: Optional list of columns to load. Defaults to all columns.
+    - date_range: Optional (start, end) tuple; either bound may be None. Bounds are inclusive.
+    - organism: Optional value or list of values of organism_column to keep (e.g. 'Salmonella enterica').
+    - isolation_source: Optional value or list of values of isolation_source_column to keep.
+    - output_format: 'parquet' or 'feather'.
+    - date_column: Column the date range applies to.
+    - organism_column: Column the organism filter applies to ('scientific_name' for NCBI metadata).
+    - isolation_source_column: Column the isolation source filter applies to.
+    - match: Optional dict mapping columns to lists of values; rows matching any of them are kept
+      (e.g. {'biosample_acc': [...], 'Run': [...]}).
+    - release: Optional value or list of values of release_column to keep. For NCBI metadata
+      this is the 'type' partition column, the PDG release number of each row's file (e.g. '3187').
+    - release_column: Column the release filter applies to.
+
+    Returns:
+    - A pandas DataFrame.
+    """
+    _require_pyarrow()
+    import pyarrow.dataset as ds
+
+    file_format = "ipc" if output_format == "feather" else output_format
+    dataset = ds.dataset(path, format=file_format, partitioning=_partitioning(ds, path))
+
+    expression = None
+    conditions = []
+    if date_range:
+        start, end = date_range
+        field_type = dataset.schema.field(date_column).type
+        if start is not None:
+            conditions.append(ds.field(date_column) >= _scalar_for(field_type, start))
+        if end is not None:
+            conditions.append(ds.field(date_column) <= _scalar_for(field_type, end))
+    if release is not None:
+        conditions.append(ds.field(release_column).isin(_values(release)))
+    if organism is not None:
+        conditions.append(ds.field(organism_column).isin(_values(organism)))
+    if isolation_source is not None:
+        conditions.append(ds.field(isolation_source_column).isin(_values(isolation_source)))
+    if match:
+        any_match = None
+        for column, values in match.items():
+            condition = ds.field(column).isin(_values(values))
+            any_match = condition if any_match is None else any_match | condition
+        conditions.append(any_match)
+    for condition in conditions:
+        expression = condition if expression is None else expression & condition
+
+    return dataset.to_table(columns=columns, filter=expression).to_pandas()
@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+
+import gzip
+import io
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+# Text codecs and the file name suffix each is chosen by
+SUFFIXES = {"gzip": ".gz", "zstd": ".zst"}
+TEXT_CODECS = tuple(SUFFIXES)
+GZIP_LEVEL = 6
+ZSTD_LEVEL = 3
+DEFAULT_THREADS = os.cpu_count() or 1
+
+
+def codec_for(path):
+    """
+    Return the text codec named by the suffix of path ('gzip' for .gz, 'zstd' for .zst), or None.
+    """
+    for codec, suffix in SUFFIXES.items():
+        if str(path).endswith(suffix):
+            return codec
+    return None
+
+
+def split_codec(path):
+    """
+    Split path into the name without its codec suffix and the suffix, e.g. ('a.tsv', '.gz').
+    """
+    codec = codec_for(path)
+    if codec is None:
+        return path, ""
+    return path[:-len(SUFFIXES[codec])], SUFFIXES[codec]
+
+
+def with_codec(path, codec):
+    """
+    Return path with the suffix of codec appended, unless it already has it. None leaves path as is.
+    """
+    if not codec or codec_for(path) == codec:
+        return path
+    if codec not in SUFFIXES:
+        raise ValueError(f"Unknown text compression '{codec}'. Expected one of {', '.join(TEXT_CODECS)}.")
+    return f"{path}{SUFFIXES[codec]}"
+
+
+def text_codec(compression, output_format=None):
+    """
+    Return the text codec of a --compression option, or None for columnar formats, whose
+    codec is applied by pyarrow, and for 'none'.
+    """
+    if output_format not in (None, "tsv", "csv") or compression in (None, "none"):
+        return None
+    if compression not in SUFFIXES:
+        raise ValueError(f"Unknown text compression '{compression}'. Expected one of {', '.join(TEXT_CODECS)}.")
+    return compression
+
+
+def _binary_mode(mode):
+    return mode.replace("t", "").replace("b", "") + "b"
+
+
+def _open_gzip(path, mode, threads):
+    binary_mode = _binary_mode(mode)
+    if threads > 1:
+        try:
+            from isal import igzip_threaded
+        except ImportError:
+            pass
+        else:
+            # python-isal compresses in a background thread pool
+            return igzip_threaded.open(path, binary_mode, threads=threads)
+    if "r" in binary_mode:
+        return gzip.open(path, binary_mode)
+    return gzip.open(path, binary_mode, compresslevel=GZIP_LEVEL)
+
+
+def _open_zstd(path, mode, threads):
+    try:
+        import zstandard
+    except ImportError as e:
+        raise ImportError("zstd files require zstandard. Install it with 'pip install zstandard'.") from e
+
+    binary_mode = _binary_mode(mode)
+    if "r" in binary_mode:
+        # The decompression reader does not split lines itself
+        return io.BufferedReader(zstandard.open(path, binary_mode))
+    compressor = zstandard.ZstdCompressor(level=ZSTD_LEVEL, threads=threads if threads > 1 else 0)
+    return zstandard.open(path, binary_mode, cctx=compressor)
+
+
+def open_file(path, mode="rt", codec=None, encoding="utf-8", newline=None, threads=DEFAULT_THREADS):
+    """
+    Open a file, compressing or decompressing it with gzip or zstd as named by its suffix.
+
+    Writing uses several threads where the codec allows it: zstd always (through
+    zstandard), gzip when python-isal is installed. Other files are opened with open.
+
+    Parameters:
+    - path: File path.
+    - mode: 'rt', 'wt', 'rb', 'wb', 'r' or 'w' ('r' and 'w' are text modes, as for open).
+    - codec: 'gzip' or 'zstd' to use regardless of the suffix, or None to go by the suffix.
+    - encoding, newline: As for open, in text mode. Text is UTF-8 regardless of the locale,
+      as pandas reads and writes it.
+    - threads: Compression threads.
+
+    Returns:
+    - A file object.
+    """
+    codec = codec or codec_for(path)
+    if codec is None:
+        return open(path, mode, encoding=encoding, newline=newline) if "b" not in mode else open(path, mode)
+    if codec == "gzip":
+        file = _open_gzip(path, mode, threads)
+    elif codec == "zstd":
+        file = _open_zstd(path, mode, threads)
+    else:
+        raise ValueError(f"Unknown text compression '{codec}'. Expected one of {', '.join(TEXT_CODECS)}.")
+    if "b" in mode:
+        return file
+    return io.TextIOWrapper(file, encoding=encoding, newline=newline)
+
@@ -0,0 +1,268 @@
+#!/usr/bin/env python3
+
+import json
+import logging
+import os
+import re
+import shutil
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows: the cache is only safe for concurrent threads of one process
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+CACHE_DIR_ENV = "OPENTRAKR_CACHE_DIR"
+CACHE_SIZE_ENV = "OPENTRAKR_CACHE_SIZE"
+DEFAULT_CACHE_SIZE = 20 * 1024 ** 3
+INDEX_NAME = "index.json"
+LOCK_NAME = ".lock"
+OBJECTS_NAME = "objects"
+
+# Linux ioctl cloning a whole file (a reflink) on copy-on-write filesystems such as Btrfs and XFS
+FICLONE = 0x40049409
+
+SIZE_PATTERN = re.compile(r"^\s*(\d+(?:\.\d+)?)\s*([KMGT]?)i?B?\s*$", re.IGNORECASE)
+SIZE_UNITS = {"": 1, "K": 1024, "M": 1024 ** 2, "G": 1024 ** 3, "T": 1024 ** 4}
+
+
+def parse_size(text):
+    """
+    Parse a size such as '500M', '20G' or '1048576' into bytes.
+    """
+    match = SIZE_PATTERN.match(str(text))
+    if not match:
+        raise ValueError(f"Invalid size '{text}'. Expected a number of bytes or e.g. 500M, 20G.")
+    return int(float(match.group(1)) * SIZE_UNITS[match.group(2).upper()])
+
+
+def _clone(source, destination):
+    # Reflink where the filesystem supports it, otherwise a plain copy
+    if fcntl is not None:
+        try:
+            with open(source, "rb") as src, open(destination, "wb") as dst:
+                fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+            return
+        except OSError:
+            pass
+    shutil.copyfile(source, destination)
+
+
+def link_or_copy(source, destination):
+    """
+    Make destination a hardlink to source, or a reflink or copy when they are on different filesystems.
+    """
+    try:
+        os.link(source, destination)
+    except OSError:
+        _clone(source, destination)
+
+
+def _replace_with(source, destination):
+    # Atomically put a link (or copy) of source at destination
+    tmp_path = f"{destination}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        link_or_copy(source, tmp_path)
+        os.replace(tmp_path, destination)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+class DownloadCache:
+    """
+    Content-addressed store of downloaded files shared by every workflow on a host.
+
+    Files are stored once under their SHA-256 and put into output folders as hardlinks
+    (reflinks or copies across filesystems), so pipelines downloading the same NCBI,
+    FSIS or FDA files keep one copy on disk. An index maps each URL to the hash of its
+    last download and the ETag and Last-Modified validators the server returned with it,
+    which lets a new output folder be filled with a conditional request instead of a
+    transfer. When the cache grows beyond max_size, the least recently used files are
+    evicted; copies already linked into output folders are not affected.
+
+    Every change to the cache is made under an exclusive lock on a file in the cache
+    directory, so processes sharing the cache do not corrupt it.
+
+    Parameters:
+    - directory: Cache directory.
+    - max_size: Size cap in bytes.
+    """
+
+    def __init__(self, directory, max_size=DEFAULT_CACHE_SIZE):
+        self.directory = directory
+        self.max_size = max_size
+        self.index_path = os.path.join(directory, INDEX_NAME)
+        self.lock_path = os.path.join(directory, LOCK_NAME)
+        self._thread_lock = threading.Lock()
+
+    def object_path(self, sha256):
+        return os.path.join(self.directory, OBJECTS_NAME, sha256[:2], sha256)
+
+    @contextmanager
+    def locked(self):
+        """
+        Hold the cache lock, shared by all threads and processes using this directory.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        with self._thread_lock, open(self.lock_path, "a") as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+    def _load(self):
+        if os.path.exists(self.index_path):
+            try:
+                with open(self.index_path) as file:
+                    index = json.load(file)
+                return {"objects": index.get("objects", {}), "urls": index.get("urls", {})}
+            except (OSError, ValueError) as e:
+                logger.warning(f"Ignoring unreadable cache index {self.index_path}: {e}")
+        return {"objects": {}, "urls": {}}
+
+    def _save(self, index):
+        tmp_path = f"{self.index_path}.tmp"
+        with open(tmp_path, "w") as file:
+            json.dump(index, file, indent=2, sort_keys=True)
+        os.replace(tmp_path, self.index_path)
+
+    def lookup(self, url):
+        """
+        Return the cache entry of url ({'sha256', 'etag', 'last_modified', 'size'}), or None
+        if it is not cached.
+        """
+        with self.locked():
+            index = self._load()
+        entry = index["urls"].get(url)
+        stored = index["objects"].get(entry["sha256"]) if entry else None
+        if not stored:
+            return None
+        path = self.object_path(entry["sha256"])
+        if not os.path.exists(path) or os.path.getsize(path) != stored["size"]:
+            return None
+        return dict(entry, size=stored["size"])
+
+    def materialize(self, sha256, file_path):
+        """
+        Put the cached file with this hash at file_path, mark it as recently used and evict
+        other files if the cache is over max_size.
+
+        Returns:
+        - True, or False if the file was evicted in the meantime.
+        """
+        with self.locked():
+            index = self._load()
+            stored = index["objects"].get(sha256)
+            path = self.object_path(sha256)
+            if not stored or not os.path.exists(path):
+                return False
+            _replace_with(path, file_path)
+            stored["last_used"] = time.time()
+            self._evict(index, keep=sha256)
+            self._save(index)
+        return True
+
+    def store(self, file_path, url, sha256, etag=None, last_modified=None):
+        """
+        Add a downloaded file to the cache under its hash and record it as the content of url.
+
+        If the cache already holds the same content, file_path is replaced by a link to it so
+        the two copies share their storage. Least recently used files are then evicted until
+        the cache fits in max_size.
+        """
+        path = self.object_path(sha256)
+        size = os.path.getsize(file_path)
+        with self.locked():
+            index = self._load()
+            if os.path.exists(path) and os.path.getsize(path) == size:
+                if not os.path.samefile(path, file_path):
+                    _replace_with(path, file_path)
+            else:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                _replace_with(file_path, path)
+            index["objects"][sha256] = {"size": size, "last_used": time.time()}
+            index["urls"][url] = {"sha256": sha256, "etag": etag, "last_modified": last_modified}
+            self._evict(index, keep=sha256)
+            self._save(index)
+
+    def _evict(self, index, keep=None):
+        objects = index["objects"]
+        for sha256 in [sha256 for sha256 in objects if not os.path.exists(self.object_path(sha256))]:
+            del objects[sha256]
+        total = sum(stored["size"] for stored in objects.values())
+        evicted = 0
+        for sha256 in sorted(objects, key=lambda sha256: objects[sha256]["last_used"]):
+            if total <= self.max_size:
+                break
+            if sha256 == keep:
+                continue
+            os.remove(self.object_path(sha256))
+            total -= objects.pop(sha256)["size"]
+            evicted += 1
+        index["urls"] = {url: entry for url, entry in index["urls"].items() if entry["sha256"] in objects}
+        if evicted:
+            logger.info(f"Evicted {evicted} files from the download cache {self.directory} ({total} bytes kept)")
+
+    def size(self):
+        """
+        Return the total size in bytes of the cached files.
+        """
+        with self.locked():
+            return sum(stored["size"] for stored in self._load()["objects"].values())
+
+
+# Cache used by download_utils.download_to_file; None disables caching
+_current = None
+_configured = False
+
+
+def configure(directory, max_size=DEFAULT_CACHE_SIZE):
+    """
+    Use a shared download cache in directory for this process, or disable caching if directory is None.
+
+    Returns:
+    - The DownloadCache, or None.
+    """
+    global _current, _configured
+    _current = DownloadCache(directory, max_size) if directory else None
+    _configured = True
+    return _current
+
+
+def current():
+    """
+    Return the download cache of this process. Unless configure was called, the cache is
+    set from the OPENTRAKR_CACHE_DIR and OPENTRAKR_CACHE_SIZE environment variables.
+    """
+    if not _configured:
+        size = os.environ.get(CACHE_SIZE_ENV)
+        configure(os.environ.get(CACHE_DIR_ENV), parse_size(size) if size else DEFAULT_CACHE_SIZE)
+    return _current
+
+
+def add_arguments(parser):
+    """
+    Add the --cache-dir and --cache-size options to a command-line parser.
+    """
+    group = parser.add_argument_group("download cache")
+    group.add_argument("--cache-dir", default=os.environ.get(CACHE_DIR_ENV),
+                       help=f"Shared cache of downloaded files, linked into the output folders. "
+                            f"Defaults to ${CACHE_DIR_ENV}; no cache if unset.")
+    group.add_argument("--cache-size", type=parse_size, default=os.environ.get(CACHE_SIZE_ENV, DEFAULT_CACHE_SIZE),
+                       help=f"Size cap of the cache, e.g. 500M or 20G; least recently used files are evicted "
+                            f"beyond it. Defaults to ${CACHE_SIZE_ENV} or 20G.")
+
+
+def configure_from_args(args):
+    """
+    Set up the download cache from the options added by add_arguments.
+    """
+    return configure(args.cache_dir, args.cache_size)
@@ -0,0 +1,517 @@
+#!/usr/bin/env python3
+
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+import zlib
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
+from urllib.parse import urlparse
+
+import requests
+import urllib3
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from opentrakr import download_cache, metrics
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_WORKERS = 1
+DEFAULT_PER_HOST = 4
+DEFAULT_RETRIES = 5
+DEFAULT_BACKOFF = 1.0
+DEFAULT_TIMEOUT = 60
+CHUNK_SIZE = 64 * 1024
+
+# Status codes worth retrying: throttling and transient server-side failures
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+
+
+def create_session(pool_size=DEFAULT_PER_HOST, retries=DEFAULT_RETRIES, backoff_factor=DEFAULT_BACKOFF):
+    """
+    Create a requests session with a shared connection pool and retry with exponential backoff.
+
+    Parameters:
+    - pool_size: Number of pooled connections kept open per host.
+    - retries: Number of retries for failed connections and retryable HTTP status codes.
+    - backoff_factor: Backoff factor between retries (sleeps backoff_factor * 2 ** retry seconds).
+
+    Returns:
+    - A configured requests.Session.
+    """
+    retry = Retry(
+        total=retries,
+        connect=retries,
+        read=retries,
+        status=retries,
+        backoff_factor=backoff_factor,
+        status_forcelist=RETRY_STATUS_CODES,
+        allowed_methods=frozenset(["HEAD", "GET"]),
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+    session = requests.Session()
+    # Listings and TSVs cross the wire gzip-compressed where the server supports it
+    session.headers["Accept-Encoding"] = "gzip"
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+class HostLimiter:
+    """
+    Limit the number of concurrent requests sent to any single host.
+    """
+
+    def __init__(self, per_host=DEFAULT_PER_HOST):
+        self.per_host = max(1, per_host)
+        self._lock = threading.Lock()
+        self._semaphores = {}
+
+    @contextmanager
+    def limit(self, url):
+        host = urlparse(url).netloc
+        with self._lock:
+            semaphore = self._semaphores.setdefault(host, threading.BoundedSemaphore(self.per_host))
+        with semaphore:
+            yield
+
+
+class DownloadSummary:
+    """
+    Thread-safe summary of a batch of downloads.
+    """
+
+    def __init__(self):
+        self.downloaded = []
+        self.skipped = []
+        self.failed = []
+        self.bytes_downloaded = 0
+        self.retries = 0
+        self.elapsed = 0.0
+        self._lock = threading.Lock()
+
+    def record_success(self, url, path, size, retries=0):
+        with self._lock:
+            self.downloaded.append(path)
+            self.bytes_downloaded += size
+            self.retries += retries
+
+    def record_skipped(self, url, path, retries=0):
+        with self._lock:
+            self.skipped.append(path)
+            self.retries += retries
+
+    def record_failure(self, url, reason, retries=0):
+        with self._lock:
+            self.failed.append((url, reason))
+            self.retries += retries
+
+    def update(self, other):
+        with self._lock:
+            self.downloaded.extend(other.downloaded)
+            self.skipped.extend(other.skipped)
+            self.failed.extend(other.failed)
+            self.bytes_downloaded += other.bytes_downloaded
+            self.retries += other.retries
+
+    @property
+    def ok(self):
+        return not self.failed
+
+    def __str__(self):
+        return (
+            f"{len(self.downloaded)} downloaded, {len(self.skipped)} unchanged, {len(self.failed)} failed, "
+            f"{self.bytes_downloaded} bytes, {self.retries} retries in {self.elapsed:.1f}s"
+        )
+
+
+def adapter_retries(response):
+    """
+    Return the number of retries the session's adapter made before it returned response.
+    """
+    retries = getattr(response.raw, "retries", None)
+    history = getattr(retries, "history", None)
+    return len(history) if history else 0
+
+
+def retry_transfer(error, attempt, retries=DEFAULT_RETRIES, backoff_factor=DEFAULT_BACKOFF):
+    """
+    Decide whether to make another attempt after a failed transfer, and wait before it.
+
+    HTTP error statuses are never retried here: the adapter of create_session has already
+    retried throttling and server errors (RETRY_STATUS_CODES) with backoff before returning
+    the response, and other statuses such as 404 will not go away. Connection, read and
+    truncated-body errors are retried up to retries times with exponential backoff.
+
+    Parameters:
+    - error: The requests.RequestException the attempt failed with.
+    - attempt: Number of attempts already retried (0 after the first failure).
+    - retries: Maximum number of retries.
+    - backoff_factor: Sleeps backoff_factor * 2 ** attempt seconds before the next attempt.
+
+    Returns:
+    - True if the caller should try again, False if it should raise error.
+    """
+    if isinstance(error, requests.HTTPError) or attempt >= retries:
+        return False
+    time.sleep(backoff_factor * (2 ** attempt))
+    return True
+
+
+def fetch_text(session, url, timeout=DEFAULT_TIMEOUT):
+    """
+    Fetch a text resource such as a directory listing.
+
+    Returns:
+    - The response text, or None if the request failed.
+    """
+    try:
+        response = session.get(url, timeout=timeout)
+    except requests.RequestException as e:
+        logger.warning(f"Failed to access {url}: {e}")
+        return None
+    if response.status_code != 200:
+        logger.warning(f"Failed to access {url}")
+        return None
+    metrics.count(bytes_downloaded=len(response.content), retries=adapter_retries(response))
+    return response.text
+
+
+# Outcome of download_to_file: bytes transferred, retries used and whether the
+# server reported the file as unchanged since the manifest entry was recorded
+DownloadResult = namedtuple("DownloadResult", ["transferred", "retries", "not_modified"])
+
+
+class DownloadVerificationError(requests.RequestException):
+    """
+    Raised when a downloaded file does not match its expected size or checksum.
+    """
+
+
+def _expected_total(response, offset):
+    # 206 responses carry the full size in Content-Range ("bytes 100-199/200")
+    if response.status_code == 206:
+        content_range = response.headers.get("Content-Range", "")
+        total = content_range.rpartition("/")[2]
+        return int(total) if total.isdigit() else None
+    length = response.headers.get("Content-Length")
+    return int(length) if length and length.isdigit() else None
+
+
+def _iter_body(response):
+    # Yield (bytes read from the connection, decoded data). A gzip body is decoded here rather
+    # than by urllib3, which does not count the compressed bytes of a chunked response.
+    if response.headers.get("Content-Encoding", "").lower() != "gzip":
+        for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+            yield len(chunk), chunk
+        return
+    decoder = zlib.decompressobj(zlib.MAX_WBITS | 16)
+    try:
+        for data in response.raw.stream(CHUNK_SIZE, decode_content=False):
+            yield len(data), decoder.decompress(data)
+    except urllib3.exceptions.HTTPError as e:
+        raise requests.exceptions.ChunkedEncodingError(e) from e
+    except zlib.error as e:
+        raise requests.exceptions.ContentDecodingError(e) from e
+    if not decoder.eof:
+        raise requests.exceptions.ChunkedEncodingError(f"Truncated gzip body from {response.url}")
+    yield 0, decoder.flush()
+
+
+def file_sha256(file_path, chunk_size=CHUNK_SIZE):
+    """
+    Compute the SHA-256 hex digest of a file without loading it into memory.
+    """
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as file:
+        for chunk in iter(lambda: file.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _if_range(etag, last_modified):
+    # If-Range needs a strong validator; a weak ETag (e.g. of a gzip-encoded response) never matches
+    if etag and not etag.startswith("W/"):
+        return etag
+    return last_modified
+
+
+def _load_part_validators(part_path, url):
+    # Validators of the response a .part file was started from, or None if it has none
+    try:
+        with open(f"{part_path}.json") as file:
+            stored = json.load(file)
+    except (OSError, ValueError):
+        return None
+    if stored.get("url") != url or not _if_range(stored.get("etag"), stored.get("last_modified")):
+        return None
+    return stored.get("etag"), stored.get("last_modified")
+
+
+def _save_part_validators(part_path, url, etag, last_modified):
+    validators_path = f"{part_path}.json"
+    if not _if_range(etag, last_modified):
+        if os.path.exists(validators_path):
+            os.remove(validators_path)
+        return
+    with open(validators_path, "w") as file:
+        json.dump({"url": url, "etag": etag, "last_modified": last_modified}, file)
+
+
+def _discard_part(part_path):
+    for path in (part_path, f"{part_path}.json"):
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def download_to_file(session, url, file_path, retries=DEFAULT_RETRIES, backoff_factor=DEFAULT_BACKOFF,
+                     timeout=DEFAULT_TIMEOUT, expected_sha256=None, manifest=None, force=False):
+    """
+    Stream a single URL to file_path, resuming with HTTP Range requests after an interruption.
+
+    Data is written in chunks to file_path + ".part", which is only renamed into place once
+    its size matches the size reported by the server (and expected_sha256, if given).
+    The ETag and Last-Modified of the response are kept in file_path + ".part.json", so a
+    .part file left behind by an earlier run is resumed with If-Range and restarted if the
+    remote file changed; a .part file without them is discarded.
+
+    Whole files are requested gzip-encoded and decoded on the fly, so text crosses the wire
+    compressed; the size check is then left to the gzip stream. Resumed transfers ask for
+    the unencoded file, since byte ranges refer to it.
+
+    When a manifest is given and file_path still matches its entry, the request is made
+    conditional (If-None-Match / If-Modified-Since) and an unchanged file is not transferred.
+
+    When a shared download cache is configured (see download_cache.configure), finished
+    files are added to it, and a file the cache already holds for url is linked from the
+    cache if a conditional request shows it is still current.
+
+    Parameters:
+    - session: The requests session to use.
+    - url: The URL to download.
+    - file_path: The local path to write.
+    - retries: Number of attempts made after an interrupted transfer. HTTP error statuses are
+      raised at once, once the session's adapter has given up (see retry_transfer).
+    - backoff_factor: Backoff factor between attempts.
+    - timeout: Connect/read timeout in seconds.
+    - expected_sha256: Optional SHA-256 hex digest the finished file must match.
+    - manifest: Optional DownloadManifest for the folder file_path is written to. The file is
+      recorded in it; the caller saves it (see DownloadManifest.save).
+    - force: Always transfer the file; the manifest is still updated afterwards.
+
+    Returns:
+    - A DownloadResult.
+
+    Raises:
+    - requests.RequestException (including DownloadVerificationError) if the download ultimately fails.
+    """
+    part_path = f"{file_path}.part"
+    start = time.perf_counter()
+    conditional = {}
+    if not force and manifest is not None and manifest.is_current(file_path, url) and not os.path.exists(part_path):
+        entry = manifest.get(file_path)
+        if entry.get("etag"):
+            conditional["If-None-Match"] = entry["etag"]
+        if entry.get("last_modified"):
+            conditional["If-Modified-Since"] = entry["last_modified"]
+    cache = download_cache.current()
+    cached = None
+    if cache is not None and not force and not conditional and not os.path.exists(part_path):
+        cached = cache.lookup(url)
+        if expected_sha256 and cached and cached["sha256"] != expected_sha256.lower():
+            cached = None
+        if cached and (cached["etag"] or cached["last_modified"]):
+            if cached["etag"]:
+                conditional["If-None-Match"] = cached["etag"]
+            if cached["last_modified"]:
+                conditional["If-Modified-Since"] = cached["last_modified"]
+        else:
+            cached = None
+
+    attempt = 0
+    used_retries = 0
+    transferred = 0
+    etag = last_modified = None
+    while True:
+        offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+        if offset:
+            validators = _load_part_validators(part_path, url)
+            if validators is None:
+                logger.info(f"Restarting {file_path}: {part_path} cannot be checked against the remote file")
+                _discard_part(part_path)
+                offset = 0
+            else:
+                etag, last_modified = validators
+        headers = {}
+        if offset:
+            # Ranges only line up with the file on disk when the body is not content-encoded
+            headers["Accept-Encoding"] = "identity"
+            headers["Range"] = f"bytes={offset}-"
+            headers["If-Range"] = _if_range(etag, last_modified)
+        else:
+            headers.update(conditional)
+        try:
+            with session.get(url, stream=True, timeout=timeout, headers=headers) as response:
+                used_retries += adapter_retries(response)
+                if response.status_code == 304 and cached and cache.materialize(cached["sha256"], file_path):
+                    if manifest is not None:
+                        manifest.record(file_path, url, etag=cached["etag"], last_modified=cached["last_modified"],
+                                        sha256=cached["sha256"])
+                    metrics.file_downloaded(file_path, url, 0, used_retries, time.perf_counter() - start, "cached")
+                    logger.debug(f"Linked {file_path} from the download cache")
+                    return DownloadResult(0, used_retries, False)
+                if response.status_code == 304 and cached:
+                    # Evicted since the lookup: fetch the whole file
+                    conditional = {}
+                    cached = None
+                    continue
+                if response.status_code == 304 and conditional:
+                    metrics.file_downloaded(file_path, url, 0, used_retries, time.perf_counter() - start, "unchanged")
+                    return DownloadResult(0, used_retries, True)
+                if response.status_code == 416:
+                    # The .part file is already complete or belongs to a different version
+                    total = response.headers.get("Content-Range", "").rpartition("/")[2]
+                    if not (total.isdigit() and int(total) == offset):
+                        _discard_part(part_path)
+                        continue
+                    expected = offset
+                    digest = None
+                else:
+                    response.raise_for_status()
+                    etag = response.headers.get("ETag")
+                    last_modified = response.headers.get("Last-Modified")
+                    if response.status_code != 206:
+                        offset = 0
+                    _save_part_validators(part_path, url, etag, last_modified)
+                    # Content-Length of an encoded body is its compressed size
+                    encoded = response.headers.get("Content-Encoding", "identity") not in ("", "identity")
+                    expected = None if encoded else _expected_total(response, offset)
+                    # Hash while writing; a resumed file is hashed up to the resume point first
+                    digest = hashlib.sha256()
+                    if offset:
+                        with open(part_path, "rb") as file:
+                            for chunk in iter(lambda: file.read(CHUNK_SIZE), b""):
+                                digest.update(chunk)
+                    with open(part_path, "ab" if offset else "wb") as file:
+                        for size, chunk in _iter_body(response):
+                            file.write(chunk)
+                            digest.update(chunk)
+                            transferred += size
+
+            size = os.path.getsize(part_path)
+            if expected is not None and size < expected:
+                raise requests.exceptions.ChunkedEncodingError(
+                    f"Incomplete download of {url}: {size} of {expected} bytes"
+                )
+            if expected is not None and size > expected:
+                _discard_part(part_path)
+                raise DownloadVerificationError(f"Size mismatch for {url}: {size} bytes, expected {expected}")
+            sha256 = digest.hexdigest() if digest is not None else file_sha256(part_path)
+            if expected_sha256 and sha256 != expected_sha256.lower():
+                _discard_part(part_path)
+                raise DownloadVerificationError(f"Checksum mismatch for {url}")
+
+            os.replace(part_path, file_path)
+            _discard_part(part_path)
+            if cache is not None:
+                try:
+                    cache.store(file_path, url, sha256, etag=etag, last_modified=last_modified)
+                except OSError as e:
+                    logger.warning(f"Could not add {file_path} to the download cache: {e}")
+            if manifest is not None:
+                manifest.record(file_path, url, etag=etag, last_modified=last_modified, sha256=sha256)
+            metrics.file_downloaded(file_path, url, transferred, used_retries, time.perf_counter() - start,
+                                    "downloaded")
+            return DownloadResult(transferred, used_retries, False)
+        except requests.RequestException as e:
+            if not retry_transfer(e, attempt, retries, backoff_factor):
+                metrics.file_downloaded(file_path, url, transferred, used_retries, time.perf_counter() - start,
+                                        "failed")
+                raise
+            attempt += 1
+            used_retries += 1
+
+
+def download_file(url, file_path, session=None, expected_sha256=None, manifest=None):
+    """
+    Stream a single URL to file_path with resume and verification.
+
+    Parameters:
+    - url: The URL to download.
+    - file_path: The local path to write.
+    - session: Optional requests session to reuse pooled connections.
+    - expected_sha256: Optional SHA-256 hex digest the finished file must match.
+    - manifest: Optional DownloadManifest used to skip an unchanged file; saved afterwards.
+
+    Returns:
+    - A DownloadResult.
+
+    Raises:
+    - requests.RequestException if the download ultimately fails.
+    """
+    os.makedirs(os.path.dirname(file_path) or ".", exist_ok=True)
+    try:
+        return download_to_file(session or create_session(), url, file_path, expected_sha256=expected_sha256,
+                                manifest=manifest)
+    finally:
+        if manifest is not None:
+            manifest.save()
+
+
+def download_many(jobs, workers=DEFAULT_WORKERS, per_host=DEFAULT_PER_HOST, session=None, summary=None,
+                  manifest=None, force=False):
+    """
+    Download many files concurrently over a shared, pooled session.
+
+    Parameters:
+    - jobs: Iterable of (url, file_path) tuples.
+    - workers: Number of concurrent download threads.
+    - per_host: Maximum number of concurrent requests to a single host.
+    - session: Optional shared session. One is created if not provided.
+    - summary: Optional DownloadSummary to add results to.
+    - manifest: Optional DownloadManifest used to skip unchanged files; saved when the batch ends.
+    - force: Transfer every file regardless of the manifest.
+
+    Returns:
+    - A DownloadSummary describing the batch.
+    """
+    session = session or create_session(pool_size=max(workers, per_host))
+    summary = summary or DownloadSummary()
+    limiter = HostLimiter(per_host)
+    start = time.time()
+
+    def run(url, file_path):
+        os.makedirs(os.path.dirname(file_path) or ".", exist_ok=True)
+        with limiter.limit(url):
+            return download_to_file(session, url, file_path, manifest=manifest, force=force)
+
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+            futures = {executor.submit(run, url, path): (url, path) for url, path in jobs}
+            for future in as_completed(futures):
+                url, path = futures[future]
+                try:
+                    result = future.result()
+                except (requests.RequestException, OSError) as e:
+                    summary.record_failure(url, str(e))
+                    logger.error(f"Failed to download {url}: {e}")
+                    continue
+                if result.not_modified:
+                    summary.record_skipped(url, path, result.retries)
+                    logger.info(f"{os.path.basename(path)} is unchanged; skipped")
+                else:
+                    summary.record_success(url, path, result.transferred, result.retries)
+                    logger.info(f"Downloaded {os.path.basename(path)} to {os.path.dirname(path)}")
+    finally:
+        # One manifest write for the whole batch
+        if manifest is not None:
+            manifest.save()
+
+    summary.elapsed += time.time() - start
+    return summary
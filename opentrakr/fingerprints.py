@@ -0,0 +1,295 @@
+#!/usr/bin/env python3
+
+import csv
+import hashlib
+import io
+import logging
+import os
+from collections import namedtuple
+
+from opentrakr import metrics
+from opentrakr.compression import codec_for, open_file
+
+logger = logging.getLogger(__name__)
+
+ACCESSION_COLUMN = "target_acc"
+CLUSTER_COLUMN = "PDS_acc"
+LABEL_COLUMN = "type"
+FINGERPRINT_SUFFIX = ".fingerprints.tsv"
+FINGERPRINT_COLUMNS = ("target_acc", "type", "PDS_acc", "digest", "offset", "length")
+DIFF_COLUMNS = ("change", "target_acc", "type", "old_PDS_acc", "new_PDS_acc")
+CHANGES = ("added", "removed", "changed", "reassigned")
+BLANK_RECORDS = (b"\n", b"\r\n", b"\r")
+
+# One row of a table: its accession, organism label, SNP cluster and content digest, plus
+# the byte offset and length of the row in the merged output (None for other tables)
+Fingerprint = namedtuple("Fingerprint", ["accession", "label", "cluster", "digest", "offset", "length"])
+
+# One isolate that differs between two snapshots; 'reassigned' is a change of SNP cluster
+Change = namedtuple("Change", ["change", "accession", "label", "old_cluster", "new_cluster"])
+
+
+def fingerprint_path(output_file):
+    """
+    Return the path of the fingerprints kept next to a merged output.
+    """
+    return f"{output_file}{FINGERPRINT_SUFFIX}"
+
+
+def iter_records(file):
+    """
+    Yield the records of a tab-delimited file opened in binary mode, header first.
+
+    Records are split on line ends outside quoted fields, so a value holding a newline
+    (written quoted by pandas and the csv module) stays in its record.
+    """
+    pending = b""
+    for line in file:
+        pending += line
+        if pending.count(b'"') % 2 == 0:
+            yield pending
+            pending = b""
+    if pending:
+        yield pending
+
+
+def is_blank(record):
+    """
+    Return True for an empty line, which pandas and the csv module skip rather than read as a row.
+    """
+    return record in BLANK_RECORDS
+
+
+def record_fields(record):
+    """
+    Split one record into its values. Only records with quotes need the csv module.
+    """
+    if b'"' in record:
+        return next(csv.reader(io.StringIO(record.decode(), newline=""), delimiter="\t"), [])
+    return record.rstrip(b"\r\n").decode().split("\t")
+
+
+def fingerprint_records(file, label=None):
+    """
+    Fingerprint the records of a tab-delimited file.
+
+    The digest of a row is a hash of its raw bytes keyed with the file's header, so two
+    rows share a digest when they hold the same values under the same columns. Hashing the
+    raw record rather than its parsed values keeps this close to the speed of reading the
+    file; only the accession, cluster and label are parsed out.
+
+    The label is left out of the digest: it is taken from the file name, which carries the
+    PDG release number, so the same row in two releases keeps its digest. For the same
+    reason the 'type' column of a merged output is not hashed.
+
+    Parameters:
+    - file: File opened in binary mode.
+    - label: Label the merge adds to every row (see ncbi_tsv_merge.type_label). If None,
+      the label is read from the rows' own 'type' column, as in a merged output.
+
+    Returns:
+    - The header record and an iterator of (record, Fingerprint) per row; blank lines are skipped.
+    """
+    records = iter_records(file)
+    header = next(records, b"")
+    key = hashlib.blake2b(header.rstrip(b"\r\n"), digest_size=32).digest()
+    positions = {name: index for index, name in enumerate(record_fields(header) if header else [])}
+    # Only three values are needed, so quote-free records are split as bytes and only those are decoded
+    wanted = [positions.get(ACCESSION_COLUMN), positions.get(CLUSTER_COLUMN),
+              None if label is not None else positions.get(LABEL_COLUMN)]
+    width = max((index for index in wanted if index is not None), default=-1) + 1
+    unhashed = wanted[2]
+
+    def pick(values, index):
+        return values[index] if index is not None and index < len(values) else ""
+
+    def rows():
+        blake2b = hashlib.blake2b
+        for record in records:
+            if record in BLANK_RECORDS:
+                continue
+            hashed = record
+            if b'"' in record:
+                values = record_fields(record)
+                accession, cluster, row_label = (pick(values, index) for index in wanted)
+                if unhashed is not None:
+                    hashed = "\t".join(values[:unhashed] + values[unhashed + 1:]).encode()
+            else:
+                values = record.rstrip(b"\r\n").split(b"\t", width)
+                accession, cluster, row_label = (pick(values, index).decode() if index is not None else ""
+                                                 for index in wanted)
+                if unhashed is not None:
+                    values = record.rstrip(b"\r\n").split(b"\t")
+                    hashed = b"\t".join(values[:unhashed] + values[unhashed + 1:])
+            digest = blake2b(hashed, digest_size=16, key=key).hexdigest()
+            yield record, Fingerprint(accession, row_label if label is None else label, cluster, digest, None, None)
+
+    return header, rows()
+
+
+def iter_fingerprints(filepaths, label_value=None):
+    """
+    Fingerprint every row of tab-delimited files.
+
+    Parameters:
+    - filepaths: Paths of the files, e.g. *.metadata.tsv files or a merged output.
+    - label_value: Optional function giving the label of a file's rows from its name, for
+      files without a 'type' column (see fingerprint_records).
+
+    Yields:
+    - A Fingerprint per row, in file order.
+    """
+    for filepath in filepaths:
+        label = label_value(os.path.basename(filepath)) if label_value else None
+        rows = 0
+        with open_file(filepath, "rb") as file:
+            _, fingerprints = fingerprint_records(file, label)
+            for _, fingerprint in fingerprints:
+                rows += 1
+                yield fingerprint
+        metrics.file_read(filepath, rows)
+
+
+def record_spans(output_file):
+    """
+    Return the (offset, length) of each data record of a tab-delimited file, skipping the header.
+    """
+    spans = []
+    with open(output_file, "rb") as file:
+        offset = 0
+        for index, record in enumerate(iter_records(file)):
+            if index and not is_blank(record):
+                spans.append((offset, len(record)))
+            offset += len(record)
+    return spans
+
+
+def write_fingerprints(path, fingerprints):
+    """
+    Write fingerprints to a tab-delimited file, replacing it atomically.
+
+    Accessions, labels, clusters and digests never hold tabs or newlines, so rows are
+    written without quoting.
+
+    Returns:
+    - The number of fingerprints written.
+    """
+    tmp_path = f"{path}.tmp"
+    count = 0
+    with open(tmp_path, "w") as file:
+        file.write("\t".join(FINGERPRINT_COLUMNS) + "\n")
+        for accession, label, cluster, digest, offset, length in fingerprints:
+            offset = "" if offset is None else offset
+            length = "" if length is None else length
+            file.write(f"{accession}\t{label}\t{cluster}\t{digest}\t{offset}\t{length}\n")
+            count += 1
+    os.replace(tmp_path, path)
+    return count
+
+
+def read_fingerprints(path):
+    """
+    Yield the Fingerprints stored by write_fingerprints.
+    """
+    with open(path) as file:
+        next(file, None)
+        for line in file:
+            accession, label, cluster, digest, offset, length = line.rstrip("\n").split("\t")
+            yield Fingerprint(accession, label, cluster, digest, int(offset) if offset else None,
+                              int(length) if length else None)
+
+
+def fingerprint_output(filepaths, output_file, label_value):
+    """
+    Fingerprint the rows of a merged output from its input files and write them next to it.
+
+    The merge writes the input rows in order, so the n-th input row is the n-th record of
+    the output; its offset and length are stored with its fingerprint so that a later
+    incremental merge can copy unchanged rows from the output without parsing them.
+
+    Returns:
+    - The path of the fingerprints, or None if the output and its inputs do not line up.
+    """
+    spans = record_spans(output_file)
+    extra_rows = []
+
+    def with_spans():
+        for index, fingerprint in enumerate(iter_fingerprints(filepaths, label_value)):
+            if index >= len(spans):
+                extra_rows.append(fingerprint)
+                return
+            yield fingerprint[:4] + spans[index]
+
+    path = fingerprint_path(output_file)
+    count = write_fingerprints(path, with_spans())
+    if extra_rows or count != len(spans):
+        logger.warning(f"{output_file} does not line up with its inputs; incremental updates will rebuild it")
+        os.remove(path)
+        return None
+    return path
+
+
+def fingerprint_map(fingerprints):
+    """
+    Map each accession to its (label, cluster, digest). Rows without an accession are left out
+    and a repeated accession keeps its last row.
+    """
+    return {
+        fingerprint[0]: (fingerprint[1], fingerprint[2], fingerprint[3])
+        for fingerprint in fingerprints
+        if fingerprint[0]
+    }
+
+
+def diff_fingerprints(old, new):
+    """
+    Compare two snapshots mapped by fingerprint_map.
+
+    Digests depend on a table's columns, so when a release adds, removes or reorders
+    columns in a table, every isolate of that table is reported as changed.
+
+    Yields:
+    - A Change for every isolate added, removed or changed, in the order of new and then old.
+      Changed isolates whose SNP cluster differs are reported as 'reassigned'.
+    """
+    for accession, (label, cluster, digest) in new.items():
+        previous = old.get(accession)
+        if previous is None:
+            yield Change("added", accession, label, "", cluster)
+        elif previous[2] != digest:
+            change = "reassigned" if previous[1] != cluster else "changed"
+            yield Change(change, accession, label, previous[1], cluster)
+    for accession, (label, cluster, _) in old.items():
+        if accession not in new:
+            yield Change("removed", accession, label, cluster, "")
+
+
+def write_diff(changes, path):
+    """
+    Write Changes to a tab-delimited file, compressed if path ends with .gz or .zst.
+
+    Returns:
+    - A dict with the number of isolates per kind of change.
+    """
+    summary = dict.fromkeys(CHANGES, 0)
+    tmp_path = f"{path}.tmp"
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open_file(tmp_path, "wt", codec=codec_for(path), newline="") as file:
+        writer = csv.writer(file, delimiter="\t", lineterminator="\n")
+        writer.writerow(DIFF_COLUMNS)
+        for change in changes:
+            writer.writerow(change)
+            summary[change.change] += 1
+    os.replace(tmp_path, path)
+    metrics.file_written(path, sum(summary.values()))
+    return summary
+
+
+def summarize(changes):
+    """
+    Count Changes by kind without writing them.
+    """
+    summary = dict.fromkeys(CHANGES, 0)
+    for change in changes:
+        summary[change.change] += 1
+    return summary
@@ -1,14 +1,24 @@
 import os
+import csv
 import time
 import json
-import pandas as pd
+import logging
 import argparse
-import subprocess
 import glob
+import shutil
+import zipfile
 import requests
-from selenium import webdriver
-from selenium.webdriver.firefox.service import Service
-from selenium.webdriver.firefox.options import Options
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from opentrakr import download_cache, metrics
+from opentrakr.columnar import DEFAULT_COMPRESSION, FORMATS, write_partitioned_dataset
+from opentrakr.compression import SUFFIXES, open_file, split_codec, text_codec, with_codec
+from opentrakr.download_utils import create_session, download_to_file, file_sha256
+from opentrakr.manifest import DownloadManifest
+from opentrakr.pipeline import StageRunner
+from opentrakr.schemas import FSIS_ACCESSION_COLUMNS, FSIS_PRIMARY, FSIS_SECONDARY, concat_frames
+
+logger = logging.getLogger(__name__)
 
 # Shared list of file names to download
 file_names = [
@@ -25,31 +35,197 @@ file_names = [
     "raw_poultry_sampling_data_fy2014.zip",
 ]
 
-def download_files_requests(output_folder):
-    base_url = "https://www.fsis.usda.gov/sites/default/files/media_file/documents/"
-    os.makedirs(output_folder, exist_ok=True)
+BASE_URL = "https://www.fsis.usda.gov/sites/default/files/media_file/documents/"
+
+def csv_name(base_name, codec=None):
+    """
+    Return the CSV file name for base_name, with the .gz or .zst suffix of codec ('gzip' or 'zstd').
+    """
+    return with_codec(f"{base_name}.csv", codec)
+
+def extract_json_members(zip_path, output_folder):
+    """
+    Extract only the JSON members of an FSIS archive into output_folder.
+
+    Parameters:
+    - zip_path: Path of the downloaded zip archive.
+    - output_folder: Folder to extract the JSON files to.
+
+    Returns:
+    - The paths of the extracted JSON files.
+    """
+    extracted = []
+    with zipfile.ZipFile(zip_path) as archive:
+        for member in _json_members(archive):
+            target = os.path.join(output_folder, os.path.basename(member.filename))
+            with archive.open(member) as source, open(target, "wb") as destination:
+                shutil.copyfileobj(source, destination, 1024 * 1024)
+            metrics.file_written(target)
+            extracted.append(target)
+            logger.info(f"Extracted {member.filename} to {output_folder}")
+    return extracted
+
+def process_zip_archive(zip_path, output_folder, streaming=False, codec=None):
+    """
+    Process the JSON members of an FSIS archive straight from the zip, without extracting them to disk.
+
+    Parameters:
+    - zip_path: Path of the downloaded zip archive.
+    - output_folder: Folder to write the CSV files to.
+    - streaming: Stream the record arrays with ijson instead of loading whole documents.
+    - codec: Compress the CSV files with 'gzip' or 'zstd'.
+
+    Returns:
+    - A dict mapping each JSON member name to its process_json_file result.
+    """
+    results = {}
+    with zipfile.ZipFile(zip_path) as archive:
+        for member in _json_members(archive):
+            name = os.path.basename(member.filename)
+            results[name] = process_json_file(
+                name, output_folder, streaming, opener=lambda member=member: archive.open(member), codec=codec
+            )
+    return results
+
+def _json_members(archive):
+    return [
+        member for member in archive.infolist()
+        if not member.is_dir() and member.filename.endswith(".json")
+    ]
+
+def _archive_processed(zip_path, output_folder, codec=None):
+    # True when every JSON member of an unchanged archive already has its primary table CSV
+    try:
+        with zipfile.ZipFile(zip_path) as archive:
+            names = [os.path.splitext(os.path.basename(m.filename))[0] for m in _json_members(archive)]
+    except (OSError, zipfile.BadZipFile):
+        return False
+    return all(os.path.exists(os.path.join(output_folder, csv_name(f"{name}_primary_table", codec))) for name in names)
+
+class _ArchivePipeline:
+    """
+    Hand each downloaded archive to the next stage while the following download runs.
+
+    Without processing, JSON members are extracted in-process (unless extract is False, when
+    the archives are left for the in-memory pipeline). With processing, archives are submitted
+    to a process pool that reads the JSON members straight from the zip.
+    """
+
+    def __init__(self, output_folder, process=False, streaming=False, workers=1, runner=None, extract=True,
+                 codec=None):
+        self.output_folder = output_folder
+        self.extract = extract
+        self.streaming = streaming
+        self.codec = codec
+        self.params = {"streaming": streaming}
+        if codec:
+            self.params["compression"] = codec
+        self.runner = runner
+        self.executor = ProcessPoolExecutor(max_workers=max(1, workers)) if process else None
+        self.futures = {}
 
-    for file_name in file_names:
-        file_url = f"{base_url}{file_name}"
-        output_path = os.path.join(output_folder, file_name)
-        print(f"Downloading {file_url} to {output_path}")
+    def submit(self, zip_path, unchanged=False):
+        if self.executor is None:
+            if self.extract and not unchanged:
+                extract_json_members(zip_path, self.output_folder)
+            return
+        if self.runner is not None:
+            # Each fiscal year is its own stage, so only changed years are reprocessed
+            stage = f"process:{os.path.basename(zip_path)}"
+            if not self.runner.selected(stage):
+                return
+            if self.runner.is_current(stage, [zip_path], self.params):
+                logger.info(f"Stage {stage}: up to date")
+                metrics.skip(stage, "up to date")
+                return
+            logger.info(f"Stage {stage}: running")
+        elif unchanged and _archive_processed(zip_path, self.output_folder, self.codec):
+            return
+        future = self.executor.submit(process_zip_archive, zip_path, self.output_folder, self.streaming, self.codec)
+        self.futures[future] = zip_path
+
+    def finish(self):
+        results = {}
+        if self.executor is None:
+            return results
         try:
-            response = requests.get(file_url, stream=True)
-            response.raise_for_status()
-            with open(output_path, "wb") as f:
-                for chunk in response.iter_content(chunk_size=8192):
-                    f.write(chunk)
-            print(f"{file_name} downloaded successfully.")
-            # Unzip the file
-            subprocess.run(["unzip", "-o", output_path, "-d", output_folder])
-        except requests.RequestException as e:
-            print(f"Failed to download {file_name}: {e}")
+            for future in as_completed(self.futures):
+                zip_path = self.futures[future]
+                try:
+                    archive_results = future.result()
+                except Exception as e:
+                    logger.error(f"Error processing {zip_path}: {e}")
+                    continue
+                results.update(archive_results)
+                metrics.file_read(zip_path)
+                _record_written(archive_results)
+                if self.runner is not None:
+                    outputs = [path for tables in archive_results.values() for path, _ in tables.values()]
+                    self.runner.record(f"process:{os.path.basename(zip_path)}", [zip_path], outputs, self.params)
+        finally:
+            self.executor.shutdown()
+        return results
+
+def download_files_requests(output_folder, base_url=BASE_URL, force=False, process=False, streaming=False,
+                            workers=1, runner=None, extract=True, codec=None):
+    """
+    Download the FSIS archives and extract or process each one while the next is downloading.
+
+    Parameters:
+    - output_folder: Folder for the downloaded archives and extracted or processed files.
+    - base_url: URL prefix of the archives.
+    - force: Re-download archives even if they are unchanged since the last run.
+    - process: Process the JSON members straight from each archive into the per-year CSV files
+      instead of extracting them.
+    - streaming: Stream the record arrays with ijson when processing.
+    - workers: Number of worker processes used for processing.
+    - runner: Optional pipeline.StageRunner used to skip fiscal years that are already processed.
+    - extract: Extract the JSON members when not processing. Disable to keep only the archives.
+    - codec: Compress the processed CSV files with 'gzip' or 'zstd'.
+
+    Returns:
+    - A dict mapping each processed JSON file name to its process_json_file result.
+    """
+    os.makedirs(output_folder, exist_ok=True)
+    session = create_session()
+    # Archives for past fiscal years never change; the manifest lets them be skipped
+    manifest = DownloadManifest(output_folder)
+    pipeline = _ArchivePipeline(output_folder, process, streaming, workers, runner, extract, codec)
+
+    try:
+        for file_name in file_names:
+            file_url = f"{base_url}{file_name}"
+            output_path = os.path.join(output_folder, file_name)
+            logger.info(f"Downloading {file_url} to {output_path}")
+            try:
+                result = download_to_file(session, file_url, output_path, manifest=manifest, force=force)
+            except requests.RequestException as e:
+                logger.error(f"Failed to download {file_name}: {e}")
+                continue
+            if result.not_modified:
+                logger.info(f"{file_name} is unchanged; skipping download.")
+            else:
+                logger.info(f"{file_name} downloaded successfully.")
+            pipeline.submit(output_path, unchanged=result.not_modified)
+    finally:
+        manifest.save()
+        results = pipeline.finish()
+    return results
 
 
 # Function to download files using Firefox
-def download_files_firefox(output_folder, geckodriver_path=None):
-    base_url = "https://www.fsis.usda.gov/sites/default/files/media_file/documents/"
+def download_files_firefox(output_folder, geckodriver_path=None, base_url=BASE_URL, process=False, streaming=False,
+                           workers=1, runner=None, extract=True, codec=None):
+    try:
+        from selenium import webdriver
+        from selenium.webdriver.firefox.options import Options
+        from selenium.webdriver.firefox.service import Service
+    except ImportError as e:
+        raise ImportError("Firefox downloads require selenium. Install it with 'pip install selenium' "
+                          "or use the requests download method.") from e
+
     os.makedirs(output_folder, exist_ok=True)
+    pipeline = _ArchivePipeline(output_folder, process, streaming, workers, runner, extract, codec)
 
     options = Options()
     options.set_preference("browser.download.folderList", 2)
@@ -66,12 +242,12 @@ def download_files_firefox(output_folder, geckodriver_path=None):
 
         for file_name in file_names:
             file_url = f"{base_url}{file_name}"
-            print(f"Downloading {file_url} to {os.path.abspath(output_folder)}")
+            logger.info(f"Downloading {file_url} to {os.path.abspath(output_folder)}")
             try:
                 driver.set_page_load_timeout(10)
                 driver.get(file_url)
             except Exception as e:
-                print(f"Page load timed out for {file_name}: {e}")
+                logger.warning(f"Page load timed out for {file_name}: {e}")
 
             file_path = os.path.join(output_folder, file_name)
             timeout = 10
@@ -79,217 +255,747 @@ def download_files_firefox(output_folder, geckodriver_path=None):
 
             while not os.path.exists(file_path):
                 if time.time() - start_time > timeout:
-                    print(f"Download did not complete for {file_name} within the expected time.")
+                    logger.warning(f"Download did not complete for {file_name} within the expected time.")
                     break
                 time.sleep(1)
 
             if os.path.exists(file_path):
-                print(f"{file_name} downloaded successfully.")
-                subprocess.run(["unzip", "-o", file_path, "-d", output_folder])
+                metrics.file_downloaded(file_path, file_url, os.path.getsize(file_path), 0,
+                                        time.time() - start_time, "downloaded")
+                cache = download_cache.current()
+                if cache is not None:
+                    # Browser downloads carry no validators, so the cache only shares their storage
+                    try:
+                        cache.store(file_path, file_url, file_sha256(file_path))
+                    except OSError as e:
+                        logger.warning(f"Could not add {file_path} to the download cache: {e}")
+                logger.info(f"{file_name} downloaded successfully.")
+                pipeline.submit(file_path)
             else:
-                print(f"{file_name} failed to download.")
+                logger.error(f"{file_name} failed to download.")
     except Exception as e:
-        print(f"An error occurred: {e}")
+        logger.error(f"An error occurred: {e}")
     finally:
         if driver:
             driver.quit()
-        print("WebDriver session closed.")
+        logger.info("WebDriver session closed.")
+        results = pipeline.finish()
+    return results
+
+def process_json_file(file_path, output_folder, streaming=False, opener=None, codec=None):
+    """
+    Extract the primary and secondary tables of one FSIS JSON file to CSV.
+
+    Parameters:
+    - file_path: Path of the JSON file.
+    - output_folder: Folder to write the CSV files to.
+    - streaming: Stream the record arrays with ijson instead of loading the whole document.
+    - opener: Optional callable returning a binary file object for the JSON (e.g. a zip member).
+    - codec: Compress the CSV files with 'gzip' or 'zstd'.
+
+    Returns:
+    - A dict mapping 'primary_table'/'secondary_table' to (csv_path, rows) for each table written.
+    """
+    file_name = os.path.basename(file_path)
+    if streaming:
+        logger.info(f"Streaming tables from JSON file: {file_path}")
+        return stream_primary_and_secondary_tables(file_path, output_folder, opener=opener, codec=codec)
+
+    logger.info(f"Processing JSON file: {file_path}")
+    with (opener() if opener else open(file_path, "rb")) as file:
+        data = json.load(file)
+    extracted_tables = extract_tables_from_list(data)
+    del data
+    if not extracted_tables:
+        logger.warning(f"No tables extracted from {file_name}.")
+    else:
+        logger.debug(f"Extracted tables from {file_name}: {list(extracted_tables.keys())}")
+    return process_primary_and_secondary_tables_per_file({file_name: extracted_tables}, output_folder, codec)[file_name]
+
+def is_fsis_json(file_name):
+    """
+    Return True for an FSIS JSON file name. Hidden files such as the download manifest and the
+    <file>.part.json validators of interrupted downloads (see download_to_file) are not FSIS data.
+    """
+    return file_name.endswith(".json") and not file_name.startswith(".") and not file_name.endswith(".part.json")
+
+def process_json_files(folder_path, streaming=False, workers=1, codec=None):
+    """
+    Extract the primary and secondary tables of every JSON file in folder_path to CSV.
+
+    Files are processed one at a time, or by a pool of worker processes when workers > 1.
+    Each fiscal-year file is parsed and written by a single worker and only a small
+    summary is returned to the parent, so peak memory is one file per worker.
+
+    Parameters:
+    - folder_path: Folder containing the JSON files; CSV files are written alongside them.
+    - streaming: Stream the record arrays with ijson instead of loading whole documents.
+    - workers: Number of worker processes.
+    - codec: Compress the CSV files with 'gzip' or 'zstd'.
 
-def process_json_files(folder_path):
+    Returns:
+    - A dict mapping each JSON file name to its process_json_file result.
+    """
     if not os.path.exists(folder_path):
-        print(f"Directory does not exist: {folder_path}")
-        return
+        logger.warning(f"Directory does not exist: {folder_path}")
+        return {}
 
-    tables_per_file = {}
-    for file_name in os.listdir(folder_path):
-        if file_name.endswith(".json"):
-            file_path = os.path.join(folder_path, file_name)
-            print(f"Processing JSON file: {file_path}")
-            with open(file_path, "r") as file:
-                data = json.load(file)
-                extracted_tables = extract_tables_from_list(data)
-                if not extracted_tables:
-                    print(f"No tables extracted from {file_name}.")
-                else:
-                    print(f"Extracted tables from {file_name}: {list(extracted_tables.keys())}")
-                tables_per_file[file_name] = extracted_tables
+    file_paths = [
+        os.path.join(folder_path, file_name)
+        for file_name in sorted(os.listdir(folder_path))
+        if is_fsis_json(file_name)
+    ]
+
+    results = {}
+    if workers > 1 and len(file_paths) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = {
+                executor.submit(process_json_file, file_path, folder_path, streaming, codec=codec): file_path
+                for file_path in file_paths
+            }
+            for future in as_completed(futures):
+                file_name = os.path.basename(futures[future])
+                try:
+                    results[file_name] = future.result()
+                except Exception as e:
+                    logger.error(f"Error processing {file_name}: {e}")
+    else:
+        for file_path in file_paths:
+            results[os.path.basename(file_path)] = process_json_file(file_path, folder_path, streaming, codec=codec)
+
+    for file_name in sorted(results):
+        metrics.file_read(os.path.join(folder_path, file_name))
+        for table, (csv_path, rows) in sorted(results[file_name].items()):
+            logger.info(f"{file_name}: {rows} {table} rows in {csv_path}")
+    _record_written(results)
+    return results
+
+def _record_written(results):
+    # Record the CSV files reported by process_json_file, which may have run in a worker process
+    for tables in results.values():
+        for csv_path, rows in tables.values():
+            metrics.file_written(csv_path, rows)
+
+
+# Record arrays used from each FSIS JSON file, and the CSV suffix each is written to
+TABLE_KEYS = {
+    "primary_table_data": "primary_table",
+    "secondary_table_data": "secondary_table",
+}
 
-    # Process the extracted tables for primary and secondary CSV files
-    if tables_per_file:
-        print("Processing primary and secondary tables...")
-        process_primary_and_secondary_tables_per_file(tables_per_file, folder_path)
+def _iter_table_events(file, ijson):
+    # Yield (table_key, prefix, event, value) for parser events inside the record arrays
+    # of the first top-level item (the list_item_0_data table of the non-streaming path)
+    table_prefixes = [(key, f"item.data.{key}") for key in TABLE_KEYS]
+    item_index = -1
+    for prefix, event, value in ijson.parse(file, use_float=True):
+        if prefix == "item" and event not in ("end_map", "end_array", "map_key"):
+            item_index += 1
+            if item_index > 0:
+                break
+        for key, table_prefix in table_prefixes:
+            if prefix == table_prefix or prefix.startswith(f"{table_prefix}."):
+                yield key, prefix, event, value
+                break
 
+def stream_primary_and_secondary_tables(file_path, output_folder, base_file_name=None, opener=None, codec=None):
+    """
+    Stream the primary and secondary record arrays of an FSIS JSON file straight to CSV.
 
+    Only data.primary_table_data and data.secondary_table_data of the first top-level item
+    are materialized, one record at a time, so memory stays bounded regardless of file size.
+    The file is read twice: once to collect the column names and once to write the rows.
+
+    Parameters:
+    - file_path: Path of the JSON file.
+    - output_folder: Folder to write <base_file_name>_primary_table.csv and _secondary_table.csv to.
+    - base_file_name: Base name of the CSV files. Defaults to the JSON file name without extension.
+    - opener: Optional callable returning a new binary file object for the JSON (e.g. a zip member).
+    - codec: Compress the CSV files with 'gzip' or 'zstd'.
+
+    Returns:
+    - A dict mapping 'primary_table'/'secondary_table' to (csv_path, rows) for each table written.
+    """
+    try:
+        import ijson
+    except ImportError as e:
+        raise ImportError("Streaming JSON extraction requires ijson. Install it with 'pip install ijson'.") from e
+
+    opener = opener or (lambda: open(file_path, "rb"))
+    base_file_name = base_file_name or os.path.splitext(os.path.basename(file_path))[0]
+    record_prefixes = {f"item.data.{key}.item": key for key in TABLE_KEYS}
+    os.makedirs(output_folder, exist_ok=True)
+
+    # First pass: column names in order of first appearance, as pd.DataFrame(records) would use
+    columns = {}
+    with opener() as file:
+        for key, prefix, event, value in _iter_table_events(file, ijson):
+            columns.setdefault(key, {})
+            if event == "map_key" and record_prefixes.get(prefix) == key:
+                columns[key].setdefault(value, None)
+
+    # Second pass: build one record at a time and write it out
+    written = {}
+    handles, writers = {}, {}
+    try:
+        for key in columns:
+            csv_path = os.path.join(output_folder, csv_name(f"{base_file_name}_{TABLE_KEYS[key]}", codec))
+            handles[key] = open_file(csv_path, "wt", newline="")
+            writers[key] = csv.DictWriter(handles[key], fieldnames=list(columns[key]), restval="", lineterminator="\n")
+            writers[key].writeheader()
+            written[TABLE_KEYS[key]] = [csv_path, 0]
+
+        builders = {}
+        with opener() as file:
+            for key, prefix, event, value in _iter_table_events(file, ijson):
+                at_record = record_prefixes.get(prefix) == key
+                if at_record and event == "start_map":
+                    builders[key] = ijson.ObjectBuilder()
+                builder = builders.get(key)
+                if builder is None:
+                    continue
+                builder.event(event, value)
+                if at_record and event == "end_map":
+                    writers[key].writerow(builder.value)
+                    written[TABLE_KEYS[key]][1] += 1
+                    builders[key] = None
+    finally:
+        for handle in handles.values():
+            handle.close()
+
+    for table, (csv_path, rows) in written.items():
+        logger.info(f"{table.replace('_', ' ').capitalize()} with {rows} rows written to {csv_path}.")
+    return {table: tuple(result) for table, result in written.items()}
 
 
 def extract_tables_from_list(json_data):
+    import pandas as pd
+
     tables = {}
     if isinstance(json_data, list):
         for i, item in enumerate(json_data):
             if isinstance(item, dict):
                 for key, value in item.items():
                     if isinstance(value, list):
-                        print(f"Extracting DataFrame for list_item_{i}_{key}.")
+                        logger.debug("Extracting DataFrame for list_item_%d_%s.", i, key)
                         tables[f"list_item_{i}_{key}"] = pd.DataFrame(value)
                     elif isinstance(value, dict):
-                        print(f"Normalizing JSON for list_item_{i}_{key}.")
+                        logger.debug("Normalizing JSON for list_item_%d_%s.", i, key)
                         tables[f"list_item_{i}_{key}"] = pd.json_normalize(value)
     else:
-        print("JSON data is not a list; no tables extracted.")
+        logger.warning("JSON data is not a list; no tables extracted.")
     return tables
 
-def process_primary_and_secondary_tables_per_file(tables_per_file, output_folder):
+def process_primary_and_secondary_tables_per_file(tables_per_file, output_folder, codec=None):
     os.makedirs(output_folder, exist_ok=True)  # Ensure the output folder exists
 
+    written_per_file = {}
     for file_name, tables in tables_per_file.items():
-        print(f"Processing tables for {file_name}: {list(tables.keys())}")
+        logger.debug(f"Processing tables for {file_name}: {list(tables.keys())}")
         data_table = tables.get("list_item_0_data", None)
-        primary_table, secondary_table = None, None
+        written = written_per_file.setdefault(file_name, {})
 
         # Generate a base file name without JSON extension for CSV outputs
         base_file_name = os.path.splitext(file_name)[0]
 
         if data_table is not None:
-            print(f"Data table found for {file_name}. Columns: {data_table.columns}")
-            if "primary_table_data" in data_table.columns:
-                try:
-                    primary_table = pd.DataFrame(data_table["primary_table_data"].iloc[0])
-                    primary_csv_path = os.path.join(output_folder, f"{base_file_name}_primary_table.csv")
-                    primary_table.to_csv(primary_csv_path, index=False)
-                    print(f"Primary table written to {primary_csv_path}.")
-                except Exception as e:
-                    print(f"Error processing primary_table_data for {file_name}: {e}")
-
-            if "secondary_table_data" in data_table.columns:
-                try:
-                    secondary_table = pd.DataFrame(data_table["secondary_table_data"].iloc[0])
-                    secondary_csv_path = os.path.join(output_folder, f"{base_file_name}_secondary_table.csv")
-                    secondary_table.to_csv(secondary_csv_path, index=False)
-                    print(f"Secondary table written to {secondary_csv_path}.")
-                except Exception as e:
-                    print(f"Error processing secondary_table_data for {file_name}: {e}")
+            logger.debug(f"Data table found for {file_name}. Columns: {data_table.columns}")
+            for table, frame in primary_and_secondary_frames(data_table, file_name).items():
+                csv_path = os.path.join(output_folder, csv_name(f"{base_file_name}_{table}", codec))
+                with open_file(csv_path, "wt", newline="") as out:
+                    frame.to_csv(out, index=False)
+                written[table] = (csv_path, len(frame))
+                logger.info(f"{table.replace('_', ' ').capitalize()} written to {csv_path}.")
         else:
-            print(f"No data table found for {file_name}.")
+            logger.warning(f"No data table found for {file_name}.")
+    return written_per_file
+
+def primary_and_secondary_frames(data_table, file_name=""):
+    """
+    Build the primary and secondary table DataFrames from the list_item_0_data table of an FSIS JSON file.
+
+    Returns:
+    - A dict mapping 'primary_table'/'secondary_table' to a DataFrame for each table found.
+    """
+    import pandas as pd
+
+    frames = {}
+    for key, table in TABLE_KEYS.items():
+        if key not in data_table.columns:
+            continue
+        try:
+            frames[table] = pd.DataFrame(data_table[key].iloc[0])
+        except Exception as e:
+            logger.error(f"Error processing {key} for {file_name}: {e}")
+    return frames
+
+
+def per_year_csv_files(input_directory, file_type, codec=None):
+    """
+    Return the sorted per-year CSV files of a type ('primary' or 'secondary') in input_directory,
+    compressed with codec ('gzip' or 'zstd') or, if None, uncompressed.
+    """
+    # Skip the merged output of an earlier run, which matches the same pattern
+    return sorted(
+        file for file in glob.glob(os.path.join(input_directory, f"*{file_type}*.csv{SUFFIXES.get(codec, '')}"))
+        if not os.path.basename(file).startswith("merged_usda_fsis_data_")
+    )
+
+def _source_name(path):
+    # Rows are labelled with the per-year file name, without a .gz or .zst suffix
+    return split_codec(os.path.basename(path))[0]
+
+def merged_columns(headers):
+    """
+    Return the union of the columns in headers (in order of first appearance) plus source_file.
+
+    Parameters:
+    - headers: Dict mapping each source name to its list of columns, in merge order.
+    """
+    columns = []
+    for header in headers.values():
+        columns.extend(column for column in header if column not in columns)
+    columns.append("source_file")
+    return columns
+
+def column_report(headers):
+    """
+    Report the columns each source adds or is missing relative to the first source.
+
+    Returns:
+    - A dict mapping each source name to {'added': [...], 'missing': [...]}.
+    """
+    report = {}
+    if not headers:
+        return report
+    reference = next(iter(headers.values()))
+    for name, header in headers.items():
+        added = [column for column in header if column not in reference]
+        missing = [column for column in reference if column not in header]
+        report[name] = {"added": added, "missing": missing}
+        if added or missing:
+            logger.info(f"Column differences for {name}: added {added}, missing {missing}")
+    return report
+
+def merge_frames(frames, columns=None):
+    """
+    Concatenate per-year tables, labelling each row with the name of the table it came from.
 
+    Parameters:
+    - frames: Dict mapping each source name (e.g. the per-year CSV file name) to its DataFrame, in merge order.
+    - columns: Output columns. Defaults to merged_columns of the frames.
+
+    Returns:
+    - The merged DataFrame.
+    """
+    import pandas as pd
+
+    if columns is None:
+        columns = merged_columns({name: list(frame.columns) for name, frame in frames.items()})
+    labelled = [
+        frame.assign(source_file=pd.Categorical([name] * len(frame))) for name, frame in frames.items()
+    ]
+    if not labelled:
+        return pd.DataFrame(columns=columns)
+    return concat_frames(labelled, columns)
 
 # Function to merge primary and secondary CSV files
-def merge_csv_files_by_type(input_directory):
-    for file_type in ["primary", "secondary"]:
-        pattern = f"*{file_type}*.csv"
-        output_filename = f"merged_usda_fsis_data_{file_type}.csv"
+def merge_csv_files_by_type(input_directory, streaming=False, chunksize=100000, codec=None):
+    """
+    Merge the per-year primary and secondary CSV files into one file per type.
 
-        file_list = glob.glob(os.path.join(input_directory, pattern))
+    Columns are aligned across fiscal years: the merged file has the union of all columns
+    (in order of first appearance) and values missing from a year are left empty. Each
+    file's added and missing columns, relative to the first file, are reported.
 
-        if not file_list:
-            print(f"No CSV files matching the pattern found: {pattern}")
-            continue
+    Parameters:
+    - input_directory: Folder containing the per-year CSV files.
+    - streaming: Append each file to the output in chunks instead of holding all years in memory.
+    - chunksize: Rows per chunk in streaming mode.
+    - codec: Read and write CSV files compressed with 'gzip' or 'zstd'.
 
-        print(f"Found {len(file_list)} files matching the pattern for {file_type}. Merging...")
+    Returns:
+    - A dict mapping 'primary'/'secondary' to {file name: {'added': [...], 'missing': [...]}}.
+    """
+    import pandas as pd
 
-        merged_data = pd.DataFrame()
+    reports = {}
+    for file_type in ["primary", "secondary"]:
+        pattern = csv_name(f"*{file_type}*", codec)
+        output_filename = csv_name(f"merged_usda_fsis_data_{file_type}", codec)
 
-        for file in file_list:
-            data = pd.read_csv(file)
-            data["source_file"] = os.path.basename(file)
+        file_list = per_year_csv_files(input_directory, file_type, codec)
 
-            if merged_data.empty:
-                merged_data = data
-            else:
-                if list(merged_data.columns) != list(data.columns):
-                    print(f"Column headers do not match for file: {file}. Skipping this file.")
-                    continue
+        if not file_list:
+            logger.warning(f"No CSV files matching the pattern found: {pattern}")
+            continue
 
-                merged_data = pd.concat([merged_data, data], ignore_index=True)
+        logger.info(f"Found {len(file_list)} files matching the pattern for {file_type}. Merging...")
+
+        schema = FSIS_PRIMARY if file_type == "primary" else FSIS_SECONDARY
+        headers = {_source_name(file): list(pd.read_csv(file, nrows=0).columns) for file in file_list}
+        columns = merged_columns(headers)
+        reports[file_type] = column_report(headers)
+        for name, header in headers.items():
+            schema.report_drift(header, name)
 
         output_file = os.path.join(input_directory, output_filename)
-        merged_data.to_csv(output_file, index=False)
+        total = 0
+        if streaming:
+            with open_file(output_file, "wt", newline="") as out:
+                pd.DataFrame(columns=columns).to_csv(out, index=False)
+                for file in file_list:
+                    dtypes = schema.dtypes(headers[_source_name(file)], str)
+                    rows = 0
+                    for chunk in pd.read_csv(file, dtype=dtypes, chunksize=chunksize):
+                        chunk["source_file"] = _source_name(file)
+                        chunk.reindex(columns=columns).to_csv(out, index=False, header=False)
+                        rows += len(chunk)
+                    metrics.file_read(file, rows)
+                    total += rows
+        else:
+            frames = {
+                _source_name(file): pd.read_csv(file, dtype=schema.dtypes(headers[_source_name(file)], str))
+                for file in file_list
+            }
+            for file in file_list:
+                metrics.file_read(file, len(frames[_source_name(file)]))
+            merged = merge_frames(frames, columns)
+            with open_file(output_file, "wt", newline="") as out:
+                merged.to_csv(out, index=False)
+            total = len(merged)
+        metrics.file_written(output_file, total)
 
-        print(f"{file_type.capitalize()} files merged successfully! Merged file saved as {output_file}.")
+        logger.info(f"{file_type.capitalize()} files merged successfully! Merged file saved as {output_file}.")
+    return reports
 
 # Function to join primary and secondary CSV files
 import os
 
-def join_primary_secondary(primary_file, secondary_file, output_folder, output_file):
-    # Ensure the output folder exists
-    os.makedirs(output_folder, exist_ok=True)
+def fiscal_year_from_source(df):
+    """
+    Derive the FSIS fiscal year (e.g. '2024') from the source_file column added by merge_csv_files_by_type.
+    """
+    import pandas as pd
 
-    # Construct the full path for the output file
-    output_file = os.path.join(output_folder, output_file)
+    source_columns = [column for column in df.columns if column.startswith("source_file")]
+    if not source_columns:
+        return pd.Series(pd.NA, index=df.index, dtype="string")
+    return df[source_columns[0]].astype("string").str.extract(r"fy(\d{4})", expand=False)
 
-    pri_df = pd.read_csv(primary_file)
-    sec_df = pd.read_csv(secondary_file)
+def join_frames(pri_df, sec_df):
+    """
+    Join the merged primary and secondary tables on form_id.
+
+    Duplicate form_ids are dropped from the primary table, year and month are derived from
+    collection_date, and the organism-specific accession columns of the secondary table are
+    coalesced into bio_project_number, bio_sample_number and sra_accession_number.
+
+    Returns:
+    - The joined DataFrame, keeping only form_ids present in both tables.
+    """
+    import pandas as pd
 
     # Remove duplicate form_ids in primary file
-    pri_df = pri_df[~pri_df.duplicated(subset="form_id")]
+    pri_df = pri_df[~pri_df.duplicated(subset="form_id")].copy()
 
     # Extract year and month from collection_date
-    pri_df["collection_date"] = pd.to_datetime(pri_df["collection_date"], errors="coerce")
+    FSIS_PRIMARY.parse_dates(pri_df)
     pri_df["year"] = pri_df["collection_date"].dt.year
     pri_df["month"] = pri_df["collection_date"].dt.month
 
     # Simplify secondary data
-    sec_df = sec_df[
-        [
-            "form_id",
-            "salmonella_bio_project_number",
-            "campylobacter_bio_project_number",
-            "salmonella_bio_sample_accession_number",
-            "campylobacter_bio_sample_accession_number",
-            "salmonella_sra_accession_number",
-            "campylobacter_sra_accession_number",
-        ]
-    ]
-
-    sec_df["bio_project_number"] = sec_df[
-        ["salmonella_bio_project_number", "campylobacter_bio_project_number"]
-    ].bfill(axis=1).iloc[:, 0]
-    sec_df["bio_sample_number"] = sec_df[
-        ["salmonella_bio_sample_accession_number", "campylobacter_bio_sample_accession_number"]
-    ].bfill(axis=1).iloc[:, 0]
-    sec_df["sra_accession_number"] = sec_df[
-        ["salmonella_sra_accession_number", "campylobacter_sra_accession_number"]
-    ].bfill(axis=1).iloc[:, 0]
-
-    sec_df = sec_df.drop(
-        columns=[
-            "salmonella_bio_project_number",
-            "campylobacter_bio_project_number",
-            "salmonella_bio_sample_accession_number",
-            "campylobacter_bio_sample_accession_number",
-            "salmonella_sra_accession_number",
-            "campylobacter_sra_accession_number",
-        ]
-    )
+    source_columns = [column for columns in FSIS_ACCESSION_COLUMNS.values() for column in columns]
+    sec_df = sec_df[["form_id"] + source_columns].copy()
+    for column, candidates in FSIS_ACCESSION_COLUMNS.items():
+        # Coalesce column by column; a row-wise bfill(axis=1) transposes the frame
+        value = sec_df[candidates[0]]
+        for candidate in candidates[1:]:
+            value = value.fillna(sec_df[candidate])
+        sec_df[column] = value
+    sec_df = sec_df.drop(columns=source_columns)
 
     # Merge datasets using an inner join to keep only form_ids present in both files
-    final_df = pd.merge(pri_df, sec_df, on="form_id", how="inner")
+    return pd.merge(pri_df, sec_df, on="form_id", how="inner")
+
+def write_joined(final_df, output_folder, output_file, output_format="csv", compression=None):
+    """
+    Write joined data as CSV, or as a columnar dataset partitioned by fiscal year.
+
+    CSV output is compressed when compression is 'gzip' or 'zstd', which adds the .gz or .zst
+    suffix to output_file, or when output_file already ends with one; columnar output is
+    compressed with the pyarrow codec compression (zstd by default).
+
+    Returns:
+    - The path written.
+    """
+    # Ensure the output folder exists
+    os.makedirs(output_folder, exist_ok=True)
+
+    # Construct the full path for the output file
+    output_file = os.path.join(output_folder, output_file)
+
+    # Columnar output is written as a dataset directory partitioned by fiscal year
+    if output_format != "csv":
+        final_df = final_df.assign(fiscal_year=fiscal_year_from_source(final_df))
+        output_file = f"{os.path.splitext(split_codec(output_file)[0])[0]}.{output_format}"
+        write_partitioned_dataset(final_df, output_file, "fiscal_year", output_format,
+                                  compression or DEFAULT_COMPRESSION)
+        metrics.file_written(output_file, len(final_df))
+        logger.info(f"Joined data saved to {output_format} dataset {output_file}")
+        return output_file
 
     # Save result to output file in the specified output folder
-    final_df.to_csv(output_file, index=False)
-    print(f"Joined data saved to {output_file}")
+    output_file = with_codec(output_file, text_codec(compression))
+    with open_file(output_file, "wt", newline="") as out:
+        final_df.to_csv(out, index=False)
+    metrics.file_written(output_file, len(final_df))
+    logger.info(f"Joined data saved to {output_file}")
+    return output_file
+
+def join_primary_secondary(primary_file, secondary_file, output_folder, output_file, output_format="csv",
+                           compression=None):
+    # Low-cardinality columns are read as categoricals and only the join columns of the secondary table
+    pri_df = FSIS_PRIMARY.read_csv(primary_file)
+    sec_df = FSIS_SECONDARY.read_csv(secondary_file, usecols=FSIS_SECONDARY.usecols)
+    metrics.file_read(primary_file, len(pri_df))
+    metrics.file_read(secondary_file, len(sec_df))
+    return write_joined(join_frames(pri_df, sec_df), output_folder, output_file, output_format, compression)
+
 
+def _read_source_tables(source):
+    # Tables of one JSON file, or of every JSON member of a zip archive, keyed by JSON file name
+    if source.endswith(".zip"):
+        with zipfile.ZipFile(source) as archive:
+            return {
+                os.path.basename(member.filename): read_json_tables(
+                    member.filename, opener=lambda member=member: archive.open(member)
+                )
+                for member in _json_members(archive)
+            }
+    return {os.path.basename(source): read_json_tables(source)}
+
+def read_json_tables(file_path, opener=None):
+    """
+    Read the primary and secondary tables of one FSIS JSON file into DataFrames.
+
+    Parameters:
+    - file_path: Path of the JSON file.
+    - opener: Optional callable returning a binary file object for the JSON (e.g. a zip member).
+
+    Returns:
+    - A dict mapping 'primary_table'/'secondary_table' to a DataFrame for each table found.
+    """
+    file_name = os.path.basename(file_path)
+    logger.info(f"Reading tables from JSON file: {file_path}")
+    with (opener() if opener else open(file_path, "rb")) as file:
+        data = json.load(file)
+    data_table = extract_tables_from_list(data).get("list_item_0_data")
+    del data
+    if data_table is None:
+        logger.warning(f"No data table found for {file_name}.")
+        return {}
+    frames = primary_and_secondary_frames(data_table, file_name)
+    schemas = {"primary_table": FSIS_PRIMARY, "secondary_table": FSIS_SECONDARY}
+    for table, frame in frames.items():
+        schemas[table].report_drift(list(frame.columns), f"{file_name} {table.replace('_', ' ')}")
+    return {table: schemas[table].apply(frame) for table, frame in frames.items()}
+
+def in_memory_sources(folder):
+    """
+    Return the inputs of the in-memory pipeline in folder: the downloaded FSIS archives, or
+    the extracted JSON files when no archives are present.
+    """
+    archives = [
+        os.path.join(folder, file_name) for file_name in sorted(file_names)
+        if os.path.exists(os.path.join(folder, file_name))
+    ]
+    if archives:
+        return archives
+    return sorted(os.path.join(folder, name) for name in os.listdir(folder) if is_fsis_json(name))
+
+def build_joined_table(sources, workers=1, debug_folder=None, codec=None):
+    """
+    Extract, merge and join FSIS tables in memory, without intermediate CSV files.
+
+    Parameters:
+    - sources: FSIS zip archives and/or JSON files, one per fiscal year.
+    - workers: Number of worker processes used to read the sources.
+    - debug_folder: If given, also write the per-year and merged CSV files the file-based
+      workflow produces to this folder, for debugging.
+    - codec: Compress those files with 'gzip' or 'zstd'.
+
+    Returns:
+    - The joined DataFrame, as join_frames returns it.
+    """
+    tables_per_file = {}
+    if workers > 1 and len(sources) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = {executor.submit(_read_source_tables, source): source for source in sources}
+            for future in as_completed(futures):
+                tables_per_file.update(future.result())
+    else:
+        for source in sources:
+            tables_per_file.update(_read_source_tables(source))
+    for source in sources:
+        metrics.file_read(source)
+
+    merged = {}
+    for file_type in ["primary", "secondary"]:
+        table = f"{file_type}_table"
+        # Rows are labelled with the CSV name the file-based workflow would have written
+        frames = {
+            f"{os.path.splitext(file_name)[0]}_{table}.csv": tables_per_file[file_name][table]
+            for file_name in sorted(tables_per_file)
+            if table in tables_per_file[file_name]
+        }
+        if not frames:
+            raise ValueError(f"No {table.replace('_', ' ')} found in {len(sources)} sources.")
+        column_report({name: list(frame.columns) for name, frame in frames.items()})
+        merged[file_type] = merge_frames(frames)
+        metrics.count(rows_read=len(merged[file_type]))
+        logger.info(f"Merged {len(frames)} {file_type} tables with {len(merged[file_type])} rows in memory.")
+
+        if debug_folder:
+            os.makedirs(debug_folder, exist_ok=True)
+            for name, frame in frames.items():
+                path = os.path.join(debug_folder, with_codec(name, codec))
+                with open_file(path, "wt", newline="") as out:
+                    frame.to_csv(out, index=False)
+                metrics.file_written(path, len(frame))
+            merged_file = os.path.join(debug_folder, csv_name(f"merged_usda_fsis_data_{file_type}", codec))
+            with open_file(merged_file, "wt", newline="") as out:
+                merged[file_type].to_csv(out, index=False)
+            metrics.file_written(merged_file, len(merged[file_type]))
+
+    return join_frames(merged["primary"], merged["secondary"])
+
+def in_memory_workflow(sources, output_folder, output_file, output_format="csv", compression=None,
+                       workers=1, keep_intermediates=False):
+    """
+    Run process -> merge -> join in memory and write only the joined output.
+
+    Parameters:
+    - sources: FSIS zip archives and/or JSON files, one per fiscal year.
+    - output_folder: Folder to write the joined output (and any intermediate files) to.
+    - output_file: File name of the joined output.
+    - output_format, compression: Output format of the joined data, see join_primary_secondary.
+    - workers: Number of worker processes used to read the sources.
+    - keep_intermediates: Also write the per-year and merged CSV files, for debugging.
+
+    Returns:
+    - The path of the joined output.
+    """
+    final_df = build_joined_table(sources, workers, output_folder if keep_intermediates else None,
+                                  text_codec(compression, output_format))
+    return write_joined(final_df, output_folder, output_file, output_format, compression)
 
 
 # Function to run the complete workflow
-def complete_workflow(download_method, output_folder, joined_file, geckodriver_path):
-    if download_method == "firefox":
-        download_files_firefox(output_folder, geckodriver_path)
-    elif download_method == "requests":
-        download_files_requests(output_folder)
+FSIS_STAGES = ("download", "process", "merge", "join")
 
-    process_json_files(output_folder)
-    merge_csv_files_by_type(output_folder)
+def complete_workflow(download_method, output_folder, joined_file, geckodriver_path, force=False,
+                      output_format="csv", compression=None, streaming=False, workers=1,
+                      from_stage=None, base_url=BASE_URL, in_memory=False, keep_intermediates=False):
+    """
+    Run download -> process -> merge -> join, skipping stages whose outputs are still valid.
 
-    primary_file = os.path.join(output_folder, "merged_usda_fsis_data_primary.csv")
-    secondary_file = os.path.join(output_folder, "merged_usda_fsis_data_secondary.csv")
+    Each fiscal year is processed as its own stage keyed on the content hash of its archive,
+    so only changed years are recomputed; merge and join are skipped when their input files
+    and options are unchanged. Stage state is kept in the output folder.
 
-    join_primary_secondary(primary_file, secondary_file, output_folder, joined_file)
+    With in_memory, the downloaded archives are read, merged and joined in memory as a single
+    join stage keyed on the archives, and no intermediate files are written unless
+    keep_intermediates is set.
 
+    Parameters:
+    - download_method: 'requests' or 'firefox'.
+    - output_folder: Folder for downloads, intermediate files and the joined output.
+    - joined_file: File name of the joined output.
+    - geckodriver_path: Path to the geckodriver executable for Firefox downloads.
+    - force: Re-download archives and re-run every stage.
+    - output_format, compression: Output format of the joined data, see write_joined. With csv
+      output, 'gzip' or 'zstd' also compresses the per-year and merged CSV files.
+    - streaming: Stream JSON extraction and merge with bounded memory.
+    - workers: Number of worker processes used for processing.
+    - from_stage: Skip the stages before this one and re-run it and every later stage.
+    - base_url: URL prefix of the archives.
+    - in_memory: Pass tables from extraction to merge to join in memory.
+    - keep_intermediates: With in_memory, also write the per-year and merged CSV files.
+    """
+    runner = StageRunner(output_folder, FSIS_STAGES, force=force, from_stage=from_stage)
+    process = not in_memory
+    codec = text_codec(compression, output_format)
 
-if __name__ == "__main__":
-    parser = argparse.ArgumentParser(
-        description="Download, process, merge, join FSIS data, or run the complete workflow."
+    # Archives are processed straight from the zip while the next one downloads
+    def download():
+        if download_method == "firefox":
+            download_files_firefox(output_folder, geckodriver_path, base_url, process=process, streaming=streaming,
+                                   workers=workers, runner=runner, extract=process, codec=codec)
+        elif download_method == "requests":
+            download_files_requests(output_folder, base_url, force=force, process=process, streaming=streaming,
+                                    workers=workers, runner=runner, extract=process, codec=codec)
+
+    runner.run("download", download, params={"method": download_method}, always=True)
+
+    if in_memory:
+        sources = in_memory_sources(output_folder)
+        output = {}
+        runner.run(
+            "join",
+            lambda: output.setdefault("path", in_memory_workflow(
+                sources, output_folder, joined_file, output_format, compression, workers, keep_intermediates
+            )),
+            inputs=sources,
+            outputs=lambda: [output["path"]],
+            params={"output_file": joined_file, "format": output_format,
+                    "compression": compression or DEFAULT_COMPRESSION, "in_memory": True,
+                    "keep_intermediates": keep_intermediates},
+        )
+        return
+
+    if not runner.selected("download") and runner.selected("process"):
+        pipeline = _ArchivePipeline(output_folder, True, streaming, workers, runner, codec=codec)
+        for file_name in file_names:
+            zip_path = os.path.join(output_folder, file_name)
+            if os.path.exists(zip_path):
+                pipeline.submit(zip_path)
+        pipeline.finish()
+
+    primary_file = os.path.join(output_folder, csv_name("merged_usda_fsis_data_primary", codec))
+    secondary_file = os.path.join(output_folder, csv_name("merged_usda_fsis_data_secondary", codec))
+    merge_params = {"streaming": streaming}
+    if codec:
+        merge_params["compression"] = codec
+
+    runner.run(
+        "merge",
+        lambda: merge_csv_files_by_type(output_folder, streaming=streaming, codec=codec),
+        inputs=per_year_csv_files(output_folder, "primary", codec)
+        + per_year_csv_files(output_folder, "secondary", codec),
+        outputs=[primary_file, secondary_file],
+        params=merge_params,
     )
+
+    output = {}
+    runner.run(
+        "join",
+        lambda: output.setdefault("path", join_primary_secondary(
+            primary_file, secondary_file, output_folder, joined_file, output_format, compression
+        )),
+        inputs=[path for path in (primary_file, secondary_file) if os.path.exists(path)],
+        outputs=lambda: [output["path"]],
+        params={"output_file": joined_file, "format": output_format,
+                "compression": compression or DEFAULT_COMPRESSION},
+    )
+
+
+DESCRIPTION = "Download, process, merge, join FSIS data, or run the complete workflow."
+
+def add_arguments(parser):
+    """
+    Add the command-line options of this script to parser.
+    """
     parser.add_argument(
         "operation",
         choices=[
@@ -313,20 +1019,107 @@ if __name__ == "__main__":
         help="Method to use for downloading files (default: requests).",
     )
     parser.add_argument("--geckodriver_path", default="geckodriver", help="Path to the geckodriver executable.")
+    parser.add_argument(
+        "--format",
+        choices=("csv",) + FORMATS,
+        default="csv",
+        help="Output format for joined data. Columnar formats write a dataset partitioned by fiscal year.",
+    )
+    parser.add_argument(
+        "--compression",
+        help=f"Compression of the outputs: gzip or zstd for csv, which also compresses the per-year and merged "
+        f"CSV files (an --output_file named *.gz or *.zst is compressed without it), or a codec for columnar "
+        f"formats (default: {DEFAULT_COMPRESSION}).",
+    )
+    parser.add_argument(
+        "--streaming",
+        action="store_true",
+        help="Stream tables from each JSON file to CSV (process; requires ijson) and merge "
+        "fiscal years chunk by chunk (merge) with bounded memory.",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Number of worker processes used to process fiscal-year JSON files in parallel (default: 1).",
+    )
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help="Re-download archives even if they are unchanged since the last run, and re-run every workflow stage.",
+    )
+    parser.add_argument(
+        "--in_memory",
+        action="store_true",
+        help="For join and complete_workflow, read the archives (or JSON files) in the output folder and "
+        "merge and join them in memory without intermediate CSV files.",
+    )
+    parser.add_argument(
+        "--keep_intermediates",
+        action="store_true",
+        help="With --in_memory, also write the per-year and merged CSV files for debugging.",
+    )
+    parser.add_argument(
+        "--from_stage",
+        choices=FSIS_STAGES,
+        help="For complete_workflow, skip earlier stages and re-run this stage and all later ones.",
+    )
 
-    args = parser.parse_args()
-
-    if args.operation == "download_firefox":
-        download_files_firefox(args.output_folder, args.geckodriver_path)
-    elif args.operation == "download_requests":
-        download_files_requests(args.output_folder)
-    elif args.operation == "process":
-        process_json_files(args.output_folder)
-    elif args.operation == "merge":
-        merge_csv_files_by_type(args.output_folder)
-    elif args.operation == "join":
-        primary_file = os.path.join(args.output_folder, "merged_usda_fsis_data_primary.csv")
-        secondary_file = os.path.join(args.output_folder, "merged_usda_fsis_data_secondary.csv")
-        join_primary_secondary(primary_file, secondary_file, args.output_folder, args.output_file)
-    elif args.operation == "complete_workflow":
-        complete_workflow(args.download_method, args.output_folder, args.output_file, args.geckodriver_path)
+    metrics.add_arguments(parser)
+    download_cache.add_arguments(parser)
+
+def run(args):
+    """
+    Run the script with arguments parsed by a parser set up with add_arguments.
+    """
+    with metrics.instrumented(args, args.operation):
+        download_cache.configure_from_args(args)
+        codec = text_codec(args.compression, args.format)
+        if args.operation == "download_firefox":
+            download_files_firefox(args.output_folder, args.geckodriver_path)
+        elif args.operation == "download_requests":
+            download_files_requests(args.output_folder, force=args.force)
+        elif args.operation == "process":
+            process_json_files(args.output_folder, streaming=args.streaming, workers=args.workers, codec=codec)
+        elif args.operation == "merge":
+            merge_csv_files_by_type(args.output_folder, streaming=args.streaming, codec=codec)
+        elif args.operation == "join" and args.in_memory:
+            in_memory_workflow(
+                in_memory_sources(args.output_folder),
+                args.output_folder,
+                args.output_file,
+                args.format,
+                args.compression,
+                args.workers,
+                args.keep_intermediates,
+            )
+        elif args.operation == "join":
+            primary_file = os.path.join(args.output_folder, csv_name("merged_usda_fsis_data_primary", codec))
+            secondary_file = os.path.join(args.output_folder, csv_name("merged_usda_fsis_data_secondary", codec))
+            join_primary_secondary(
+                primary_file, secondary_file, args.output_folder, args.output_file, args.format, args.compression
+            )
+        elif args.operation == "complete_workflow":
+            complete_workflow(
+                args.download_method,
+                args.output_folder,
+                args.output_file,
+                args.geckodriver_path,
+                args.force,
+                args.format,
+                args.compression,
+                args.streaming,
+                args.workers,
+                args.from_stage,
+                in_memory=args.in_memory,
+                keep_intermediates=args.keep_intermediates,
+            )
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=DESCRIPTION)
+    add_arguments(parser)
+    run(parser.parse_args(argv))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,374 @@
+#!/usr/bin/env python3
+
+import argparse
+import logging
+import os
+import re
+
+from opentrakr import metrics
+from opentrakr.columnar import dataset_columns, read_columnar
+from opentrakr.compression import open_file, split_codec
+from opentrakr.schemas import NCBI_CLUSTERS, NCBI_METADATA, concat_frames
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CHUNKSIZE = 100000
+DEFAULT_OUTPUT_FOLDER = "linked"
+PREFIX = "ncbi_"
+
+# Candidate accession columns of the records being linked (FSIS joined data, NARMS retail
+# isolates), in order of preference. Names are matched ignoring case, spaces and punctuation.
+BIOSAMPLE_COLUMNS = ("bio_sample_number", "biosample_acc", "BioSample", "BioSample Accession")
+RUN_COLUMNS = ("sra_accession_number", "Run", "sra_run", "SRA", "SRA Accession", "SRR")
+
+# NCBI metadata columns added to linked records when present
+NCBI_COLUMNS = (
+    "target_acc",
+    "biosample_acc",
+    "Run",
+    "PDS_acc",
+    "scientific_name",
+    "serovar",
+    "computed_types",
+    "isolation_source",
+    "collection_date",
+    "geo_loc_name",
+    "AMR_genotypes",
+)
+
+_SEPARATORS = re.compile(r"[,;\s]+")
+
+
+def _normalize(name):
+    return re.sub(r"[^a-z0-9]", "", str(name).lower())
+
+
+def pick_column(columns, candidates):
+    """
+    Return the first column of columns matching one of candidates, ignoring case and punctuation.
+    """
+    normalized = {}
+    for column in columns:
+        normalized.setdefault(_normalize(column), column)
+    for candidate in candidates:
+        if _normalize(candidate) in normalized:
+            return normalized[_normalize(candidate)]
+    return None
+
+
+def _accessions(value):
+    # A cell may hold several accessions, e.g. "SRR1,SRR2"
+    if not isinstance(value, str):
+        return []
+    return [accession for accession in _SEPARATORS.split(value.strip()) if accession]
+
+
+def _sep(path):
+    return "\t" if split_codec(path)[0].endswith((".tsv", ".txt")) else ","
+
+
+def _header(path, sep):
+    import pandas as pd
+
+    return list(pd.read_csv(path, sep=sep, nrows=0).columns)
+
+
+def record_keys(path, biosample_column=None, run_column=None, chunksize=DEFAULT_CHUNKSIZE):
+    """
+    Collect the BioSample and SRA run accessions of a table of records, reading only those columns.
+
+    Parameters:
+    - path: CSV, or tab-delimited .tsv/.txt file of records, optionally compressed (.gz, .zst).
+    - biosample_column, run_column: Accession columns. Detected from the header if not given.
+    - chunksize: Rows per chunk.
+
+    Returns:
+    - A tuple (biosample_column, run_column, biosamples, runs); a column is None when not found.
+    """
+    import pandas as pd
+
+    sep = _sep(path)
+    header = _header(path, sep)
+    biosample_column = biosample_column or pick_column(header, BIOSAMPLE_COLUMNS)
+    run_column = run_column or pick_column(header, RUN_COLUMNS)
+    key_columns = [column for column in (biosample_column, run_column) if column]
+    biosamples, runs = set(), set()
+    if not key_columns:
+        logger.warning(f"No BioSample or SRA run column found in {path}.")
+        return biosample_column, run_column, biosamples, runs
+
+    for chunk in pd.read_csv(path, sep=sep, usecols=key_columns, dtype=str, chunksize=chunksize):
+        for column, keys in ((biosample_column, biosamples), (run_column, runs)):
+            if column:
+                for value in chunk[column].dropna():
+                    keys.update(_accessions(value))
+    return biosample_column, run_column, biosamples, runs
+
+
+def _dataset_format(path):
+    for _, _, names in os.walk(path):
+        for name in names:
+            if name.endswith(".feather"):
+                return "feather"
+            if name.endswith(".parquet"):
+                return "parquet"
+    return "parquet"
+
+
+def load_ncbi_matches(metadata_path, biosamples, runs, columns=NCBI_COLUMNS, chunksize=DEFAULT_CHUNKSIZE):
+    """
+    Stream merged NCBI metadata and keep only the isolates matching the given accessions.
+
+    Only the requested columns are read, and only matching rows are kept, so memory is
+    proportional to the number of linked records rather than to the size of the NCBI table.
+
+    Parameters:
+    - metadata_path: Merged metadata TSV, or columnar dataset directory, written by ncbi_tsv_merge.
+    - biosamples: Set of BioSample accessions to keep.
+    - runs: Set of SRA run accessions to keep.
+    - columns: NCBI columns to keep; biosample_acc and Run are always kept.
+    - chunksize: Rows per chunk.
+
+    Returns:
+    - A DataFrame of the matching isolates.
+    """
+    import pandas as pd
+
+    columns = set(columns) | {"biosample_acc", "Run"}
+    if os.path.isdir(metadata_path):
+        output_format = _dataset_format(metadata_path)
+        names = dataset_columns(metadata_path, output_format)
+        usecols = [column for column in names if column in columns]
+        match = {}
+        if "biosample_acc" in names and biosamples:
+            match["biosample_acc"] = sorted(biosamples)
+        if "Run" in names and runs:
+            match["Run"] = sorted(runs)
+        if not match:
+            return pd.DataFrame(columns=usecols)
+        return read_columnar(metadata_path, columns=usecols, output_format=output_format, match=match)
+
+    header = _header(metadata_path, "\t")
+    NCBI_METADATA.report_drift(header, metadata_path)
+    usecols = [column for column in header if column in columns]
+    matches = []
+    rows = 0
+    for chunk in pd.read_csv(metadata_path, sep="\t", usecols=usecols, dtype=NCBI_METADATA.dtypes(usecols, str),
+                             chunksize=chunksize):
+        rows += len(chunk)
+        mask = pd.Series(False, index=chunk.index)
+        if "biosample_acc" in chunk.columns:
+            mask |= chunk["biosample_acc"].isin(biosamples)
+        if "Run" in chunk.columns and runs:
+            chunk_runs = chunk["Run"].astype("string").str.split(",").explode().str.strip()
+            mask |= chunk_runs.isin(runs).groupby(level=0).any().reindex(chunk.index, fill_value=False)
+        if mask.any():
+            matches.append(chunk[mask])
+    metrics.file_read(metadata_path, rows)
+    if not matches:
+        return pd.DataFrame(columns=usecols)
+    return concat_frames(matches, usecols)
+
+
+def add_clusters(matches, cluster_paths, chunksize=DEFAULT_CHUNKSIZE):
+    """
+    Fill in the SNP cluster (PDS_acc) of matched isolates from *.cluster_list.tsv files.
+
+    Parameters:
+    - matches: DataFrame of matched isolates with a target_acc column.
+    - cluster_paths: *.cluster_list.tsv files.
+    - chunksize: Rows per chunk.
+
+    Returns:
+    - matches with PDS_acc filled in where it was missing.
+    """
+    import pandas as pd
+
+    if "target_acc" not in matches.columns or not cluster_paths:
+        return matches
+    targets = set(matches["target_acc"].dropna())
+    clusters = {}
+    for path in cluster_paths:
+        options = NCBI_CLUSTERS.read_options(path, sep="\t", default=str, usecols=NCBI_CLUSTERS.usecols)
+        if len(options.get("usecols", [])) < 2:
+            logger.warning(f"No target_acc/PDS_acc columns in {path}; skipping.")
+            continue
+        for chunk in pd.read_csv(path, chunksize=chunksize, **options):
+            chunk = chunk[chunk["target_acc"].isin(targets)]
+            clusters.update(zip(chunk["target_acc"], chunk["PDS_acc"]))
+    matches = matches.copy()
+    existing = matches["PDS_acc"].astype(object) if "PDS_acc" in matches.columns else None
+    filled = matches["target_acc"].map(clusters)
+    matches["PDS_acc"] = filled if existing is None else existing.where(existing.notna(), filled)
+    return matches
+
+
+def _index(matches, column, split=False):
+    # Accession -> position of the first matching isolate
+    index = {}
+    if column not in matches.columns:
+        return index
+    for position, value in enumerate(matches[column]):
+        for accession in (_accessions(value) if split else [value] if isinstance(value, str) else []):
+            index.setdefault(accession, position)
+    return index
+
+
+def annotate_records(path, output_path, unmatched_path, matches, biosample_column, run_column,
+                     chunksize=DEFAULT_CHUNKSIZE):
+    """
+    Stream a table of records and append the matching NCBI isolate and SNP cluster to each row.
+
+    Records are matched on BioSample first, then on SRA run. The NCBI columns are added
+    with an 'ncbi_' prefix, plus ncbi_match ('biosample', 'run' or empty). Records whose
+    accessions are not found, or that have none, are listed in unmatched_path.
+
+    Returns:
+    - A dict with the number of 'records', 'biosample' and 'run' matches, 'unmatched' and 'no_accession' records.
+    """
+    import pandas as pd
+
+    sep = _sep(path)
+    by_biosample = _index(matches, "biosample_acc")
+    by_run = _index(matches, "Run", split=True)
+    # A trailing empty row is used for records without a match
+    annotations = pd.concat([matches, pd.DataFrame(index=[0], columns=matches.columns)], ignore_index=True)
+    annotations.columns = [f"{PREFIX}{column}" for column in annotations.columns]
+    missing = len(matches)
+
+    summary = {"records": 0, "biosample": 0, "run": 0, "unmatched": 0, "no_accession": 0}
+    header = True
+    with open_file(output_path, "wt", newline="") as out, open(unmatched_path, "w", encoding="utf-8", newline="") as unmatched:
+        unmatched.write("\t".join(["line", "accessions", "reason"]) + "\n")
+        for chunk in pd.read_csv(path, sep=sep, dtype=str, chunksize=chunksize):
+            positions, kinds = [], []
+            biosample_values = chunk[biosample_column] if biosample_column else [None] * len(chunk)
+            run_values = chunk[run_column] if run_column else [None] * len(chunk)
+            # Line numbers count the header as line 1
+            for line, (biosample, run) in enumerate(zip(biosample_values, run_values), start=summary["records"] + 2):
+                candidates = [("biosample", accession, by_biosample) for accession in _accessions(biosample)]
+                candidates += [("run", accession, by_run) for accession in _accessions(run)]
+                hit = next(((kind, index[accession]) for kind, accession, index in candidates
+                            if accession in index), None)
+                if hit:
+                    kinds.append(hit[0])
+                    positions.append(hit[1])
+                    summary[hit[0]] += 1
+                    continue
+                kinds.append("")
+                positions.append(missing)
+                reason = "not found" if candidates else "no accession"
+                summary["unmatched" if candidates else "no_accession"] += 1
+                unmatched.write(f"{line}\t{','.join(accession for _, accession, _ in candidates)}\t{reason}\n")
+            summary["records"] += len(chunk)
+
+            annotated = annotations.iloc[positions].reset_index(drop=True)
+            annotated[f"{PREFIX}match"] = kinds
+            linked = pd.concat([chunk.reset_index(drop=True), annotated], axis=1)
+            linked.to_csv(out, sep=sep, index=False, header=header)
+            header = False
+    metrics.file_read(path, summary["records"])
+    metrics.file_written(output_path, summary["records"])
+    metrics.file_written(unmatched_path, summary["unmatched"] + summary["no_accession"])
+    return summary
+
+
+def link_records(inputs, ncbi_metadata, output_folder=DEFAULT_OUTPUT_FOLDER, cluster_paths=(),
+                 columns=NCBI_COLUMNS, biosample_column=None, run_column=None, chunksize=DEFAULT_CHUNKSIZE):
+    """
+    Link FSIS and NARMS records to NCBI Pathogen Detection isolates and SNP clusters.
+
+    The accessions of all inputs are collected first, the NCBI metadata is then scanned once
+    keeping only matching isolates, and each input is streamed through the resulting index.
+    Memory is proportional to the inputs, not to the NCBI metadata.
+
+    Parameters:
+    - inputs: Record tables, e.g. the joined FSIS CSV and the tab-delimited NARMS table.
+    - ncbi_metadata: Merged metadata TSV, or columnar dataset directory, written by ncbi_tsv_merge.
+    - output_folder: Folder for <input>.linked.<ext> and <input>.unmatched.tsv; the linked
+      records of a compressed input are compressed the same way.
+    - cluster_paths: Optional *.cluster_list.tsv files used to fill in missing SNP clusters.
+    - columns: NCBI columns added to the records.
+    - biosample_column, run_column: Accession columns of the inputs. Detected per input if not given.
+    - chunksize: Rows per chunk.
+
+    Returns:
+    - A dict mapping each input to its annotate_records summary plus 'output' and 'unmatched' paths.
+    """
+    keys = {}
+    biosamples, runs = set(), set()
+    for path in inputs:
+        keys[path] = record_keys(path, biosample_column, run_column, chunksize)
+        biosamples |= keys[path][2]
+        runs |= keys[path][3]
+    logger.info(f"Collected {len(biosamples)} BioSample and {len(runs)} SRA run accessions from {len(inputs)} inputs")
+
+    matches = load_ncbi_matches(ncbi_metadata, biosamples, runs, columns, chunksize)
+    matches = add_clusters(matches, cluster_paths, chunksize)
+    logger.info(f"Found {len(matches)} matching NCBI isolates in {ncbi_metadata}")
+
+    os.makedirs(output_folder, exist_ok=True)
+    results = {}
+    for path in inputs:
+        name, suffix = split_codec(os.path.basename(path))
+        base, ext = os.path.splitext(name)
+        output_path = os.path.join(output_folder, f"{base}.linked{ext}{suffix}")
+        unmatched_path = os.path.join(output_folder, f"{base}.unmatched.tsv")
+        summary = annotate_records(path, output_path, unmatched_path, matches, keys[path][0], keys[path][1],
+                                   chunksize)
+        summary.update(output=output_path, unmatched_file=unmatched_path)
+        logger.info(f"{path}: {summary['records']} records, {summary['biosample']} matched on BioSample, "
+                    f"{summary['run']} on SRA run, {summary['unmatched']} unmatched, "
+                    f"{summary['no_accession']} without accessions; written to {output_path}")
+        results[path] = summary
+    return results
+
+
+DESCRIPTION = "Annotate FSIS and NARMS records with their NCBI Pathogen Detection isolate and SNP cluster."
+
+
+def add_arguments(parser):
+    """
+    Add the command-line options of this script to parser.
+    """
+    parser.add_argument("inputs", nargs="+", help="Record tables: the joined FSIS CSV and/or the tab-delimited NARMS table.")
+    parser.add_argument("-n", "--ncbi_metadata", required=True,
+                        help="Merged NCBI metadata TSV or columnar dataset written by ncbi_tsv_merge.")
+    parser.add_argument("-c", "--clusters", nargs="*", default=[],
+                        help="*.cluster_list.tsv files, or directories containing them, to fill in SNP clusters.")
+    parser.add_argument("-o", "--output_folder", default=DEFAULT_OUTPUT_FOLDER,
+                        help=f"Folder for the linked tables and unmatched reports. Defaults to {DEFAULT_OUTPUT_FOLDER}.")
+    parser.add_argument("--columns", nargs="+", default=list(NCBI_COLUMNS), help="NCBI columns to add.")
+    parser.add_argument("--biosample_column", help="BioSample column of the inputs. Detected if not given.")
+    parser.add_argument("--run_column", help="SRA run column of the inputs. Detected if not given.")
+    parser.add_argument("--chunksize", type=int, default=DEFAULT_CHUNKSIZE,
+                        help=f"Rows per chunk. Defaults to {DEFAULT_CHUNKSIZE}.")
+    metrics.add_arguments(parser)
+
+
+def run(args):
+    """
+    Run the script with arguments parsed by a parser set up with add_arguments.
+    """
+    cluster_paths = []
+    for path in args.clusters:
+        if os.path.isdir(path):
+            cluster_paths.extend(
+                os.path.join(path, name) for name in sorted(os.listdir(path)) if split_codec(name)[0].endswith(".cluster_list.tsv")
+            )
+        else:
+            cluster_paths.append(path)
+
+    with metrics.instrumented(args, "link"):
+        link_records(args.inputs, args.ncbi_metadata, args.output_folder, cluster_paths, args.columns,
+                     args.biosample_column, args.run_column, args.chunksize)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=DESCRIPTION)
+    add_arguments(parser)
+    run(parser.parse_args(argv))
+
+
+if __name__ == "__main__":
+    main()
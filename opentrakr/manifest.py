@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows: only threads of one process are kept from overwriting each other
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_NAME = ".opentrakr_manifest.json"
+LOCK_SUFFIX = ".lock"
+
+
+class DownloadManifest:
+    """
+    Per-folder record of downloaded files, used to skip files that have not changed.
+
+    Each file entry is keyed by file name and stores the source URL, the ETag and
+    Last-Modified validators returned by the server, the size and the SHA-256 of the
+    file. Arbitrary release markers (such as the NCBI PDG release that latest_snps
+    pointed to) can be stored alongside the file entries.
+
+    Entries are recorded in memory and written by save, once per batch of downloads.
+    Saving merges them into the manifest on disk under a lock on a file next to it, so
+    workflows sharing a folder keep each other's entries.
+    """
+
+    def __init__(self, folder):
+        self.folder = folder
+        self.path = os.path.join(folder, MANIFEST_NAME)
+        self._lock = threading.Lock()
+        self._changed_files = set()
+        self._changed_releases = set()
+        self.files, self.releases = self._load()
+
+    def _load(self):
+        if os.path.exists(self.path):
+            try:
+                with open(self.path, "r") as file:
+                    data = json.load(file)
+                return data.get("files", {}), data.get("releases", {})
+            except (OSError, ValueError) as e:
+                logger.warning(f"Ignoring unreadable manifest {self.path}: {e}")
+        return {}, {}
+
+    def get(self, file_path):
+        return self.files.get(os.path.basename(file_path))
+
+    def is_current(self, file_path, url=None):
+        """
+        Check that file_path exists and still matches its manifest entry.
+
+        The entry must hold an ETag or Last-Modified validator, so the file can be checked
+        against the server. The local file is compared by size only; it is not hashed again.
+        """
+        entry = self.get(file_path)
+        if not entry or (url is not None and entry.get("url") != url):
+            return False
+        if not (entry.get("etag") or entry.get("last_modified")):
+            return False
+        return os.path.exists(file_path) and os.path.getsize(file_path) == entry.get("size")
+
+    def record(self, file_path, url, etag=None, last_modified=None, sha256=None):
+        with self._lock:
+            name = os.path.basename(file_path)
+            self.files[name] = {
+                "url": url,
+                "etag": etag,
+                "last_modified": last_modified,
+                "size": os.path.getsize(file_path),
+                "sha256": sha256,
+                "updated": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            }
+            self._changed_files.add(name)
+
+    def get_release(self, key):
+        return self.releases.get(key)
+
+    def set_release(self, key, release):
+        with self._lock:
+            self.releases[key] = release
+            self._changed_releases.add(key)
+
+    @contextmanager
+    def _locked(self):
+        os.makedirs(self.folder, exist_ok=True)
+        with open(f"{self.path}{LOCK_SUFFIX}", "a") as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+    def save(self):
+        """
+        Write the entries recorded since the last save into the manifest on disk.
+        """
+        with self._lock:
+            if not (self._changed_files or self._changed_releases):
+                return
+            with self._locked():
+                files, releases = self._load()
+                files.update({name: self.files[name] for name in self._changed_files})
+                releases.update({key: self.releases[key] for key in self._changed_releases})
+                with tempfile.NamedTemporaryFile("w", dir=self.folder, prefix=f"{MANIFEST_NAME}.",
+                                                 suffix=".tmp", delete=False) as file:
+                    json.dump({"files": files, "releases": releases}, file, indent=2, sort_keys=True)
+                try:
+                    os.replace(file.name, self.path)
+                except OSError:
+                    os.remove(file.name)
+                    raise
+            self.files, self.releases = files, releases
+            self._changed_files.clear()
+            self._changed_releases.clear()
@@ -0,0 +1,309 @@
+#!/usr/bin/env python3
+
+import cProfile
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:  # Windows: peak RSS is not recorded
+    resource = None
+
+logger = logging.getLogger(__name__)
+
+# Counters kept for every stage and file record
+COUNTERS = ("bytes_downloaded", "bytes_read", "bytes_written", "rows_read", "rows_written", "retries")
+LOG_LEVELS = ("DEBUG", "INFO", "WARNING", "ERROR")
+LOG_FORMAT = "%(message)s"
+
+
+def _max_rss_bytes(children=False):
+    # High-water mark of the process (or of its finished children) since it started, or None.
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS.
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF).ru_maxrss
+    return rss if sys.platform == "darwin" else rss * 1024
+
+
+def _timestamp(seconds):
+    return time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(seconds))
+
+
+def path_size(path):
+    """
+    Return the size of a file, or the total size of the files below a directory (e.g. a dataset).
+    """
+    if os.path.isdir(path):
+        return sum(
+            os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(path) for name in names
+        )
+    return os.path.getsize(path) if os.path.exists(path) else 0
+
+
+class RunMetrics:
+    """
+    Collect wall time, bytes, rows, HTTP retries and peak RSS per stage and per file for one run.
+
+    Stages nest: counters are added to every open stage, so a workflow stage includes the
+    downloads and files of the stages it runs. File records name the innermost open stage.
+    Collection is process-wide and thread-safe, so download threads count into the stage
+    that started them; work done in worker processes is recorded by the parent from the
+    results the workers return.
+
+    Peak RSS is the high-water mark of the process since it started, as the operating
+    system reports it, read at the end of each stage: a stage that follows a heavier one
+    reports the heavier stage's peak. It is None where the resource module is missing (Windows).
+
+    Parameters:
+    - command: Command line recorded with the metrics. Defaults to sys.argv.
+    """
+
+    def __init__(self, command=None):
+        self.command = list(command if command is not None else sys.argv)
+        self.started = time.time()
+        self.stages = []
+        self.files = []
+        self._open = []
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, name, **labels):
+        """
+        Time a stage and record its counters and the peak RSS of the process reached by its end.
+
+        Parameters:
+        - name: Stage name, e.g. 'download' or 'merge'.
+        - labels: Extra JSON-serializable fields stored with the stage.
+
+        Yields:
+        - The stage record.
+        """
+        record = {"name": name, "parent": None, "started": _timestamp(time.time()), "status": "running"}
+        record.update(labels)
+        record.update(dict.fromkeys(COUNTERS, 0))
+        with self._lock:
+            if self._open:
+                record["parent"] = self._open[-1]["name"]
+            self._open.append(record)
+            self.stages.append(record)
+        start = time.perf_counter()
+        try:
+            yield record
+            record["status"] = "ok"
+        except BaseException:
+            record["status"] = "failed"
+            raise
+        finally:
+            record["seconds"] = round(time.perf_counter() - start, 6)
+            record["peak_rss_bytes"] = _max_rss_bytes()
+            record["peak_rss_children_bytes"] = _max_rss_bytes(children=True)
+            with self._lock:
+                self._open.remove(record)
+
+    def skip(self, name, reason):
+        """
+        Record a stage that was not run, e.g. because its outputs are up to date.
+        """
+        record = {"name": name, "parent": None, "started": _timestamp(time.time()), "status": "skipped",
+                  "reason": reason, "seconds": 0.0}
+        record.update(dict.fromkeys(COUNTERS, 0))
+        with self._lock:
+            if self._open:
+                record["parent"] = self._open[-1]["name"]
+            self.stages.append(record)
+
+    def count(self, **counters):
+        """
+        Add counters (e.g. rows_read=100) to every open stage.
+        """
+        with self._lock:
+            for record in self._open:
+                for name, value in counters.items():
+                    record[name] += value or 0
+
+    def file(self, path, **fields):
+        """
+        Record one file read, written or downloaded, and add its counters to the open stages.
+
+        Parameters:
+        - path: Path of the file.
+        - fields: Counters (see COUNTERS) and other fields such as url, status or seconds.
+        """
+        record = {"path": path}
+        record.update(fields)
+        with self._lock:
+            record["stage"] = self._open[-1]["name"] if self._open else None
+            self.files.append(record)
+            for stage in self._open:
+                for name in COUNTERS:
+                    stage[name] += fields.get(name) or 0
+
+    def report(self):
+        """
+        Return the metrics as a JSON-serializable dict.
+        """
+        finished = time.time()
+        top = [stage for stage in self.stages if stage["parent"] is None]
+        return {
+            "command": self.command,
+            "started": _timestamp(self.started),
+            "finished": _timestamp(finished),
+            "seconds": round(finished - self.started, 6),
+            "status": "failed" if any(stage["status"] == "failed" for stage in top) else "ok",
+            "peak_rss_bytes": _max_rss_bytes(),
+            "peak_rss_children_bytes": _max_rss_bytes(children=True),
+            "totals": {name: sum(stage[name] for stage in top) for name in COUNTERS},
+            "stages": self.stages,
+            "files": self.files,
+        }
+
+    def write_json(self, path):
+        """
+        Write the metrics report to path.
+        """
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as file:
+            json.dump(self.report(), file, indent=2)
+        os.replace(tmp_path, path)
+        logger.info(f"Metrics written to {path}")
+
+
+# Metrics of the current run; None when collection is disabled, which makes every call below a no-op
+_current = None
+
+
+def enable(command=None):
+    """
+    Start collecting metrics for this process and return the RunMetrics.
+    """
+    global _current
+    _current = RunMetrics(command)
+    return _current
+
+
+def disable():
+    global _current
+    _current = None
+
+
+def current():
+    return _current
+
+
+@contextmanager
+def stage(name, **labels):
+    """
+    Time a stage of the current run (see RunMetrics.stage). Yields None when metrics are disabled.
+    """
+    if _current is None:
+        yield None
+        return
+    with _current.stage(name, **labels) as record:
+        yield record
+
+
+def skip(name, reason):
+    if _current is not None:
+        _current.skip(name, reason)
+
+
+def count(**counters):
+    if _current is not None:
+        _current.count(**counters)
+
+
+def file_read(path, rows=None):
+    """
+    Record a file read by the current stage, with its size and the number of rows read from it.
+    """
+    if _current is not None:
+        _current.file(path, bytes_read=path_size(path), rows_read=rows or 0)
+
+
+def file_written(path, rows=None):
+    """
+    Record a file (or dataset directory) written by the current stage, with its size and row count.
+    """
+    if _current is not None:
+        _current.file(path, bytes_written=path_size(path), rows_written=rows or 0)
+
+
+def file_downloaded(path, url, transferred, retries, seconds, status):
+    """
+    Record one download attempt: bytes transferred, HTTP retries, wall time and
+    status ('downloaded', 'unchanged', 'cached' or 'failed').
+    """
+    if _current is not None:
+        _current.file(path, url=url, bytes_downloaded=transferred, retries=retries, seconds=round(seconds, 6),
+                      status=status)
+
+
+def configure_logging(level="INFO", stream=None):
+    """
+    Show log messages at level and above on stream (standard output by default, where the scripts printed them).
+    """
+    logging.basicConfig(level=getattr(logging, level.upper()), format=LOG_FORMAT, stream=stream or sys.stdout)
+
+
+@contextmanager
+def profiling(path=None):
+    """
+    Profile the enclosed code with cProfile and write the statistics to path.
+
+    View the statistics with 'python -m pstats <path>' or a viewer such as snakeviz.
+    Does nothing when path is None.
+    """
+    if not path:
+        yield
+        return
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        profiler.dump_stats(path)
+        logger.info(f"Profile written to {path}")
+
+
+def add_arguments(parser):
+    """
+    Add the --log-level, --metrics-json and --profile options to a command-line parser.
+    """
+    group = parser.add_argument_group("logging and metrics")
+    group.add_argument("--log-level", choices=LOG_LEVELS, default="INFO",
+                       help="Level of the messages shown. Defaults to INFO.")
+    group.add_argument("--metrics-json",
+                       help="Write wall time, bytes, rows, HTTP retries and peak RSS per stage and file to this JSON file.")
+    group.add_argument("--profile", help="Write cProfile statistics for the run to this file.")
+
+
+@contextmanager
+def instrumented(args, command, stream=None):
+    """
+    Set up logging, metrics and profiling for a command from the options added by add_arguments.
+
+    The whole command is recorded as one stage; the metrics file is written even when the
+    command fails, with the failed stages marked as such.
+
+    Parameters:
+    - args: Parsed arguments.
+    - command: Name of the command, used as the top-level stage name.
+    - stream: Stream for the log messages, see configure_logging.
+    """
+    configure_logging(args.log_level, stream)
+    recorder = enable() if args.metrics_json else None
+    try:
+        with profiling(args.profile), stage(command):
+            yield recorder
+    finally:
+        if recorder is not None:
+            disable()
+            recorder.write_json(args.metrics_json)
@@ -1,68 +1,276 @@
 import os
+import csv
+import datetime
+import logging
 import argparse
 import requests
-import pandas as pd
 
-def download_file(target_directory, filename):
+from opentrakr import download_cache, metrics
+from opentrakr.compression import TEXT_CODECS, codec_for, open_file, with_codec
+from opentrakr.download_utils import create_session, download_to_file
+from opentrakr.manifest import DownloadManifest
+from opentrakr.pipeline import StageRunner
+
+logger = logging.getLogger(__name__)
+
+NARMS_URL = "https://www.fda.gov/media/93325/download?attachment"
+
+def download_file(target_directory, filename, url=NARMS_URL, force=False):
     """
-    Download a file from a hardcoded URL and save it to the target directory.
+    Download a file from the NARMS URL and save it to the target directory.
+
+    The file is streamed to a .part file, resumed with Range requests if the transfer
+    is interrupted, and only renamed into place once its size has been verified.
+    A manifest in target_directory is used to skip the download when the file is unchanged.
 
     Parameters:
     - target_directory: The local directory to save the downloaded file.
     - filename: Optional. The name to save the file as. If not provided, the name will be derived from the URL.
-    """
-    # Hardcoded URL
-    url = "https://www.fda.gov/media/93325/download?attachment"
+    - url: The URL to download. Defaults to the FDA NARMS retail isolates workbook.
+    - force: Download the file even if the manifest shows it is unchanged.
 
+    Returns:
+    - The path of the downloaded file, or None if the download failed.
+    """
     # Ensure the target directory exists
     os.makedirs(target_directory, exist_ok=True)
 
     file_path = os.path.join(target_directory, filename)
 
     # Download the file
-    response = requests.get(url, stream=True)
-    if response.status_code == 200:
-        with open(file_path, 'wb') as file:
-            for chunk in response.iter_content(chunk_size=8192):
-                file.write(chunk)
-        print(f"Downloaded {filename} to {file_path}")
-        return file_path
-    else:
-        print(f"Failed to download the file. HTTP status code: {response.status_code}")
+    manifest = DownloadManifest(target_directory)
+    try:
+        result = download_to_file(create_session(), url, file_path, manifest=manifest, force=force)
+    except requests.RequestException as e:
+        logger.error(f"Failed to download the file: {e}")
         return None
+    finally:
+        manifest.save()
+    if result.not_modified:
+        logger.info(f"{filename} is unchanged; skipping download")
+    else:
+        logger.info(f"Downloaded {filename} to {file_path}")
+    return file_path
+
+def sheet_rows(excel_file, sheet=None):
+    """
+    Yield the rows of a worksheet as tuples of cell values, one row at a time.
+
+    The workbook is opened read-only, so rows are parsed from the sheet XML as they are
+    read and memory does not grow with the number of rows.
+
+    Parameters:
+    - excel_file: Path to the Excel file.
+    - sheet: Sheet name or 0-based index. Defaults to the first sheet.
+    """
+    try:
+        import openpyxl
+    except ImportError as e:
+        raise ImportError("Converting Excel files requires openpyxl. Install it with 'pip install openpyxl'.") from e
+
+    # A file object is passed so files without an .xlsx extension (e.g. the FDA download) are accepted
+    with open(excel_file, "rb") as handle:
+        yield from _worksheet_rows(openpyxl.load_workbook(handle, read_only=True, data_only=True), excel_file, sheet)
 
-def convert_to_tab_delimited(excel_file, output_file):
+def _worksheet_rows(workbook, excel_file, sheet):
+    try:
+        if sheet is None or isinstance(sheet, int):
+            index = sheet or 0
+            if index >= len(workbook.worksheets):
+                raise ValueError(f"{excel_file} has {len(workbook.worksheets)} sheets; there is no sheet {index}.")
+            worksheet = workbook.worksheets[index]
+        elif sheet in workbook.sheetnames:
+            worksheet = workbook[sheet]
+        else:
+            raise ValueError(f"No sheet '{sheet}' in {excel_file}. Sheets: {', '.join(workbook.sheetnames)}.")
+        # The stored sheet dimensions are not always right; read the rows as they are
+        worksheet.reset_dimensions()
+        yield from worksheet.iter_rows(values_only=True)
+    finally:
+        workbook.close()
+
+def cell_text(value):
+    """
+    Format a cell value as pandas.read_excel followed by to_csv would write it.
+
+    Whole-number floats are written as integers and dates without a time of day as YYYY-MM-DD.
+    """
+    if value is None:
+        return ""
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    if isinstance(value, datetime.datetime):
+        if value.time() == datetime.time(0):
+            return value.date().isoformat()
+        return value.isoformat(sep=" ")
+    if isinstance(value, (datetime.date, datetime.time)):
+        return value.isoformat()
+    return str(value)
+
+def _header(row):
+    # Empty and repeated column names are renamed as pandas does ("Unnamed: 3", "name.1")
+    names, seen = [], {}
+    for index, value in enumerate(row):
+        name = cell_text(value) or f"Unnamed: {index}"
+        if name in seen:
+            seen[name] += 1
+            name = f"{name}.{seen[name]}"
+        seen.setdefault(name, 0)
+        names.append(name)
+    return names
+
+def _trimmed(row):
+    end = len(row)
+    while end and (row[end - 1] is None or row[end - 1] == ""):
+        end -= 1
+    return row[:end]
+
+def _widen(path, codec, width):
+    # Rewrite a tab-delimited file with Unnamed columns added up to width, as pandas names
+    # the columns of values beyond the last header cell
+    wide_path = f"{path}.wide"
+    try:
+        with open_file(path, "rt", codec=codec, newline="") as file, \
+                open_file(wide_path, "wt", codec=codec, newline="") as out:
+            reader = csv.reader(file, delimiter="\t")
+            writer = csv.writer(out, delimiter="\t", lineterminator=os.linesep)
+            header = next(reader)
+            writer.writerow(header + [f"Unnamed: {index}" for index in range(len(header), width)])
+            for row in reader:
+                writer.writerow(row + [""] * (width - len(row)))
+        os.replace(wide_path, path)
+    finally:
+        if os.path.exists(wide_path):
+            os.remove(wide_path)
+
+def stream_to_tab_delimited(excel_file, output_file, sheet=None):
+    """
+    Write a worksheet to a tab-delimited file row by row, without building a DataFrame.
+
+    As with pandas.read_excel, the first non-empty row is the header and empty rows are kept
+    except at the end of the sheet. Unlike read_excel followed by to_csv, whole numbers and
+    booleans in columns with empty cells are written as they appear in the sheet (1, True)
+    rather than as floats (1.0). Values beyond the last header cell are kept under
+    'Unnamed: <index>' columns, which takes a second pass over the output. The output is
+    written to a temporary file and renamed into place when complete; it is compressed if
+    output_file ends with .gz or .zst.
+
+    Parameters:
+    - excel_file: Path to the Excel file.
+    - output_file: Path of the tab-delimited output.
+    - sheet: Sheet name or 0-based index. Defaults to the first sheet.
+
+    Returns:
+    - The number of data rows written.
+    """
+    tmp_path = f"{output_file}.tmp"
+    codec = codec_for(output_file)
+    rows = 0
+    blank = 0
+    width = None
+    widest = 0
+    try:
+        with open_file(tmp_path, "wt", codec=codec, newline="") as out:
+            writer = csv.writer(out, delimiter="\t", lineterminator=os.linesep)
+            for row in sheet_rows(excel_file, sheet):
+                row = _trimmed(row)
+                if not row:
+                    # Empty rows are written once a later row shows they are not trailing
+                    blank += width is not None
+                    continue
+                if width is None:
+                    header = _header(row)
+                    width = len(header)
+                    writer.writerow(header)
+                    continue
+                widest = max(widest, len(row))
+                writer.writerows([[""] * width] * blank)
+                writer.writerow([cell_text(value) for value in row] + [""] * (width - len(row)))
+                rows += blank + 1
+                blank = 0
+        if width is not None and widest > width:
+            logger.info(f"{excel_file} has values beyond the last header column; adding {widest - width} Unnamed columns")
+            _widen(tmp_path, codec, widest)
+        os.replace(tmp_path, output_file)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return rows
+
+def convert_to_tab_delimited(excel_file, output_file, sheet=None, force=False):
     """
     Convert an Excel file to a tab-delimited text file.
 
+    The worksheet is streamed row by row (see stream_to_tab_delimited). The conversion is
+    skipped when the Excel file has the same content hash, and the sheet is the same, as
+    at the last conversion and the output is unchanged; the record is kept in the output folder.
+
     Parameters:
     - excel_file: Path to the Excel file to be converted.
     - output_file: Path to save the converted tab-delimited file.
+    - sheet: Sheet name or 0-based index. Defaults to the first sheet.
+    - force: Convert even if the Excel file is unchanged.
+
+    Returns:
+    - The path of the tab-delimited file, or None if the conversion failed.
     """
-    try:
-        # Load the Excel file
-        df = pd.read_excel(excel_file)
+    runner = StageRunner(os.path.dirname(output_file) or ".", ("convert",), force=force)
+
+    def convert():
+        rows = stream_to_tab_delimited(excel_file, output_file, sheet)
+        metrics.file_read(excel_file, rows)
+        metrics.file_written(output_file, rows)
+        logger.info(f"Converted {excel_file} to tab-delimited file {output_file} ({rows} rows)")
 
-        # Save as tab-delimited file
-        df.to_csv(output_file, sep='\t', index=False)
-        print(f"Converted {excel_file} to tab-delimited file {output_file}")
+    try:
+        runner.run(f"convert:{os.path.basename(output_file)}", convert, inputs=[excel_file],
+                   outputs=[output_file], params={"sheet": sheet})
     except Exception as e:
-        print(f"Error converting file: {e}")
+        logger.error(f"Error converting file: {e}")
+        return None
+    return output_file
+
+def parse_sheet(value):
+    """
+    Sheet argument: a 0-based index if numeric, otherwise a sheet name.
+    """
+    return int(value) if value.isdigit() else value
+
+DESCRIPTION = 'Download a hardcoded file from the FDA website and convert it to a tab-delimited file.'
 
-def main():
-    parser = argparse.ArgumentParser(description='Download a hardcoded file from the FDA website and convert it to a tab-delimited file.')
+def add_arguments(parser):
+    """
+    Add the command-line options of this script to parser.
+    """
     parser.add_argument('-t', '--target', type=str, default='metadata_narms', help='Target directory to save the downloaded file. Defaults to the current directory.')
     parser.add_argument('-f', '--filename', type=str, default='narms_retail.xlsx', help='Optional custom filename to save the file as.')
+    parser.add_argument('--force', action='store_true', help='Download and convert the file even if it is unchanged since the last run.')
     parser.add_argument('-o', '--output', type=str, default='narms_retail.txt', help='Optional custom filename for the tab-delimited output file.')
-    args = parser.parse_args()
+    parser.add_argument('--compression', choices=TEXT_CODECS, help='Compress the tab-delimited output with gzip or zstd, adding .gz or .zst to its name. An output named *.gz or *.zst is compressed without it.')
+    parser.add_argument('-s', '--sheet', type=parse_sheet, help='Sheet to convert, by name or 0-based index. Defaults to the first sheet.')
+    metrics.add_arguments(parser)
+    download_cache.add_arguments(parser)
 
-    # Download the file
-    excel_file_path = download_file(args.target, args.filename)
+def run(args):
+    """
+    Run the script with arguments parsed by a parser set up with add_arguments.
+    """
+    with metrics.instrumented(args, "narms"):
+        download_cache.configure_from_args(args)
+        # Download the file
+        with metrics.stage("download"):
+            excel_file_path = download_file(args.target, args.filename, force=args.force)
+
+        # Convert to tab-delimited if the download succeeded
+        if excel_file_path:
+            output_file_path = with_codec(os.path.join(args.target, args.output), args.compression)
+            with metrics.stage("convert"):
+                convert_to_tab_delimited(excel_file_path, output_file_path, args.sheet, args.force)
 
-    # Convert to tab-delimited if the download succeeded
-    if excel_file_path:
-        output_file_path = os.path.join(args.target, args.output)
-        convert_to_tab_delimited(excel_file_path, output_file_path)
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=DESCRIPTION)
+    add_arguments(parser)
+    run(parser.parse_args(argv))
 
 if __name__ == "__main__":
     main()
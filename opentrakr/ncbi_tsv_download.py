@@ -1,81 +1,195 @@
 #!/usr/bin/env python3
 
-import requests
 import os
 import re
+import time
 import argparse
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from opentrakr import download_cache, metrics
+from opentrakr.download_utils import (
+    DEFAULT_PER_HOST,
+    DEFAULT_WORKERS,
+    DownloadSummary,
+    create_session,
+    download_many,
+    fetch_text,
+)
+from opentrakr.manifest import DownloadManifest
+
+logger = logging.getLogger(__name__)
+
+BASE_URL = 'https://ftp.ncbi.nlm.nih.gov/pathogen/Results'
+METADATA_PATTERN = r'href="([^"]+\.tsv)"'
+CLUSTER_PATTERN = r'href="((?![^"]*SNP_distances)[^"]+\.tsv)"'
+RELEASE_PATTERN = re.compile(r'(PDG\d+\.\d+)')
+
+def release_from_files(files):
+    """
+    Return the PDG release (e.g. PDG000000002.3187) named by a latest_snps file listing, if any.
+    """
+    releases = sorted({m.group(1) for _, name in files for m in [RELEASE_PATTERN.search(name)] if m})
+    return ",".join(releases) or None
 
-def download_tsv_files(base_url, target_directory):
+def list_tsv_files(base_url, pattern, session=None):
     """
-    Download all *.tsv files from a specified subdirectory on the NCBI FTP site using base Python.
+    List the *.tsv files linked from a directory listing on the NCBI FTP site.
 
     Parameters:
     - base_url: The URL of the subdirectory containing the *.tsv files.
-    - target_directory: The local directory to save the downloaded files.
+    - pattern: Regular expression with one group capturing each file link.
+    - session: Optional requests session to reuse pooled connections.
+
+    Returns:
+    - A list of (download_url, file_name) tuples, or None if the listing could not be fetched.
     """
-    # Ensure the target directory exists
-    os.makedirs(target_directory, exist_ok=True)
+    session = session or create_session()
+    listing = fetch_text(session, base_url)
+    if listing is None:
+        return None
+    return [(f"{base_url}/{href}", href.split('/')[-1]) for href in re.findall(pattern, listing)]
 
-    response = requests.get(base_url)
-    if response.status_code != 200:
-        print(f"Failed to access {base_url}")
-        return
+def download_tsv_files(base_url, target_directory, session=None, workers=DEFAULT_WORKERS, manifest=None):
+    """
+    Download all *.tsv files from a specified subdirectory on the NCBI FTP site.
 
-    # Use a regular expression to find all .tsv file links
-    file_links = re.findall(r'href="([^"]+\.tsv)"', response.text)
-
-    for href in file_links:
-        download_url = f"{base_url}/{href}"
-        file_response = requests.get(download_url)
-        if file_response.status_code == 200:
-            file_path = os.path.join(target_directory, href.split('/')[-1])
-            with open(file_path, 'wb') as file:
-                file.write(file_response.content)
-            print(f"Downloaded {href} to {target_directory}")
-        else:
-            print(f"Failed to download {href}")
-
-def download_cluster_tsv_files(base_url, target_directory):
+    Parameters:
+    - base_url: The URL of the subdirectory containing the *.tsv files.
+    - target_directory: The local directory to save the downloaded files.
+    - session: Optional requests session to reuse pooled connections.
+    - workers: Number of concurrent downloads.
+    - manifest: Optional DownloadManifest used to skip unchanged files.
+
+    Returns:
+    - A DownloadSummary describing the downloads.
+    """
+    return _download_listed_files(base_url, METADATA_PATTERN, target_directory, session, workers, manifest)
+
+def download_cluster_tsv_files(base_url, target_directory, session=None, workers=DEFAULT_WORKERS, manifest=None):
     """
     Download all *.tsv files from the clusters subdirectory on the NCBI FTP site.
 
     Parameters:
     - base_url: The URL of the subdirectory containing the *.tsv files.
     - target_directory: The local directory to save the downloaded files.
+    - session: Optional requests session to reuse pooled connections.
+    - workers: Number of concurrent downloads.
+    - manifest: Optional DownloadManifest used to skip unchanged files.
+
+    Returns:
+    - A DownloadSummary describing the downloads.
     """
+    return _download_listed_files(base_url, CLUSTER_PATTERN, target_directory, session, workers, manifest)
+
+def _download_listed_files(base_url, pattern, target_directory, session, workers, manifest):
     # Ensure the target directory exists
     os.makedirs(target_directory, exist_ok=True)
 
-    response = requests.get(base_url, timeout=10)
-    if response.status_code != 200:
-        print(f"Failed to access {base_url}")
-        return
+    session = session or create_session(pool_size=max(workers, DEFAULT_PER_HOST))
+    summary = DownloadSummary()
+    files = list_tsv_files(base_url, pattern, session)
+    if files is None:
+        summary.record_failure(base_url, "directory listing unavailable")
+        return summary
+
+    jobs = [(url, os.path.join(target_directory, name)) for url, name in files]
+    return download_many(jobs, workers=workers, session=session, summary=summary, manifest=manifest)
+
+def download_all(bacteria_list, base_url, target_directory, workers=DEFAULT_WORKERS, per_host=DEFAULT_PER_HOST,
+                 force=False):
+    """
+    Download the Metadata and Clusters TSV files for several bacteria at once.
+
+    Directory listings and file downloads for all bacteria are fetched concurrently
+    over a single pooled session, with at most per_host requests in flight per host.
+
+    A manifest in target_directory records each file's ETag, Last-Modified, size and
+    hash, and the PDG release each latest_snps directory pointed to. Directories whose
+    release is unchanged and whose files are intact are skipped without further requests;
+    other files are fetched with conditional requests and skipped if unchanged.
+
+    Parameters:
+    - bacteria_list: Names of the bacteria to download.
+    - base_url: The NCBI pathogen Results URL.
+    - target_directory: The local directory to save the downloaded files.
+    - workers: Number of concurrent listing and download requests.
+    - per_host: Maximum number of concurrent requests to a single host.
+    - force: Re-download every file even if the manifest shows it is unchanged.
 
-    file_links = re.findall(r'href="((?![^"]*SNP_distances)[^"]+\.tsv)"', response.text)
+    Returns:
+    - A DownloadSummary describing all downloads.
+    """
+    os.makedirs(target_directory, exist_ok=True)
 
-    for href in file_links:
-        download_url = f"{base_url}/{href}"
-        file_response = requests.get(download_url)
-        if file_response.status_code == 200:
-            file_path = os.path.join(target_directory, href.split('/')[-1])
-            with open(file_path, 'wb') as file:
-                file.write(file_response.content)
-            print(f"Downloaded {href} to {target_directory}")
-        else:
-            print(f"Failed to download {href}")
+    session = create_session(pool_size=max(workers, per_host))
+    manifest = DownloadManifest(target_directory)
+    summary = DownloadSummary()
+    start = time.time()
+
+    directories = []
+    for bacteria in bacteria_list:
+        for subdirectory, pattern in (("Metadata", METADATA_PATTERN), ("Clusters", CLUSTER_PATTERN)):
+            directories.append((f"{bacteria}/{subdirectory}", f"{base_url}/{bacteria}/latest_snps/{subdirectory}", pattern))
+
+    jobs = []
+    releases = {}
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, per_host))) as executor:
+        listings = executor.map(lambda d: (d[0], d[1], list_tsv_files(d[1], d[2], session)), directories)
+        for key, directory_url, files in listings:
+            if files is None:
+                summary.record_failure(directory_url, "directory listing unavailable")
+                continue
+            release = release_from_files(files)
+            directory_jobs = [(url, os.path.join(target_directory, name)) for url, name in files]
+            if (not force and release and manifest.get_release(key) == release
+                    and all(manifest.is_current(path, url) for url, path in directory_jobs)):
+                logger.info(f"{key} is unchanged at release {release}; skipping")
+                for url, path in directory_jobs:
+                    summary.record_skipped(url, path)
+                continue
+            logger.info(f"Found {len(files)} files in {directory_url}")
+            releases[key] = (release, directory_jobs)
+            jobs.extend(directory_jobs)
+
+    download_many(jobs, workers=workers, per_host=per_host, session=session, summary=summary,
+                  manifest=manifest, force=force)
+
+    # Only mark a release as synced once every file from its directory is in place
+    failed_urls = {url for url, _ in summary.failed}
+    for key, (release, directory_jobs) in releases.items():
+        if release and not any(url in failed_urls for url, _ in directory_jobs):
+            manifest.set_release(key, release)
+    manifest.save()
+
+    summary.elapsed = time.time() - start
+    return summary
 
 def list_available_bacteria():
     return ['Salmonella', 'Listeria', 'Campylobacter', 'Escherichia_coli_Shigella']
 
-def main():
-    bacteria_list = list_available_bacteria()
-    base_url = 'https://ftp.ncbi.nlm.nih.gov/pathogen/Results'
+DESCRIPTION = 'Download TSV files from the NCBI FTP site.'
 
-    parser = argparse.ArgumentParser(description='Download TSV files from the NCBI FTP site.')
+def add_arguments(parser):
+    """
+    Add the command-line options of this script to parser.
+    """
     parser.add_argument('-b', '--bacteria', type=str, help='Name of the bacteria to process. If not provided, all bacteria will be processed.')
     parser.add_argument('-l', '--list', action='store_true', help='List available bacteria and exit.')
     parser.add_argument('-t', '--output_folder', type=str, default='metadata_ncbi', help='Target directory to save the downloaded files. Defaults to metadata_ncbi.')
-    args = parser.parse_args()
+    parser.add_argument('--base_url', type=str, default=BASE_URL, help='Base URL of the NCBI pathogen Results directory (e.g. a local mirror).')
+    parser.add_argument('-w', '--workers', type=int, default=DEFAULT_WORKERS, help=f'Number of concurrent downloads across all bacteria. Defaults to {DEFAULT_WORKERS}.')
+    parser.add_argument('--force', action='store_true', help='Re-download all files even if the manifest shows they are unchanged.')
+    parser.add_argument('--per_host', type=int, default=DEFAULT_PER_HOST, help=f'Maximum number of concurrent requests per host. Defaults to {DEFAULT_PER_HOST}.')
+    parser.add_argument('--snp_distances', type=int, metavar='MAX_SNPS', help='Also stream the SNP_distances tables and keep the pairs at most MAX_SNPS apart in compact stores (see snp_distances.py).')
+    metrics.add_arguments(parser)
+    download_cache.add_arguments(parser)
+
+def run(args):
+    """
+    Run the script with arguments parsed by a parser set up with add_arguments.
+    """
+    bacteria_list = list_available_bacteria()
 
     if args.list:
         print("Available bacteria:")
@@ -87,20 +201,29 @@ def main():
 
     if args.bacteria:
         if args.bacteria not in bacteria_list:
-            print(f"Bacteria '{args.bacteria}' not found in the available list.")
-            print("Use the -l or --list option to see all available bacteria.")
+            logger.error(f"Bacteria '{args.bacteria}' not found in the available list.")
+            logger.error("Use the -l or --list option to see all available bacteria.")
             return
         bacteria_list = [args.bacteria]
 
-    for bacteria in bacteria_list:
-        print(f"Processing {bacteria}...")
-        bacteria_url = f"{base_url}/{bacteria}/latest_snps/Metadata"
-        download_tsv_files(bacteria_url, target_directory)
-
-    for bacteria in bacteria_list:
-        print(f"Processing {bacteria}...")
-        bacteria_url = f"{base_url}/{bacteria}/latest_snps/Clusters"
-        download_cluster_tsv_files(bacteria_url, target_directory)
+    with metrics.instrumented(args, "download"):
+        download_cache.configure_from_args(args)
+        logger.info(f"Processing {', '.join(bacteria_list)}...")
+        summary = download_all(bacteria_list, args.base_url, target_directory, workers=args.workers,
+                               per_host=args.per_host, force=args.force)
+        logger.info(f"Download summary: {summary}")
+        for url, reason in summary.failed:
+            logger.warning(f"Failed: {url} ({reason})")
+        if args.snp_distances is not None:
+            from opentrakr.snp_distances import ingest_snp_distances
+
+            with metrics.stage("snp_distances"):
+                ingest_snp_distances(bacteria_list, args.base_url, target_directory, args.snp_distances, args.force)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=DESCRIPTION)
+    add_arguments(parser)
+    run(parser.parse_args(argv))
 
 if __name__ == "__main__":
     main()
@@ -1,8 +1,275 @@
 import argparse
-import pandas as pd
+import csv
+import io
+import logging
+import mmap
 import os
+import shutil
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
 
-def read_and_label_files(directory, file_pattern, label_column, label_value):
+from opentrakr import metrics
+from opentrakr.columnar import (
+    DEFAULT_COMPRESSION,
+    FORMATS,
+    arrow_schema,
+    read_arrow_file,
+    write_arrow_file,
+    write_partitioned_dataset,
+)
+from opentrakr.compression import codec_for, open_file, split_codec, text_codec, with_codec
+from opentrakr.download_cache import parse_size
+from opentrakr.fingerprints import (
+    diff_fingerprints,
+    fingerprint_map,
+    fingerprint_output,
+    fingerprint_path,
+    fingerprint_records,
+    iter_records,
+    read_fingerprints,
+    record_fields,
+    summarize,
+    write_diff,
+    write_fingerprints,
+)
+from opentrakr.schemas import NCBI_METADATA, concat_frames
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CHUNKSIZE = 100000
+DEFAULT_SPLIT_SIZE = 64 * 1024 * 1024
+COPY_BUFFER = 1024 * 1024
+
+def find_files(directory, file_pattern):
+    """
+    Return the sorted paths of files in directory whose names end with file_pattern, either
+    as is or compressed (e.g. a.metadata.tsv.gz or a.metadata.tsv.zst for '.metadata.tsv').
+    """
+    return [
+        os.path.join(directory, filename)
+        for filename in sorted(os.listdir(directory))
+        if split_codec(filename)[0].endswith(file_pattern)
+    ]
+
+def merged_columns(filepaths, column_mode="union", label_column=None):
+    """
+    Compute the output column set for a merge from the headers of the input files.
+
+    Parameters:
+    - filepaths: Paths of the tab-delimited input files.
+    - column_mode: 'union' keeps every column seen in any file, 'common' only the columns present in all files.
+    - label_column: Optional label column appended to the column set.
+
+    Returns:
+    - A list of column names in order of first appearance.
+    """
+    import pandas as pd
+
+    columns = []
+    common = None
+    for filepath in filepaths:
+        header = list(pd.read_csv(filepath, sep="\t", dtype=str, nrows=0).columns)
+        columns.extend(column for column in header if column not in columns)
+        common = set(header) if common is None else common & set(header)
+    if column_mode == "common" and common is not None:
+        columns = [column for column in columns if column in common]
+    if label_column and label_column not in columns:
+        columns.append(label_column)
+    return columns
+
+def _read_options(filepath, schema):
+    # Schema columns get their declared types and everything else is read as text
+    if schema is None:
+        return {"sep": "\t", "dtype": str}
+    return schema.read_options(filepath, sep="\t", default=str, source=os.path.basename(filepath))
+
+def _aligned(chunk, columns, label_column, label, schema):
+    # Label a chunk, apply the schema's types and align it to the merged columns
+    if label_column:
+        chunk[label_column] = label
+    if schema is not None:
+        chunk = schema.apply(chunk)
+    return chunk.reindex(columns=columns)
+
+def iter_merged_chunks(filepaths, columns, label_column, label_value, chunksize=DEFAULT_CHUNKSIZE, schema=None):
+    """
+    Yield labelled chunks of the input files, each aligned to columns (missing columns are left empty).
+    """
+    import pandas as pd
+
+    for filepath in filepaths:
+        label = label_value(os.path.basename(filepath)) if label_column else None
+        rows = 0
+        for chunk in pd.read_csv(filepath, chunksize=chunksize, **_read_options(filepath, schema)):
+            rows += len(chunk)
+            yield _aligned(chunk, columns, label_column, label, schema)
+        metrics.file_read(filepath, rows)
+        logger.info(f"Merged {filepath}")
+
+def stream_merge_files(filepaths, output_file, label_column, label_value, column_mode="union",
+                       chunksize=DEFAULT_CHUNKSIZE, output_format="tsv", compression=None, schema=None):
+    """
+    Merge files into output_file chunk by chunk, so memory use does not grow with the input size.
+
+    Each chunk is aligned to the merged column set (missing columns are left empty),
+    labelled, and appended to the output before the next chunk is read.
+
+    Parameters:
+    - filepaths: Paths of the tab-delimited input files.
+    - output_file: Path of the merged tab-delimited output file (compressed if it ends with
+      .gz or .zst), or dataset directory for columnar formats.
+    - label_column: Name of the column to add as a label (e.g., 'type').
+    - label_value: Function to determine the label value based on the filename.
+    - column_mode: 'union' or 'common', see merged_columns.
+    - chunksize: Number of rows read per chunk.
+    - output_format: 'tsv', or 'parquet'/'feather' for a dataset partitioned by label_column.
+    - compression: Compression codec for columnar formats; tsv output is compressed by the
+      suffix of output_file.
+    - schema: Optional schemas.TableSchema giving the column types of the input files.
+
+    Returns:
+    - The number of rows written.
+    """
+    columns = merged_columns(filepaths, column_mode, label_column)
+    chunks = iter_merged_chunks(filepaths, columns, label_column, label_value, chunksize, schema)
+    if output_format != "tsv":
+        schema = arrow_schema(columns, label_column)
+        rows = write_partitioned_dataset(chunks, output_file, label_column, output_format,
+                                         compression or DEFAULT_COMPRESSION, schema=schema)
+    else:
+        rows = 0
+        with open_file(output_file, "wt", newline="") as out:
+            out.write("\t".join(columns) + "\n")
+            for chunk in chunks:
+                chunk.to_csv(out, sep="\t", index=False, header=False)
+                rows += len(chunk)
+    metrics.file_written(output_file, rows)
+    return rows
+
+def split_ranges(filepath, split_size=DEFAULT_SPLIT_SIZE):
+    """
+    Split the data records of a tab-delimited file into byte ranges of about split_size.
+
+    Ranges end after a line end preceded by an even number of quotes, so a quoted value
+    holding a newline is never cut in two. Compressed files cannot be read from an offset
+    and, like files no larger than split_size, are kept whole.
+
+    Returns:
+    - A list of (start, end) byte offsets, or [(None, None)] for a whole file.
+    """
+    size = os.path.getsize(filepath)
+    if codec_for(filepath) or size <= split_size:
+        return [(None, None)]
+    with open(filepath, "rb") as file:
+        start = position = len(next(iter_records(file), b""))
+        ranges = []
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            quotes = 0
+            while start + split_size < size:
+                end = data.find(b"\n", max(position, start + split_size)) + 1
+                if not end:
+                    break
+                quotes += data[position:end].count(b'"')
+                position = end
+                if quotes % 2 == 0:
+                    ranges.append((start, end))
+                    start = end
+                    quotes = 0
+    ranges.append((start, size))
+    return ranges
+
+def _parse_part(filepath, start, end, options, columns, label_column, label, schema, output_format, part_path,
+                chunksize):
+    # Runs in a worker process: parse a file, or a byte range of it, and write its aligned rows
+    # to part_path as TSV rows or an Arrow IPC file; only the row count goes back to the parent
+    import pandas as pd
+
+    source = filepath
+    if start is not None:
+        with open(filepath, "rb") as file:
+            header = next(iter_records(file), b"")
+            file.seek(start)
+            source = io.BytesIO(header + file.read(end - start))
+    chunks = (
+        _aligned(chunk, columns, label_column, label, schema)
+        for chunk in pd.read_csv(source, chunksize=chunksize, **options)
+    )
+    if output_format != "tsv":
+        return write_arrow_file(chunks, part_path, arrow_schema(columns, label_column))
+    rows = 0
+    with open(part_path, "w", encoding="utf-8", newline="") as out:
+        for chunk in chunks:
+            chunk.to_csv(out, sep="\t", index=False, header=False)
+            rows += len(chunk)
+    return rows
+
+def parallel_merge_files(filepaths, output_file, label_column, label_value, column_mode="union",
+                         chunksize=DEFAULT_CHUNKSIZE, output_format="tsv", compression=None, schema=None,
+                         workers=2, split_size=DEFAULT_SPLIT_SIZE):
+    """
+    Merge files as stream_merge_files does, parsing them in worker processes.
+
+    Each file, or each byte range of a file larger than split_size (see split_ranges), is
+    parsed by a worker, which writes the labelled and aligned rows to a part file in a
+    scratch folder next to the output: formatted TSV rows, or an Arrow IPC file for
+    columnar formats. Only row counts are sent back, so no DataFrame is pickled. The parent
+    appends the TSV parts to the output in order, or memory-maps the Arrow parts and passes
+    their tables to the dataset writer without copying them, while later parts are still
+    being parsed. The output is the same as stream_merge_files writes.
+
+    Parameters:
+    - filepaths, output_file, label_column, label_value, column_mode, chunksize, output_format,
+      compression, schema: See stream_merge_files.
+    - workers: Number of worker processes.
+    - split_size: Size in bytes above which an uncompressed file is split into byte ranges.
+
+    Returns:
+    - The number of rows written.
+    """
+    columns = merged_columns(filepaths, column_mode, label_column)
+    parts = []
+    for filepath in filepaths:
+        # Drift is reported once per file, here, rather than by every worker
+        options = _read_options(filepath, schema)
+        label = label_value(os.path.basename(filepath)) if label_column else None
+        parts.extend((filepath, start, end, options, label) for start, end in split_ranges(filepath, split_size))
+    logger.info(f"Parsing {len(filepaths)} files in {len(parts)} parts with {workers} workers")
+
+    rows_read = dict.fromkeys(filepaths, 0)
+    folder = os.path.dirname(os.path.abspath(output_file))
+    with tempfile.TemporaryDirectory(dir=folder) as scratch, ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [
+            executor.submit(_parse_part, filepath, start, end, options, columns, label_column, label, schema,
+                            output_format, os.path.join(scratch, f"part-{index}"), chunksize)
+            for index, (filepath, start, end, options, label) in enumerate(parts)
+        ]
+
+        def finished_parts():
+            # Parts in input order, each as soon as it is written
+            for index, ((filepath, *_), future) in enumerate(zip(parts, futures)):
+                rows_read[filepath] += future.result()
+                yield os.path.join(scratch, f"part-{index}")
+
+        if output_format != "tsv":
+            rows = write_partitioned_dataset((read_arrow_file(path) for path in finished_parts()), output_file,
+                                             label_column, output_format, compression or DEFAULT_COMPRESSION,
+                                             schema=arrow_schema(columns, label_column))
+        else:
+            with open_file(output_file, "wt", newline="") as out:
+                out.write("\t".join(columns) + "\n")
+                out.flush()
+                for path in finished_parts():
+                    with open(path, "rb") as part:
+                        shutil.copyfileobj(part, out.buffer, COPY_BUFFER)
+                    os.remove(path)
+            rows = sum(rows_read.values())
+    for filepath, file_rows in rows_read.items():
+        metrics.file_read(filepath, file_rows)
+        logger.info(f"Merged {filepath}")
+    metrics.file_written(output_file, rows)
+    return rows
+
+def read_and_label_files(directory, file_pattern, label_column, label_value, schema=None):
     """
     Reads files matching a pattern, adds a label column, and concatenates them into a single DataFrame.
     
@@ -11,22 +278,272 @@ def read_and_label_files(directory, file_pattern, label_column, label_value):
     - file_pattern: Pattern to match files (e.g., '*.metadata.tsv' or '*.all_isolates.tsv').
     - label_column: Name of the column to add as a label (e.g., 'type').
     - label_value: Function to determine the label value based on the filename.
+    - schema: Optional schemas.TableSchema; its categorical columns are loaded as categoricals.
     
     Returns:
     - A pandas DataFrame containing the concatenated data.
     """
+    import pandas as pd
+
     dfs = []  # List to hold dataframes
-    for filename in os.listdir(directory):
-        if filename.endswith(file_pattern):
-            filepath = os.path.join(directory, filename)
-            df = pd.read_csv(filepath, sep="\t", dtype=str)
-            if label_column:
-                df[label_column] = label_value(filename)
-            dfs.append(df)
-    return pd.concat(dfs, ignore_index=True) if dfs else pd.DataFrame()
-
-def main():
-    parser = argparse.ArgumentParser(description="Merge and process metadata files.")
+    columns = []
+    for filepath in find_files(directory, file_pattern):
+        df = pd.read_csv(filepath, **_read_options(filepath, schema))
+        metrics.file_read(filepath, len(df))
+        if label_column:
+            df[label_column] = label_value(os.path.basename(filepath))
+        if schema is not None:
+            df = schema.apply(df)
+        columns.extend(column for column in df.columns if column not in columns)
+        dfs.append(df)
+    return concat_frames(dfs, columns) if dfs else pd.DataFrame()
+
+METADATA_PATTERN = '.metadata.tsv'
+
+def type_label(filename):
+    """
+    Label of the 'type' column for a metadata file: the second dot-separated field of its
+    name, which for NCBI files is the PDG release number (3187 for PDG000000002.3187.metadata.tsv).
+    It does not name the organism; that is in the 'scientific_name' column.
+    """
+    return filename.split('.')[1]
+
+def _format_rows(pending_path, source, columns, label, chunksize, out):
+    # Format rows exactly as stream_merge_files does for a whole input file
+    import pandas as pd
+
+    options = NCBI_METADATA.read_options(pending_path, sep="\t", default=str, source=source)
+    for chunk in pd.read_csv(pending_path, chunksize=chunksize, **options):
+        chunk['type'] = label
+        chunk = NCBI_METADATA.apply(chunk)
+        chunk.reindex(columns=columns).to_csv(out, sep="\t", index=False, header=False)
+
+def _relabel(record, index, label):
+    # Replace the 'type' value of a merged record, quoting as pandas does
+    if b'"' not in record:
+        values = record.rstrip(b"\r\n").split(b"\t")
+        values[index] = label.encode()
+        return b"\t".join(values) + b"\n"
+    values = record_fields(record)
+    values[index] = label
+    out = io.StringIO()
+    csv.writer(out, delimiter="\t", lineterminator="\n").writerow(values)
+    return out.getvalue().encode()
+
+def update_merged_output(filepaths, output_file, column_mode="union", chunksize=DEFAULT_CHUNKSIZE, diff_file=None):
+    """
+    Update a merged TSV for new metadata files instead of rebuilding it.
+
+    Every row of the new files is fingerprinted (accession plus content hash, see
+    opentrakr.fingerprints) and compared with the fingerprints kept next to the previous
+    output. Unchanged rows are copied byte for byte from the previous output; only added
+    and changed rows are parsed and formatted with pandas, and removed rows are dropped.
+    The result is the file a full streaming merge would write.
+
+    Parameters:
+    - filepaths: Paths of the *.metadata.tsv files.
+    - output_file: Merged TSV written by an earlier incremental merge.
+    - column_mode: 'union' or 'common', see merged_columns.
+    - chunksize: Rows per chunk when formatting added and changed rows.
+    - diff_file: Optional path for the isolates added, removed, changed and reassigned.
+
+    Returns:
+    - A dict with the number of 'rows' written and of isolates per kind of change, or None
+      if output_file has no up-to-date fingerprints or its columns changed.
+    """
+    fingerprints_file = fingerprint_path(output_file)
+    if not (os.path.exists(output_file) and os.path.exists(fingerprints_file)):
+        return None
+    if os.path.getmtime(fingerprints_file) < os.path.getmtime(output_file):
+        logger.info(f"{output_file} changed after its fingerprints were written")
+        return None
+
+    columns = merged_columns(filepaths, column_mode, 'type')
+    with open(output_file, "rb") as previous:
+        header = next(iter_records(previous), b"")
+    if record_fields(header) != columns:
+        logger.info(f"The merged columns changed since {output_file} was written")
+        return None
+
+    # Previous rows by content digest, as (offset, length) spans of the previous output
+    spans = {}
+    old = {}
+    end = 0
+    for accession, label, cluster, digest, offset, length in read_fingerprints(fingerprints_file):
+        if offset is None:
+            return None
+        spans.setdefault(digest, []).append((offset, length, label))
+        if accession:
+            old[accession] = (label, cluster, digest)
+        end = max(end, offset + length)
+    if end > os.path.getsize(output_file):
+        return None
+
+    label_index = columns.index('type')
+    new = {}
+    rows = copied = 0
+    tmp_output = f"{output_file}.tmp"
+    new_fingerprints = f"{fingerprints_file}.new"
+    folder = os.path.dirname(os.path.abspath(output_file))
+
+    def write_rows(out, previous, scratch):
+        nonlocal rows, copied
+        offset = out.tell()
+        for filepath in filepaths:
+            label = type_label(os.path.basename(filepath))
+            plan = []
+            pending_path = os.path.join(scratch, "pending.tsv")
+            with open_file(filepath, "rb") as file, open(pending_path, "wb") as pending:
+                # Added and changed rows keep their original text, so pandas reads them as in a full merge
+                header, fingerprints = fingerprint_records(file, label)
+                pending.write(header)
+                pending_rows = 0
+                for record, fingerprint in fingerprints:
+                    if fingerprint.accession:
+                        new[fingerprint.accession] = (label, fingerprint.cluster, fingerprint.digest)
+                    if spans.get(fingerprint.digest):
+                        plan.append((fingerprint, spans[fingerprint.digest].pop()))
+                        continue
+                    plan.append((fingerprint, None))
+                    if not record.endswith(b"\n"):
+                        record += b"\n"
+                    pending.write(record)
+                    pending_rows += 1
+            metrics.file_read(filepath, len(plan))
+
+            formatted_path = os.path.join(scratch, "formatted.tsv")
+            with open(formatted_path, "w", encoding="utf-8", newline="") as formatted:
+                if pending_rows:
+                    _format_rows(pending_path, os.path.basename(filepath), columns, label, chunksize, formatted)
+            with open(formatted_path, "rb") as formatted:
+                records = iter_records(formatted)
+                for fingerprint, span in plan:
+                    if span is not None:
+                        record = previous[span[0]:span[0] + span[1]]
+                        if span[2] != label:
+                            # Same row, but its file was renamed for a new PDG release
+                            record = _relabel(record, label_index, label)
+                        copied += 1
+                    else:
+                        record = next(records)
+                    yield fingerprint[:4] + (offset, len(record))
+                    out.write(record)
+                    offset += len(record)
+                    rows += 1
+            logger.info(f"Merged {filepath}: {len(plan) - pending_rows} rows unchanged, {pending_rows} added or changed")
+
+    with tempfile.TemporaryDirectory(dir=folder) as scratch:
+        with open(output_file, "rb") as file, open(tmp_output, "wb") as out:
+            with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as previous:
+                out.write(header)
+                write_fingerprints(new_fingerprints, write_rows(out, previous, scratch))
+    # Replace the output before its fingerprints, so an interruption leaves stale (and ignored) fingerprints
+    os.replace(tmp_output, output_file)
+    os.replace(new_fingerprints, fingerprints_file)
+    metrics.file_written(output_file, rows)
+
+    changes = diff_fingerprints(old, new)
+    summary = write_diff(changes, diff_file) if diff_file else summarize(changes)
+    summary["rows"] = rows
+    summary["copied"] = copied
+    return summary
+
+def _merge_metadata(directory, filepaths, output_file, column_mode, streaming, chunksize, output_format,
+                    compression, workers=1, split_size=DEFAULT_SPLIT_SIZE):
+    if workers > 1:
+        rows = parallel_merge_files(filepaths, output_file, 'type', type_label, column_mode, chunksize,
+                                    output_format, compression, NCBI_METADATA, workers, split_size)
+        logger.info(f"Merged {rows} metadata rows saved to {output_file}")
+        return rows
+    if streaming:
+        rows = stream_merge_files(filepaths, output_file, 'type', type_label, column_mode, chunksize,
+                                  output_format, compression, NCBI_METADATA)
+        logger.info(f"Merged {rows} metadata rows saved to {output_file}")
+        return rows
+
+    metadata = read_and_label_files(directory, METADATA_PATTERN, 'type', type_label, NCBI_METADATA)
+
+    # Keep the union or the common subset of columns across all metadata files
+    metadata = metadata[merged_columns(filepaths, column_mode, 'type')]
+
+    if output_format != "tsv":
+        write_partitioned_dataset(metadata, output_file, 'type', output_format, compression or DEFAULT_COMPRESSION)
+        metrics.file_written(output_file, len(metadata))
+        logger.info(f"Merged metadata saved to {output_format} dataset {output_file}")
+        return len(metadata)
+
+    # Save the merged data to a CSV file
+    with open_file(output_file, "wt", newline="") as out:
+        metadata.to_csv(out, index=False, sep='\t')
+    metrics.file_written(output_file, len(metadata))
+    logger.info(f"Merged metadata saved to {output_file}")
+    return len(metadata)
+
+def merge_metadata(directory, output_file, column_mode="union", streaming=False, chunksize=DEFAULT_CHUNKSIZE,
+                   output_format="tsv", compression=None, incremental=False, diff_file=None, workers=1,
+                   split_size=DEFAULT_SPLIT_SIZE):
+    """
+    Merge the *.metadata.tsv files in directory into one labelled output.
+
+    Parameters:
+    - directory: Directory to search for metadata files.
+    - output_file: Path of the merged output file, or dataset directory for columnar formats.
+      A tsv output ending with .gz or .zst is compressed.
+    - column_mode: 'union' or 'common', see merged_columns.
+    - streaming: Merge chunk by chunk with bounded memory instead of loading all files at once.
+    - chunksize: Rows per chunk in streaming mode.
+    - output_format: 'tsv', 'parquet' or 'feather'.
+    - compression: Codec of the output: 'gzip' or 'zstd' for tsv, which adds the .gz or .zst
+      suffix to output_file, or a pyarrow codec for columnar formats (defaults to zstd).
+    - incremental: Keep row fingerprints next to a tsv output and use them to update it on the
+      next merge instead of rebuilding it (see update_merged_output).
+    - diff_file: With incremental, write the isolates added, removed, changed and reassigned
+      since the previous merge to this file.
+    - workers: Parse the files in this many worker processes (see parallel_merge_files); the
+      merge then streams with bounded memory whether or not streaming is set.
+    - split_size: With workers, size in bytes above which a file is split into byte ranges.
+
+    Returns:
+    - The number of rows written, or None if no metadata files were found.
+    """
+    # Read and label metadata files
+    filepaths = find_files(directory, METADATA_PATTERN)
+
+    if not filepaths:
+        logger.warning("No metadata files found. Exiting.")
+        return None
+
+    if output_format == "tsv":
+        output_file = with_codec(output_file, text_codec(compression))
+    if incremental and (output_format != "tsv" or codec_for(output_file)):
+        logger.warning("Incremental merges need uncompressed tsv output; rebuilding the merged output.")
+        incremental = False
+    if not incremental:
+        return _merge_metadata(directory, filepaths, output_file, column_mode, streaming, chunksize, output_format,
+                               compression, workers, split_size)
+
+    summary = update_merged_output(filepaths, output_file, column_mode, chunksize, diff_file)
+    if summary is not None:
+        logger.info(f"Updated {output_file}: {summary['rows']} rows, {summary['copied']} unchanged; "
+                    f"{summary['added']} isolates added, {summary['removed']} removed, "
+                    f"{summary['changed']} changed, {summary['reassigned']} reassigned to another SNP cluster")
+        return summary["rows"]
+
+    # Rebuild, keeping the previous fingerprints (if any) to report what changed
+    fingerprints_file = fingerprint_path(output_file)
+    old = fingerprint_map(read_fingerprints(fingerprints_file)) if diff_file and os.path.exists(fingerprints_file) else {}
+    rows = _merge_metadata(directory, filepaths, output_file, column_mode, streaming, chunksize, output_format,
+                           compression, workers, split_size)
+    if fingerprint_output(filepaths, output_file, type_label) and diff_file:
+        write_diff(diff_fingerprints(old, fingerprint_map(read_fingerprints(fingerprints_file))), diff_file)
+    return rows
+
+DESCRIPTION = "Merge and process metadata files."
+
+def add_arguments(parser):
+    """
+    Add the command-line options of this script to parser.
+    """
     parser.add_argument(
         "directory",
         type=str,
@@ -37,28 +554,70 @@ def main():
         type=str,
         help="Path to save the merged output file."
     )
-    args = parser.parse_args()
-
-    directory = args.directory
-    output_file = args.output_file
-
-    # Read and label metadata files
-    metadata_pattern = '.metadata.tsv'
-    metadata = read_and_label_files(directory, metadata_pattern, 'type', lambda f: f.split('.')[1])
-
-    if metadata.empty:
-        print("No metadata files found. Exiting.")
-        return
+    parser.add_argument(
+        "--columns",
+        choices=["union", "common"],
+        default="union",
+        help="Keep the union of all columns (default) or only the columns common to all files."
+    )
+    parser.add_argument(
+        "--streaming",
+        action="store_true",
+        help="Merge chunk by chunk with bounded memory instead of loading all files at once."
+    )
+    parser.add_argument(
+        "--chunksize",
+        type=int,
+        default=DEFAULT_CHUNKSIZE,
+        help=f"Rows per chunk in streaming mode. Defaults to {DEFAULT_CHUNKSIZE}."
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Parse the metadata files in this many worker processes, splitting large files into byte ranges. Defaults to 1."
+    )
+    parser.add_argument(
+        "--split_size",
+        type=parse_size,
+        default=DEFAULT_SPLIT_SIZE,
+        help="With --workers, size above which an uncompressed file is split into ranges parsed in parallel, e.g. 64M (the default)."
+    )
+    parser.add_argument(
+        "--format",
+        choices=("tsv",) + FORMATS,
+        default="tsv",
+        help="Output format. Columnar formats write a dataset directory partitioned by the type (release) label."
+    )
+    parser.add_argument(
+        "--compression",
+        help=f"Output compression: gzip or zstd for tsv (adds .gz or .zst to the output name; an output "
+             f"named *.gz or *.zst is compressed without this option), or a codec for columnar formats, "
+             f"which default to {DEFAULT_COMPRESSION}."
+    )
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="Keep row fingerprints next to the output and update it from them on later merges instead of rebuilding it."
+    )
+    parser.add_argument(
+        "--diff_file",
+        help="With --incremental, write the isolates added, removed, changed and reassigned since the previous merge to this file."
+    )
+    metrics.add_arguments(parser)
 
-    # Find common columns across all metadata files
-    common_columns = list(set.intersection(*(set(metadata.columns) for _ in [metadata])))
-    
-    # Filter each metadata dataframe to keep only common columns
-    metadata = metadata[common_columns]
+def run(args):
+    """
+    Run the script with arguments parsed by a parser set up with add_arguments.
+    """
+    with metrics.instrumented(args, "merge"):
+        merge_metadata(args.directory, args.output_file, args.columns, args.streaming, args.chunksize, args.format,
+                       args.compression, args.incremental, args.diff_file, args.workers, args.split_size)
 
-    # Save the merged data to a CSV file
-    metadata.to_csv(output_file, index=False, sep='\t')
-    print(f"Merged metadata saved to {output_file}")
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=DESCRIPTION)
+    add_arguments(parser)
+    run(parser.parse_args(argv))
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,286 @@
+#!/usr/bin/env python3
+
+import argparse
+import hashlib
+import json
+import logging
+import os
+
+from opentrakr import download_cache, metrics
+from opentrakr.columnar import DEFAULT_COMPRESSION, FORMATS
+from opentrakr.compression import codec_for, text_codec, with_codec
+from opentrakr.download_utils import DEFAULT_PER_HOST, DEFAULT_WORKERS, file_sha256
+from opentrakr.fingerprints import fingerprint_path
+from opentrakr.ncbi_tsv_download import BASE_URL, download_all, list_available_bacteria
+from opentrakr.ncbi_tsv_merge import DEFAULT_CHUNKSIZE, METADATA_PATTERN, find_files, merge_metadata
+
+logger = logging.getLogger(__name__)
+
+STATE_NAME = ".opentrakr_stages.json"
+NCBI_STAGES = ("download", "merge")
+
+
+def _stage_base(name):
+    # Per-item stages are named "<stage>:<item>", e.g. "process:raw_poultry_sampling_data_fy2024.zip"
+    return name.split(":", 1)[0]
+
+
+def _expand_outputs(paths):
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _, names in os.walk(path):
+                files.extend(os.path.join(root, name) for name in sorted(names))
+        else:
+            files.append(path)
+    return files
+
+
+class StageRunner:
+    """
+    Run workflow stages, skipping those whose outputs are still valid.
+
+    For every stage the runner records the content hashes of its input files, a hash of
+    its parameters, and the size and modification time of its outputs in a state file in
+    the workflow folder. A stage is skipped when its inputs and parameters hash the same
+    as last time and its outputs are unchanged on disk. File hashes are cached by size and
+    modification time so unchanged inputs are not re-read.
+
+    Parameters:
+    - folder: Workflow folder holding the state file.
+    - stage_order: Ordered names of the workflow stages.
+    - force: Re-run every stage.
+    - from_stage: Skip the stages before this one and re-run it and every later stage.
+    """
+
+    def __init__(self, folder, stage_order, force=False, from_stage=None):
+        if from_stage is not None and from_stage not in stage_order:
+            raise ValueError(f"Unknown stage '{from_stage}'. Expected one of {', '.join(stage_order)}.")
+        self.folder = folder
+        self.path = os.path.join(folder, STATE_NAME)
+        self.stage_order = list(stage_order)
+        self.force = force
+        self.from_stage = from_stage
+        self.stages = {}
+        self.hashes = {}
+        if os.path.exists(self.path):
+            try:
+                with open(self.path) as file:
+                    state = json.load(file)
+                self.stages = state.get("stages", {})
+                self.hashes = state.get("hashes", {})
+            except (OSError, ValueError) as e:
+                logger.warning(f"Ignoring unreadable stage state {self.path}: {e}")
+
+    def selected(self, name):
+        if self.from_stage is None:
+            return True
+        return self.stage_order.index(_stage_base(name)) >= self.stage_order.index(self.from_stage)
+
+    def forced(self, name):
+        return self.force or (self.from_stage is not None and self.selected(name))
+
+    def file_hash(self, path):
+        stat = os.stat(path)
+        key = os.path.abspath(path)
+        cached = self.hashes.get(key)
+        if cached and cached["size"] == stat.st_size and cached["mtime"] == stat.st_mtime:
+            return cached["sha256"]
+        digest = file_sha256(path)
+        self.hashes[key] = {"size": stat.st_size, "mtime": stat.st_mtime, "sha256": digest}
+        return digest
+
+    def fingerprint(self, inputs, params):
+        return {
+            "inputs": {os.path.abspath(path): self.file_hash(path) for path in sorted(inputs)},
+            "params": hashlib.sha256(json.dumps(params or {}, sort_keys=True).encode()).hexdigest(),
+        }
+
+    def is_current(self, name, inputs=(), params=None):
+        """
+        Check whether a stage can be skipped.
+        """
+        entry = self.stages.get(name)
+        if self.forced(name) or not entry or entry["fingerprint"] != self.fingerprint(inputs, params):
+            return False
+        for path, recorded in entry["outputs"].items():
+            if not os.path.exists(path):
+                return False
+            stat = os.stat(path)
+            if stat.st_size != recorded["size"] or stat.st_mtime != recorded["mtime"]:
+                return False
+        return True
+
+    def record(self, name, inputs=(), outputs=(), params=None):
+        """
+        Record that a stage completed with the given inputs, outputs and parameters.
+        """
+        recorded = {}
+        for path in _expand_outputs(outputs):
+            if os.path.exists(path):
+                stat = os.stat(path)
+                recorded[os.path.abspath(path)] = {"size": stat.st_size, "mtime": stat.st_mtime}
+        self.stages[name] = {"fingerprint": self.fingerprint(inputs, params), "outputs": recorded}
+        self._save()
+
+    def run(self, name, func, inputs=(), outputs=(), params=None, always=False):
+        """
+        Run a stage unless it is before from_stage or still up to date.
+
+        Parameters:
+        - name: Stage name.
+        - func: Callable running the stage.
+        - inputs: Input file paths.
+        - outputs: Output paths, or a callable returning them once the stage has run.
+        - params: JSON-serializable parameters that affect the outputs.
+        - always: Run the stage whenever it is selected (e.g. incremental downloads).
+
+        Returns:
+        - The result of func, or None if the stage was skipped.
+        """
+        if not self.selected(name):
+            logger.info(f"Stage {name}: skipped (before {self.from_stage})")
+            metrics.skip(name, f"before {self.from_stage}")
+            return None
+        inputs = list(inputs)
+        if not always and self.is_current(name, inputs, params):
+            logger.info(f"Stage {name}: up to date")
+            metrics.skip(name, "up to date")
+            return None
+        logger.info(f"Stage {name}: running")
+        with metrics.stage(name):
+            result = func()
+        self.record(name, inputs, outputs() if callable(outputs) else outputs, params)
+        return result
+
+    def _save(self):
+        os.makedirs(self.folder, exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as file:
+            json.dump({"stages": self.stages, "hashes": self.hashes}, file, indent=2, sort_keys=True)
+        os.replace(tmp_path, self.path)
+
+
+def ncbi_workflow(output_folder, output_file, bacteria_list=None, base_url=BASE_URL, workers=DEFAULT_WORKERS,
+                  per_host=DEFAULT_PER_HOST, column_mode="union", streaming=False, chunksize=DEFAULT_CHUNKSIZE,
+                  output_format="tsv", compression=None, force=False, from_stage=None, incremental=False,
+                  diff_file=None, merge_workers=1):
+    """
+    Download the NCBI metadata and cluster TSVs and merge the metadata, skipping up-to-date stages.
+
+    The download stage always runs when selected (unchanged files are skipped by the download
+    manifest); the merge stage is skipped when the metadata files and merge options are unchanged.
+
+    Parameters:
+    - output_folder: Folder for the downloaded TSVs and the stage state.
+    - output_file: Path of the merged metadata output. A tsv output ending with .gz or .zst is compressed.
+    - bacteria_list: Names of the bacteria to download. Defaults to all available bacteria.
+    - base_url: The NCBI pathogen Results URL.
+    - workers: Number of concurrent downloads.
+    - per_host: Maximum number of concurrent requests to a single host.
+    - column_mode, streaming, chunksize, output_format, compression, incremental, diff_file: Merge options,
+      see ncbi_tsv_merge.merge_metadata.
+    - merge_workers: Worker processes parsing the metadata files. The output does not depend on
+      it, so changing it does not re-run the merge.
+    - force: Re-run every stage.
+    - from_stage: Skip the stages before this one and re-run it and every later stage.
+    """
+    runner = StageRunner(output_folder, NCBI_STAGES, force=force, from_stage=from_stage)
+    bacteria_list = bacteria_list or list_available_bacteria()
+
+    runner.run(
+        "download",
+        lambda: download_all(bacteria_list, base_url, output_folder, workers=workers, per_host=per_host, force=force),
+        params={"bacteria": bacteria_list, "base_url": base_url},
+        always=True,
+    )
+
+    if output_format == "tsv":
+        output_file = with_codec(output_file, text_codec(compression))
+    params = {
+        "columns": column_mode,
+        "streaming": streaming,
+        "format": output_format,
+        "compression": text_codec(compression) if output_format == "tsv" else compression or DEFAULT_COMPRESSION,
+        "output_file": os.path.abspath(output_file),
+    }
+    outputs = [output_file]
+    if incremental and not codec_for(output_file):
+        params["incremental"] = True
+        outputs.append(fingerprint_path(output_file))
+    if diff_file:
+        params["diff_file"] = os.path.abspath(diff_file)
+        outputs.append(diff_file)
+    runner.run(
+        "merge",
+        lambda: merge_metadata(output_folder, output_file, column_mode, streaming, chunksize, output_format,
+                               compression, incremental, diff_file, workers=merge_workers),
+        inputs=find_files(output_folder, METADATA_PATTERN),
+        outputs=outputs,
+        params=params,
+    )
+
+
+DESCRIPTION = "Run the NCBI download and merge workflow, skipping up-to-date stages."
+
+
+def add_arguments(parser):
+    """
+    Add the command-line options of this script to parser.
+    """
+    parser.add_argument('-b', '--bacteria', type=str, help='Name of the bacteria to process. If not provided, all bacteria will be processed.')
+    parser.add_argument('-t', '--output_folder', type=str, default='metadata_ncbi', help='Folder for the downloaded files. Defaults to metadata_ncbi.')
+    parser.add_argument('-o', '--output_file', type=str, default='ncbi_metadata.tsv', help='Merged metadata output. Defaults to ncbi_metadata.tsv.')
+    parser.add_argument('--base_url', type=str, default=BASE_URL, help='Base URL of the NCBI pathogen Results directory (e.g. a local mirror).')
+    parser.add_argument('-w', '--workers', type=int, default=DEFAULT_WORKERS, help=f'Number of concurrent downloads. Defaults to {DEFAULT_WORKERS}.')
+    parser.add_argument('--per_host', type=int, default=DEFAULT_PER_HOST, help=f'Maximum number of concurrent requests per host. Defaults to {DEFAULT_PER_HOST}.')
+    parser.add_argument('--columns', choices=["union", "common"], default="union", help='Keep the union (default) or the common columns.')
+    parser.add_argument('--streaming', action='store_true', help='Merge chunk by chunk with bounded memory.')
+    parser.add_argument('--merge_workers', type=int, default=1, help='Parse the metadata files in this many worker processes. Defaults to 1.')
+    parser.add_argument('--format', choices=("tsv",) + FORMATS, default="tsv", help='Merged output format. Defaults to tsv.')
+    parser.add_argument('--compression', help=f'Output compression: gzip or zstd for tsv (an output named *.gz or *.zst is compressed without it), or a codec for columnar formats, which default to {DEFAULT_COMPRESSION}.')
+    parser.add_argument('--incremental', action='store_true', help='Update the merged output from row fingerprints instead of rebuilding it.')
+    parser.add_argument('--diff_file', type=str, help='With --incremental, write the isolates added, removed, changed and reassigned by the merge to this file.')
+    parser.add_argument('--force', action='store_true', help='Re-run every stage.')
+    parser.add_argument('--from_stage', choices=NCBI_STAGES, help='Skip earlier stages and re-run this stage and all later ones.')
+    metrics.add_arguments(parser)
+    download_cache.add_arguments(parser)
+
+
+def run(args):
+    """
+    Run the script with arguments parsed by a parser set up with add_arguments.
+    """
+    with metrics.instrumented(args, "ncbi_workflow"):
+        download_cache.configure_from_args(args)
+        if args.bacteria and args.bacteria not in list_available_bacteria():
+            logger.error(f"Bacteria '{args.bacteria}' not found in the available list.")
+            return
+
+        ncbi_workflow(
+            args.output_folder,
+            args.output_file,
+            bacteria_list=[args.bacteria] if args.bacteria else None,
+            base_url=args.base_url,
+            workers=args.workers,
+            per_host=args.per_host,
+            column_mode=args.columns,
+            streaming=args.streaming,
+            output_format=args.format,
+            compression=args.compression,
+            force=args.force,
+            from_stage=args.from_stage,
+            incremental=args.incremental,
+            diff_file=args.diff_file,
+            merge_workers=args.merge_workers,
+        )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=DESCRIPTION)
+    add_arguments(parser)
+    run(parser.parse_args(argv))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+
+import argparse
+import logging
+import os
+
+from opentrakr import metrics
+from opentrakr.fingerprints import (
+    FINGERPRINT_SUFFIX,
+    diff_fingerprints,
+    fingerprint_map,
+    fingerprint_path,
+    iter_fingerprints,
+    read_fingerprints,
+    write_diff,
+)
+from opentrakr.ncbi_tsv_merge import METADATA_PATTERN, find_files, type_label
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_OUTPUT = "ncbi_release_diff.tsv"
+
+
+def load_snapshot(path):
+    """
+    Fingerprint one snapshot of the NCBI metadata.
+
+    Parameters:
+    - path: A folder of downloaded *.metadata.tsv files, a merged TSV written with
+      --incremental (its fingerprints are reused), another merged TSV, or a
+      *.fingerprints.tsv file.
+
+    Returns:
+    - The snapshot mapped by fingerprints.fingerprint_map.
+
+    Snapshots are compared by row digests, which depend on the text of the rows: a folder
+    and a merged TSV with fingerprints can be compared with each other, but a merged TSV
+    without fingerprints can only be compared with another such TSV.
+    """
+    if os.path.isdir(path):
+        filepaths = find_files(path, METADATA_PATTERN)
+        if not filepaths:
+            raise ValueError(f"No *{METADATA_PATTERN} files found in {path}")
+        return fingerprint_map(iter_fingerprints(filepaths, type_label))
+    if path.endswith(FINGERPRINT_SUFFIX):
+        return fingerprint_map(read_fingerprints(path))
+    fingerprints_file = fingerprint_path(path)
+    if os.path.exists(fingerprints_file) and os.path.getmtime(fingerprints_file) >= os.path.getmtime(path):
+        return fingerprint_map(read_fingerprints(fingerprints_file))
+    return fingerprint_map(iter_fingerprints([path]))
+
+
+def diff_releases(old_path, new_path, output_file=DEFAULT_OUTPUT):
+    """
+    Write the isolates added, removed, changed and reassigned to another SNP cluster
+    between two snapshots of the NCBI metadata (see load_snapshot).
+
+    Returns:
+    - A dict with the number of isolates per kind of change.
+    """
+    old = load_snapshot(old_path)
+    new = load_snapshot(new_path)
+    summary = write_diff(diff_fingerprints(old, new), output_file)
+    logger.info(f"{len(old)} isolates in {old_path}, {len(new)} in {new_path}: {summary['added']} added, "
+                f"{summary['removed']} removed, {summary['changed']} changed, "
+                f"{summary['reassigned']} reassigned to another SNP cluster; written to {output_file}")
+    return summary
+
+
+DESCRIPTION = "List the isolates added, removed, changed and reassigned between two NCBI metadata snapshots."
+
+
+def add_arguments(parser):
+    """
+    Add the command-line options of this script to parser.
+    """
+    parser.add_argument("old", help="Earlier snapshot: a folder of *.metadata.tsv files, a merged TSV or a fingerprints file.")
+    parser.add_argument("new", help="Later snapshot, as for old.")
+    parser.add_argument("-o", "--output_file", default=DEFAULT_OUTPUT,
+                        help=f"Tab-delimited list of changes. Defaults to {DEFAULT_OUTPUT}.")
+    metrics.add_arguments(parser)
+
+
+def run(args):
+    """
+    Run the script with arguments parsed by a parser set up with add_arguments.
+    """
+    with metrics.instrumented(args, "release_diff"):
+        diff_releases(args.old, args.new, args.output_file)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=DESCRIPTION)
+    add_arguments(parser)
+    run(parser.parse_args(argv))
+
+
+if __name__ == "__main__":
+    main()
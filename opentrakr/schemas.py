@@ -0,0 +1,291 @@
+#!/usr/bin/env python3
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class TableSchema:
+    """
+    Column types and projection for one known input table.
+
+    Categorical columns are read as pandas categoricals, so low-cardinality text (organism,
+    establishment, product, serovar, isolation source, ...) is stored once per distinct value
+    instead of once per row. Columns not listed in the schema are read as text by default,
+    and are reported as drift rather than causing the read to fail.
+
+    Parameters:
+    - name: Name used in drift reports.
+    - required: Columns the code depends on; reported when missing.
+    - categoricals: Low-cardinality columns read as categoricals.
+    - dates: Columns holding dates, parsed by parse_dates.
+    - columns: Other known columns, read with the default type.
+    - usecols: Optional subset of columns that key-only readers need (e.g. the join keys).
+    """
+
+    def __init__(self, name, required=(), categoricals=(), dates=(), columns=(), usecols=None):
+        self.name = name
+        self.required = tuple(required)
+        self.categoricals = frozenset(categoricals)
+        self.dates = tuple(dates)
+        self.columns = frozenset(columns) | self.categoricals | set(self.required) | set(self.dates)
+        self.usecols = tuple(usecols) if usecols else None
+
+    def drift(self, header):
+        """
+        Compare a header with the schema.
+
+        Returns:
+        - A dict with the 'unknown' columns not in the schema and the 'missing' required columns.
+        """
+        return {
+            "unknown": [column for column in header if column not in self.columns],
+            "missing": [column for column in self.required if column not in header],
+        }
+
+    def report_drift(self, header, source):
+        """
+        Log and return the drift of a header (see drift).
+        """
+        drift = self.drift(header)
+        if drift["unknown"]:
+            logger.warning(f"{source}: columns not in the {self.name} schema: {drift['unknown']}")
+        if drift["missing"]:
+            logger.warning(f"{source}: missing required {self.name} columns: {drift['missing']}")
+        return drift
+
+    def dtypes(self, header, default=None):
+        """
+        Return the read_csv dtype mapping for the columns of header.
+
+        Parameters:
+        - header: Column names of the file being read.
+        - default: Type for the non-categorical columns (e.g. str), or None to let pandas infer them.
+        """
+        dtypes = {}
+        for column in header:
+            if column in self.categoricals:
+                dtypes[column] = "category"
+            elif default is not None:
+                dtypes[column] = default
+        return dtypes
+
+    def projection(self, header, usecols):
+        """
+        Return the columns of usecols present in header, in header order, or None to keep all columns.
+        """
+        if not usecols:
+            return None
+        return [column for column in header if column in usecols]
+
+    def read_options(self, path, sep=",", default=None, usecols=None, source=None):
+        """
+        Read the header of path, report its drift and return the read_csv keyword arguments for it.
+
+        Parameters:
+        - path: Path of the delimited file.
+        - sep: Field delimiter.
+        - default: Type for the non-categorical columns, see dtypes.
+        - usecols: Columns to load (e.g. the schema's usecols). Defaults to all columns.
+        - source: Name used in drift reports. Defaults to path.
+
+        Returns:
+        - A dict of read_csv keyword arguments (sep, dtype and, with a projection, usecols).
+        """
+        import pandas as pd
+
+        header = list(pd.read_csv(path, sep=sep, nrows=0).columns)
+        self.report_drift(header, source or path)
+        options = {"sep": sep}
+        projection = self.projection(header, usecols)
+        if projection is not None:
+            header = projection
+            options["usecols"] = projection
+        options["dtype"] = self.dtypes(header, default)
+        return options
+
+    def read_csv(self, path, sep=",", default=None, usecols=None, **kwargs):
+        """
+        Read a delimited file with the schema's types and projection.
+        """
+        import pandas as pd
+
+        return pd.read_csv(path, **self.read_options(path, sep, default, usecols), **kwargs)
+
+    def apply(self, df):
+        """
+        Convert the categorical columns of an already loaded DataFrame.
+        """
+        columns = [column for column in df.columns if column in self.categoricals]
+        return df.astype({column: "category" for column in columns}) if columns else df
+
+    def parse_dates(self, df):
+        """
+        Parse the schema's date columns in place; unparseable values become NaT.
+        """
+        import pandas as pd
+
+        for column in self.dates:
+            if column in df.columns:
+                df[column] = pd.to_datetime(df[column], errors="coerce")
+        return df
+
+
+def concat_frames(frames, columns):
+    """
+    Concatenate DataFrames aligned to columns, keeping categorical columns categorical.
+
+    pandas falls back to object dtype when categoricals with different categories are
+    concatenated, so every categorical column is given the union of the categories first.
+
+    Parameters:
+    - frames: List of DataFrames.
+    - columns: Output columns; columns missing from a frame are left empty.
+
+    Returns:
+    - The concatenated DataFrame.
+    """
+    import pandas as pd
+
+    frames = [frame.reindex(columns=columns) for frame in frames]
+    for column in columns:
+        values = [frame[column] for frame in frames]
+        if not any(isinstance(value.dtype, pd.CategoricalDtype) for value in values):
+            continue
+        categories = pd.Index([])
+        for value in values:
+            new = value.cat.categories if isinstance(value.dtype, pd.CategoricalDtype) else value.dropna().unique()
+            categories = categories.append(pd.Index(new).difference(categories))
+        for frame in frames:
+            frame[column] = pd.Categorical(frame[column], categories=categories)
+    # A single concat is linear in the total number of rows
+    return pd.concat(frames, ignore_index=True, sort=False)
+
+
+# FSIS raw poultry sampling data, per-year and merged primary table
+FSIS_PRIMARY = TableSchema(
+    "FSIS primary",
+    required=("form_id", "collection_date"),
+    categoricals=(
+        "establishment_name",
+        "establishment_number",
+        "state",
+        "district",
+        "circuit",
+        "project_code",
+        "project_name",
+        "product",
+        "product_type",
+        "sample_source",
+        "sample_type",
+        "salmonella_result",
+        "campylobacter_result",
+        "source_file",
+    ),
+    dates=("collection_date",),
+)
+
+# Accession columns of the secondary table that the join needs, by organism
+FSIS_ACCESSION_COLUMNS = {
+    "bio_project_number": ("salmonella_bio_project_number", "campylobacter_bio_project_number"),
+    "bio_sample_number": ("salmonella_bio_sample_accession_number", "campylobacter_bio_sample_accession_number"),
+    "sra_accession_number": ("salmonella_sra_accession_number", "campylobacter_sra_accession_number"),
+}
+
+# FSIS raw poultry sampling data, per-year and merged secondary table
+FSIS_SECONDARY = TableSchema(
+    "FSIS secondary",
+    required=("form_id",) + tuple(column for pair in FSIS_ACCESSION_COLUMNS.values() for column in pair),
+    categoricals=(
+        "serotype",
+        "salmonella_serotype",
+        "campylobacter_species",
+        "source_file",
+    ),
+    usecols=("form_id",) + tuple(column for pair in FSIS_ACCESSION_COLUMNS.values() for column in pair),
+)
+
+# NCBI Pathogen Detection <PDG>.metadata.tsv (plus the 'type' label added by ncbi_tsv_merge)
+NCBI_METADATA = TableSchema(
+    "NCBI metadata",
+    required=("target_acc",),
+    categoricals=(
+        # Added by the merge: the PDG release number of the row's file (ncbi_tsv_merge.type_label)
+        "type",
+        "HHS_region",
+        "LibraryLayout",
+        "Platform",
+        "asm_level",
+        "assembly_method",
+        "attribute_package",
+        "bioproject_center",
+        "collected_by",
+        "epi_type",
+        "geo_loc_name",
+        "host",
+        "host_disease",
+        "isolation_source",
+        "scientific_name",
+        "serovar",
+        "source_type",
+        "species_taxid",
+        "sra_center",
+        "taxid",
+    ),
+    dates=("collection_date", "target_creation_date", "sra_release_date"),
+    columns=(
+        "#label",
+        "Run",
+        "asm_acc",
+        "asm_stats_contig_n50",
+        "asm_stats_length_bp",
+        "asm_stats_n_contig",
+        "bioproject_acc",
+        "biosample_acc",
+        "computed_types",
+        "fullasm_id",
+        "lat_lon",
+        "outbreak",
+        "sample_name",
+        "strain",
+        "wgs_acc_prefix",
+        "wgs_master_acc",
+        "minsame",
+        "mindiff",
+        "AMR_genotypes",
+        "AMR_genotypes_core",
+        "AST_phenotypes",
+        "number_drugs_resistant",
+        "number_drugs_intermediate",
+        "number_drugs_susceptible",
+        "number_drugs_tested",
+        "number_amr_genes",
+        "number_core_amr_genes",
+        "PFGE_PrimaryEnzyme_pattern",
+        "PFGE_SecondaryEnzyme_pattern",
+        "PDS_acc",
+    ),
+    usecols=("target_acc", "biosample_acc", "Run", "PDS_acc", "type"),
+)
+
+# NCBI Pathogen Detection <PDG>.reference_target.cluster_list.tsv
+NCBI_CLUSTERS = TableSchema(
+    "NCBI clusters",
+    required=("target_acc", "PDS_acc"),
+    columns=("biosample_acc", "gencoll_acc", "minsame", "mindiff"),
+    usecols=("target_acc", "PDS_acc"),
+)
+
+SCHEMAS = {
+    "fsis_primary": FSIS_PRIMARY,
+    "fsis_secondary": FSIS_SECONDARY,
+    "ncbi_metadata": NCBI_METADATA,
+    "ncbi_clusters": NCBI_CLUSTERS,
+}
+
+
+def categorical_columns():
+    """
+    Return the names of all columns declared categorical in any schema.
+    """
+    return set().union(*(schema.categoricals for schema in SCHEMAS.values()))
@@ -0,0 +1,508 @@
+#!/usr/bin/env python3
+
+import argparse
+import logging
+import mmap
+import os
+import struct
+import sys
+import tempfile
+import time
+from array import array
+
+import requests
+
+from opentrakr import metrics
+from opentrakr.compression import open_file
+from opentrakr.download_utils import (
+    CHUNK_SIZE,
+    DEFAULT_BACKOFF,
+    DEFAULT_RETRIES,
+    DEFAULT_TIMEOUT,
+    adapter_retries,
+    create_session,
+    retry_transfer,
+)
+from opentrakr.manifest import DownloadManifest
+from opentrakr.ncbi_tsv_download import BASE_URL, list_available_bacteria, list_tsv_files
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_SNPS = 20
+# Distances are stored as unsigned 16-bit integers
+MAX_STORED_SNPS = 0xFFFF
+SNP_DISTANCES_PATTERN = r'href="([^"]*SNP_distances[^"]*\.tsv)"'
+STORE_SUFFIX = ".pairs.bin"
+
+# Candidate column names, in order of preference
+ISOLATE_COLUMNS = (("target_acc_1", "target_acc_2"), ("biosample_acc_1", "biosample_acc_2"))
+DISTANCE_COLUMNS = ("delta_positions_unambiguous", "compatible_distance")
+
+# Store layout (native little-endian): header, then n_isolates + 1 uint64 row offsets, n_slots uint32
+# neighbor ids, n_slots uint16 distances and the newline-separated isolate names in id order.
+# Each kept pair fills two slots, one in the row of each isolate (compressed sparse rows).
+MAGIC = b"OTSNPS01"
+HEADER = struct.Struct("<8sIIQQ")
+EDGE = struct.Struct("<IIH")
+
+
+def store_path_for(tsv_name, target_directory):
+    """
+    Return the path of the pair store built from an SNP_distances file name.
+    """
+    stem = tsv_name[:-len(".tsv")] if tsv_name.endswith(".tsv") else tsv_name
+    return os.path.join(target_directory, stem + STORE_SUFFIX)
+
+
+def _columns(header, isolate_columns, distance_column):
+    fields = header.rstrip("\r\n").split("\t")
+    pairs = [isolate_columns] if isolate_columns else ISOLATE_COLUMNS
+    pair = next((p for p in pairs if p[0] in fields and p[1] in fields), None)
+    candidates = [distance_column] if distance_column else DISTANCE_COLUMNS
+    distance = next((c for c in candidates if c in fields), None)
+    if pair is None or distance is None:
+        raise ValueError(
+            f"SNP_distances header is missing the isolate or distance columns: {', '.join(fields)}"
+        )
+    return fields.index(pair[0]), fields.index(pair[1]), fields.index(distance)
+
+
+def write_pair_store(lines, output_path, max_snps=DEFAULT_MAX_SNPS, isolate_columns=None, distance_column=None):
+    """
+    Stream an SNP_distances table and store the pairs at most max_snps apart.
+
+    Rows are parsed one at a time and only the kept pairs are spooled, as fixed-size
+    integer records, to a temporary file next to output_path. The store is then laid out
+    as a compressed sparse row graph (see MAGIC) that SnpPairStore memory-maps, so neither
+    the full table nor the kept pairs are ever held in memory.
+
+    Parameters:
+    - lines: Iterable of the table's lines, header first (e.g. an open file).
+    - output_path: Path of the store to write; replaced atomically.
+    - max_snps: Keep pairs at most this many SNPs apart.
+    - isolate_columns: Pair of column names identifying the two isolates. Defaults to
+      target_acc_1/target_acc_2, or the BioSample columns if those are missing.
+    - distance_column: Column holding the SNP distance. Defaults to delta_positions_unambiguous.
+
+    Returns:
+    - A dict with the number of rows read, pairs kept and isolates stored.
+    """
+    if not 0 <= max_snps <= MAX_STORED_SNPS:
+        raise ValueError(f"max_snps must be between 0 and {MAX_STORED_SNPS}")
+    lines = iter(lines)
+    header = next(lines, None)
+    if header is None:
+        raise ValueError("SNP_distances table is empty")
+    first, second, distance_index = _columns(header, isolate_columns, distance_column)
+    width = max(first, second, distance_index) + 1
+
+    folder = os.path.dirname(output_path) or "."
+    os.makedirs(folder, exist_ok=True)
+    ids = {}
+    degrees = array("Q")
+    rows = pairs = 0
+    with tempfile.TemporaryFile(dir=folder) as spool:
+        buffer = bytearray()
+        for line in lines:
+            rows += 1
+            fields = line.rstrip("\r\n").split("\t")
+            if len(fields) < width:
+                continue
+            try:
+                distance = int(fields[distance_index])
+            except ValueError:
+                continue
+            if distance > max_snps:
+                continue
+            a, b = fields[first], fields[second]
+            if a == b:
+                continue
+            for name in (a, b):
+                if name not in ids:
+                    ids[name] = len(ids)
+                    degrees.append(0)
+            a, b = ids[a], ids[b]
+            degrees[a] += 1
+            degrees[b] += 1
+            buffer += EDGE.pack(a, b, distance)
+            pairs += 1
+            if len(buffer) >= CHUNK_SIZE:
+                spool.write(buffer)
+                buffer.clear()
+        spool.write(buffer)
+        _write_store(spool, output_path, max_snps, ids, degrees, pairs)
+    metrics.count(rows_read=rows)
+    metrics.file_written(output_path, pairs)
+    return {"rows": rows, "pairs": pairs, "isolates": len(ids)}
+
+
+def _write_store(spool, output_path, max_snps, ids, degrees, pairs):
+    count = len(ids)
+    slots = 2 * pairs
+    offsets = array("Q", [0])
+    for degree in degrees:
+        offsets.append(offsets[-1] + degree)
+    names = "\n".join(sorted(ids, key=ids.get)).encode()
+
+    neighbors_start = HEADER.size + offsets.itemsize * len(offsets)
+    distances_start = neighbors_start + 4 * slots
+    names_start = distances_start + 2 * slots
+
+    tmp_path = f"{output_path}.tmp"
+    with open(tmp_path, "w+b") as file:
+        file.write(HEADER.pack(MAGIC, max_snps, count, slots, len(names)))
+        offsets.tofile(file)
+        file.truncate(names_start)
+        file.seek(names_start)
+        file.write(names)
+        file.flush()
+        if slots:
+            # Fill each isolate's row from the spooled pairs, one slot per pair end
+            with mmap.mmap(file.fileno(), 0) as mapped:
+                neighbors = memoryview(mapped)[neighbors_start:distances_start].cast("I")
+                distances = memoryview(mapped)[distances_start:names_start].cast("H")
+                cursor = array("Q", offsets)
+                spool.seek(0)
+                record_bytes = EDGE.size * (CHUNK_SIZE // EDGE.size)
+                for chunk in iter(lambda: spool.read(record_bytes), b""):
+                    for a, b, distance in EDGE.iter_unpack(chunk):
+                        slot = cursor[a]
+                        neighbors[slot] = b
+                        distances[slot] = distance
+                        cursor[a] = slot + 1
+                        slot = cursor[b]
+                        neighbors[slot] = a
+                        distances[slot] = distance
+                        cursor[b] = slot + 1
+                neighbors.release()
+                distances.release()
+    os.replace(tmp_path, output_path)
+
+
+def read_max_snps(store_path):
+    """
+    Return the threshold a pair store was built with, or None if it is missing or unreadable.
+    """
+    try:
+        with open(store_path, "rb") as file:
+            magic, max_snps, _, _, _ = HEADER.unpack(file.read(HEADER.size))
+    except (OSError, struct.error):
+        return None
+    return max_snps if magic == MAGIC else None
+
+
+class SnpPairStore:
+    """
+    Read-only view of a pair store written by write_pair_store.
+
+    The row offsets, neighbor ids and distances are memory-mapped, so a query only touches
+    the pages of the isolate's row; the isolate names are loaded once to map names to ids.
+
+    Parameters:
+    - path: Path of the store.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, "rb")
+        try:
+            self._mapped = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            self._file.close()
+            raise ValueError(f"{path} is not an SNP pair store")
+        try:
+            magic, self.max_snps, count, slots, names_size = HEADER.unpack_from(self._mapped)
+        except struct.error:
+            magic = None
+        if magic != MAGIC or sys.byteorder != "little":
+            self.close()
+            raise ValueError(f"{path} is not an SNP pair store readable on this platform")
+        neighbors_start = HEADER.size + 8 * (count + 1)
+        distances_start = neighbors_start + 4 * slots
+        names_start = distances_start + 2 * slots
+        view = memoryview(self._mapped)
+        self._offsets = view[HEADER.size:neighbors_start].cast("Q")
+        self._neighbors = view[neighbors_start:distances_start].cast("I")
+        self._distances = view[distances_start:names_start].cast("H")
+        self._names = bytes(view[names_start:names_start + names_size]).decode().split("\n") if count else []
+        self._ids = {name: index for index, name in enumerate(self._names)}
+        self.pairs = slots // 2
+
+    def __len__(self):
+        return len(self._names)
+
+    def __contains__(self, isolate):
+        return isolate in self._ids
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        for name in ("_offsets", "_neighbors", "_distances"):
+            view = self.__dict__.pop(name, None)
+            if view is not None:
+                view.release()
+        if getattr(self, "_mapped", None) is not None:
+            self._mapped.close()
+            self._mapped = None
+        self._file.close()
+
+    def neighbors(self, isolate, max_snps=None):
+        """
+        Return the isolates at most max_snps SNPs from isolate.
+
+        Parameters:
+        - isolate: Accession of the isolate, as named in the SNP_distances table.
+        - max_snps: Distance cut-off; defaults to the threshold the store was built with,
+          which is also the largest distance it holds.
+
+        Returns:
+        - A list of (accession, distance) tuples, closest first. Empty for isolates with no
+          stored neighbors.
+        """
+        index = self._ids.get(isolate)
+        if index is None:
+            return []
+        limit = self.max_snps if max_snps is None else max_snps
+        start, end = self._offsets[index], self._offsets[index + 1]
+        found = [
+            (self._names[neighbor], distance)
+            for neighbor, distance in zip(self._neighbors[start:end], self._distances[start:end])
+            if distance <= limit
+        ]
+        found.sort(key=lambda item: (item[1], item[0]))
+        return found
+
+
+def neighbors(store_paths, isolates, max_snps=None):
+    """
+    Look up the neighbors of several isolates across several pair stores (e.g. one per organism).
+
+    Returns:
+    - A list of dicts with 'query', 'neighbor', 'snps' and 'store', closest first per query.
+    """
+    results = []
+    for path in store_paths:
+        with SnpPairStore(path) as store:
+            for isolate in isolates:
+                results.extend(
+                    {"query": isolate, "neighbor": neighbor, "snps": distance, "store": os.path.basename(path)}
+                    for neighbor, distance in store.neighbors(isolate, max_snps)
+                )
+    order = {isolate: index for index, isolate in enumerate(isolates)}
+    results.sort(key=lambda row: (order[row["query"]], row["snps"], row["neighbor"]))
+    return results
+
+
+def build_pair_store(source, output_path, max_snps=DEFAULT_MAX_SNPS, isolate_columns=None, distance_column=None):
+    """
+    Build a pair store from a local SNP_distances table, optionally compressed (.gz, .zst).
+
+    Returns:
+    - The summary returned by write_pair_store.
+    """
+    with open_file(source, "rt", newline="") as file:
+        summary = write_pair_store(file, output_path, max_snps, isolate_columns, distance_column)
+    metrics.file_read(source, summary["rows"])
+    logger.info(f"Kept {summary['pairs']} of {summary['rows']} pairs within {max_snps} SNPs "
+                f"({summary['isolates']} isolates) from {source} in {output_path}")
+    return summary
+
+
+def stream_pair_store(session, url, output_path, max_snps=DEFAULT_MAX_SNPS, manifest=None, force=False,
+                      retries=DEFAULT_RETRIES, backoff_factor=DEFAULT_BACKOFF, timeout=DEFAULT_TIMEOUT):
+    """
+    Stream a remote SNP_distances table straight into a pair store, without saving the table.
+
+    When a manifest is given and output_path was built from the same URL with the same
+    threshold, the request is conditional and an unchanged table is not transferred. An
+    interrupted transfer is restarted from the beginning, up to retries times; HTTP error
+    statuses are raised at once (see download_utils.retry_transfer).
+
+    Returns:
+    - The write_pair_store summary, or None if the table is unchanged.
+
+    Raises:
+    - requests.RequestException if the transfer ultimately fails.
+    """
+    headers = {}
+    if (not force and manifest is not None and manifest.is_current(output_path, url)
+            and read_max_snps(output_path) == max_snps):
+        entry = manifest.get(output_path)
+        if entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+
+    start = time.perf_counter()
+    used_retries = 0
+    attempt = 0
+    while True:
+        transferred = 0
+        try:
+            with session.get(url, stream=True, timeout=timeout, headers=headers) as response:
+                used_retries += adapter_retries(response)
+                if response.status_code == 304 and headers:
+                    metrics.file_downloaded(output_path, url, 0, used_retries, time.perf_counter() - start,
+                                            "unchanged")
+                    return None
+                response.raise_for_status()
+                lines = (line.decode() for line in response.iter_lines(chunk_size=CHUNK_SIZE))
+                summary = write_pair_store(lines, output_path, max_snps)
+                transferred = response.raw.tell()
+        except requests.RequestException as e:
+            if not retry_transfer(e, attempt, retries, backoff_factor):
+                metrics.file_downloaded(output_path, url, transferred, used_retries, time.perf_counter() - start,
+                                        "failed")
+                raise
+            attempt += 1
+            used_retries += 1
+            continue
+        if manifest is not None:
+            manifest.record(output_path, url, etag=response.headers.get("ETag"),
+                            last_modified=response.headers.get("Last-Modified"))
+        metrics.file_downloaded(output_path, url, transferred, used_retries, time.perf_counter() - start,
+                                "downloaded")
+        return summary
+
+
+def ingest_snp_distances(bacteria_list, base_url, target_directory, max_snps=DEFAULT_MAX_SNPS, force=False):
+    """
+    Build a pair store for the latest SNP_distances table of each bacteria.
+
+    download_cluster_tsv_files leaves these tables out because they hold every pairwise
+    distance in a cluster; here each one is streamed and filtered on the fly, so only the
+    pairs at most max_snps apart ever reach the disk. Stores are named after their table
+    (e.g. PDG000000002.3187.reference_target.SNP_distances.pairs.bin) and tracked in the
+    download manifest of target_directory.
+
+    Parameters:
+    - bacteria_list: Names of the bacteria to ingest.
+    - base_url: The NCBI pathogen Results URL.
+    - target_directory: Folder for the stores.
+    - max_snps: Keep pairs at most this many SNPs apart.
+    - force: Rebuild stores even if their table is unchanged.
+
+    Returns:
+    - A list of the store paths that are up to date.
+    """
+    os.makedirs(target_directory, exist_ok=True)
+    session = create_session()
+    manifest = DownloadManifest(target_directory)
+    stores = []
+    try:
+        for bacteria in bacteria_list:
+            directory_url = f"{base_url}/{bacteria}/latest_snps/Clusters"
+            files = list_tsv_files(directory_url, SNP_DISTANCES_PATTERN, session)
+            if files is None:
+                logger.warning(f"Could not list {directory_url}; skipping {bacteria} SNP distances")
+                continue
+            for url, name in files:
+                output_path = store_path_for(name, target_directory)
+                try:
+                    summary = stream_pair_store(session, url, output_path, max_snps, manifest, force)
+                except (requests.RequestException, ValueError, OSError) as e:
+                    logger.error(f"Failed to ingest {url}: {e}")
+                    continue
+                if summary is None:
+                    logger.info(f"{name} is unchanged; kept {os.path.basename(output_path)}")
+                else:
+                    logger.info(f"Kept {summary['pairs']} of {summary['rows']} pairs within {max_snps} SNPs "
+                                f"({summary['isolates']} isolates) from {name}")
+                stores.append(output_path)
+    finally:
+        manifest.save()
+    return stores
+
+
+def _expand_stores(paths):
+    stores = []
+    for path in paths:
+        if os.path.isdir(path):
+            stores.extend(
+                os.path.join(path, name) for name in sorted(os.listdir(path)) if name.endswith(STORE_SUFFIX)
+            )
+        else:
+            stores.append(path)
+    return stores
+
+
+DESCRIPTION = "Keep close pairs from NCBI SNP_distances tables in compact stores and query isolate neighbors."
+
+
+def add_arguments(parser):
+    """
+    Add the command-line options of this script to parser.
+    """
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    ingest = subparsers.add_parser("ingest", help="Stream the latest SNP_distances tables from NCBI into stores.")
+    ingest.add_argument("-b", "--bacteria", help="Name of the bacteria to process. Defaults to all bacteria.")
+    ingest.add_argument("-t", "--output_folder", default="metadata_ncbi",
+                        help="Folder for the stores. Defaults to metadata_ncbi.")
+    ingest.add_argument("--base_url", default=BASE_URL,
+                        help="Base URL of the NCBI pathogen Results directory (e.g. a local mirror).")
+    ingest.add_argument("--force", action="store_true", help="Rebuild stores even if their table is unchanged.")
+
+    build = subparsers.add_parser("build", help="Build a store from a local SNP_distances table.")
+    build.add_argument("table", help="SNP_distances TSV file.")
+    build.add_argument("-o", "--output", help=f"Store to write. Defaults to the table name with {STORE_SUFFIX}.")
+    build.add_argument("--isolate_columns", nargs=2, metavar=("FIRST", "SECOND"),
+                       help="Columns naming the two isolates of a pair. Defaults to target_acc_1 target_acc_2.")
+    build.add_argument("--distance_column",
+                       help="Column holding the SNP distance. Defaults to delta_positions_unambiguous.")
+
+    for subparser in (ingest, build):
+        subparser.add_argument("-d", "--max_snps", type=int, default=DEFAULT_MAX_SNPS,
+                               help=f"Keep pairs at most this many SNPs apart. Defaults to {DEFAULT_MAX_SNPS}.")
+
+    query = subparsers.add_parser("query", help="List the neighbors of isolates within a number of SNPs.")
+    query.add_argument("isolates", nargs="+", help="Isolate accessions (target_acc, e.g. PDT000000001.1).")
+    query.add_argument("-s", "--stores", nargs="+", default=["metadata_ncbi"],
+                       help=f"Stores, or directories containing *{STORE_SUFFIX} files. Defaults to metadata_ncbi.")
+    query.add_argument("-d", "--max_snps", type=int, help="Distance cut-off. Defaults to each store's threshold.")
+    query.add_argument("-o", "--output", help="Tab-delimited output file. Defaults to standard output.")
+
+    for subparser in (ingest, build, query):
+        metrics.add_arguments(subparser)
+
+
+def run(args):
+    """
+    Run the script with arguments parsed by a parser set up with add_arguments.
+    """
+    # Query results go to standard output unless --output is given, so messages go to standard error
+    stream = sys.stderr if args.command == "query" and not args.output else sys.stdout
+    with metrics.instrumented(args, f"snp_{args.command}", stream=stream):
+        if args.command == "ingest":
+            bacteria_list = [args.bacteria] if args.bacteria else list_available_bacteria()
+            ingest_snp_distances(bacteria_list, args.base_url, args.output_folder, args.max_snps, args.force)
+        elif args.command == "build":
+            output = args.output or store_path_for(os.path.basename(args.table), os.path.dirname(args.table))
+            build_pair_store(args.table, output, args.max_snps, args.isolate_columns, args.distance_column)
+        else:
+            rows = neighbors(_expand_stores(args.stores), args.isolates, args.max_snps)
+            out = open(args.output, "w") if args.output else sys.stdout
+            try:
+                out.write("query\tneighbor\tsnps\tstore\n")
+                for row in rows:
+                    out.write(f"{row['query']}\t{row['neighbor']}\t{row['snps']}\t{row['store']}\n")
+            finally:
+                if args.output:
+                    out.close()
+            if args.output:
+                metrics.file_written(args.output, len(rows))
+                logger.info(f"{len(rows)} neighbors written to {args.output}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=DESCRIPTION)
+    add_arguments(parser)
+    run(parser.parse_args(argv))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,43 @@
+import pandas as pd
+import pytest
+
+from opentrakr.columnar import read_columnar, write_partitioned_dataset
+
+
+@pytest.fixture
+def dataset(tmp_path):
+    df = pd.DataFrame({
+        "target_acc": [f"PDT{i:09d}.1" for i in range(8)],
+        "scientific_name": ["Salmonella enterica", "Listeria monocytogenes"] * 4,
+        "isolation_source": ["chicken", "chicken", "beef", "beef", "turkey", "turkey", "chicken", "beef"],
+        "collection_date": pd.to_datetime(["2019-01-05", "2019-06-01", "2020-02-29", "2020-12-31",
+                                           "2021-03-15", "2021-07-04", "2022-01-01", "2022-11-30"]),
+        "type": ["3187", "3187", "3187", "3187", "3188", "3188", "3188", "3188"],
+    })
+    path = tmp_path / "dataset"
+    write_partitioned_dataset(df, str(path), "type")
+    return str(path)
+
+
+def accessions(df):
+    return sorted(int(acc[3:12]) for acc in df["target_acc"])
+
+
+def test_filters_by_organism_and_release(dataset):
+    assert accessions(read_columnar(dataset, organism="Salmonella enterica")) == [0, 2, 4, 6]
+    assert accessions(read_columnar(dataset, release="3188")) == [4, 5, 6, 7]
+    assert accessions(read_columnar(dataset, organism="Listeria monocytogenes", release=["3187"])) == [1, 3]
+
+
+def test_filters_by_inclusive_date_range(dataset):
+    assert accessions(read_columnar(dataset, date_range=("2020-02-29", "2021-07-04"))) == [2, 3, 4, 5]
+    assert accessions(read_columnar(dataset, date_range=(None, "2019-06-01"))) == [0, 1]
+    assert accessions(read_columnar(dataset, date_range=("2022-01-01", None))) == [6, 7]
+
+
+def test_filters_by_isolation_source_and_match(dataset):
+    df = read_columnar(dataset, columns=["target_acc", "type"], isolation_source=["beef", "turkey"], release="3187")
+    assert list(df.columns) == ["target_acc", "type"]
+    assert accessions(df) == [2, 3]
+    assert accessions(read_columnar(dataset, match={"target_acc": ["PDT000000001.1"],
+                                                    "isolation_source": ["turkey"]})) == [1, 4, 5]
@@ -0,0 +1,120 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+import requests
+
+from opentrakr.download_utils import create_session, download_to_file
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """
+    Serve one file, or answer every request with a fixed error status, recording the requests.
+
+    The first `truncate` responses are cut off halfway through the body.
+    """
+
+    protocol_version = "HTTP/1.1"
+    body = b""
+    etag = '"v1"'
+    status = None
+    truncate = 0
+    requests = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self.requests.append(dict(self.headers))
+        if self.status:
+            self.send_response(self.status)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        start = 0
+        range_header = self.headers.get("Range")
+        if range_header and self.headers.get("If-Range") == self.etag:
+            start = int(range_header.split("=", 1)[1].rstrip("-"))
+        self.send_response(206 if start else 200)
+        self.send_header("ETag", self.etag)
+        self.send_header("Content-Length", str(len(self.body) - start))
+        if start:
+            self.send_header("Content-Range", f"bytes {start}-{len(self.body) - 1}/{len(self.body)}")
+        self.end_headers()
+        if self.truncate:
+            type(self).truncate -= 1
+            self.close_connection = True
+            self.wfile.write(self.body[start:len(self.body) // 2])
+            return
+        self.wfile.write(self.body[start:])
+
+
+@pytest.fixture
+def stub():
+    handler = type("Handler", (StubHandler,), {"requests": [], "body": bytes(range(256)) * 1024})
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    handler.url = f"http://127.0.0.1:{server.server_port}/file.bin"
+    yield handler
+    server.shutdown()
+
+
+@pytest.mark.parametrize("status, expected_requests", [(503, 3), (429, 3), (404, 1)])
+def test_http_errors_are_only_retried_by_the_adapter(stub, tmp_path, status, expected_requests):
+    stub.status = status
+    session = create_session(retries=2, backoff_factor=0)
+    with pytest.raises(requests.HTTPError):
+        download_to_file(session, stub.url, str(tmp_path / "file.bin"), retries=3, backoff_factor=0)
+    # One request plus the adapter's two retries for throttling and server errors, none for a 404
+    assert len(stub.requests) == expected_requests
+
+
+def write_part(path, data, etag=None, url=None):
+    with open(f"{path}.part", "wb") as file:
+        file.write(data)
+    if etag:
+        with open(f"{path}.part.json", "w") as file:
+            json.dump({"url": url, "etag": etag, "last_modified": None}, file)
+
+
+def test_interrupted_transfer_is_resumed(stub, tmp_path):
+    stub.truncate = 1
+    path = tmp_path / "file.bin"
+    result = download_to_file(create_session(), stub.url, str(path), retries=2, backoff_factor=0)
+    assert path.read_bytes() == stub.body
+    assert result.retries == 1
+    assert len(stub.requests) == 2
+    # Resumed from the last chunk written before the connection broke
+    offset = int(stub.requests[1]["Range"].split("=")[1].rstrip("-"))
+    assert 0 < offset <= len(stub.body) // 2
+    assert stub.requests[1]["If-Range"] == stub.etag
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["file.bin"]
+
+
+def test_part_file_is_resumed_when_its_validators_match(stub, tmp_path):
+    path = tmp_path / "file.bin"
+    write_part(path, stub.body[:1000], etag=stub.etag, url=stub.url)
+    result = download_to_file(create_session(), stub.url, str(path), backoff_factor=0)
+    assert path.read_bytes() == stub.body
+    assert stub.requests[0]["Range"] == "bytes=1000-"
+    assert result.transferred == len(stub.body) - 1000
+    assert not (tmp_path / "file.bin.part.json").exists()
+
+
+@pytest.mark.parametrize("etag", [None, '"v0"'])
+def test_part_file_of_unknown_or_changed_version_is_restarted(stub, tmp_path, etag):
+    path = tmp_path / "file.bin"
+    write_part(path, b"x" * 1000, etag=etag, url=stub.url)
+    result = download_to_file(create_session(), stub.url, str(path), backoff_factor=0)
+    # Without validators the .part file is dropped before asking; with stale ones the server sends the whole file
+    assert path.read_bytes() == stub.body
+    assert ("Range" in stub.requests[0]) == bool(etag)
+    assert result.transferred == len(stub.body)
+
+
+def test_transfer_errors_give_up_after_the_retries(stub, tmp_path):
+    stub.truncate = 3
+    with pytest.raises(requests.exceptions.ChunkedEncodingError):
+        download_to_file(create_session(), stub.url, str(tmp_path / "file.bin"), retries=2, backoff_factor=0)
+    assert len(stub.requests) == 3
@@ -0,0 +1,61 @@
+import csv
+import filecmp
+
+import pandas as pd
+import pytest
+
+from opentrakr.ncbi_tsv_merge import parallel_merge_files, split_ranges, stream_merge_files, type_label
+
+
+def write_release(folder, release, header, rows):
+    path = folder / f"PDG000000002.{release}.metadata.tsv"
+    with open(path, "w", encoding="utf-8", newline="") as file:
+        writer = csv.writer(file, delimiter="\t", lineterminator="\n")
+        writer.writerow(header)
+        writer.writerows(rows)
+    return str(path)
+
+
+@pytest.fixture
+def releases(tmp_path):
+    old = write_release(tmp_path, 1000, ["target_acc", "serovar", "isolation_source"], [
+        [f"PDT{i:09d}.1", "Typhimurium", "chicken breast\n\"raw\"" if i % 40 == 0 else "feces"]
+        for i in range(600)
+    ])
+    new = write_release(tmp_path, 1001, ["target_acc", "isolation_source", "scientific_name"], [
+        [f"PDT{i:09d}.2", "ground turkey" if i % 3 else "café\tdrain", "Salmonella enterica"]
+        for i in range(400)
+    ])
+    return [old, new]
+
+
+def test_split_ranges_do_not_cut_quoted_newlines(releases):
+    ranges = split_ranges(releases[0], split_size=1024)
+    assert len(ranges) > 1
+    assert all(end == start for (_, end), (start, _) in zip(ranges, ranges[1:]))
+    with open(releases[0], "rb") as file:
+        data = file.read()
+    for start, end in ranges:
+        assert data[start:end].count(b'"') % 2 == 0
+        assert data[end - 1:end] == b"\n"
+
+
+@pytest.mark.parametrize("column_mode", ["union", "common"])
+def test_parallel_merge_matches_stream_merge(releases, tmp_path, column_mode):
+    streamed = tmp_path / "streamed.tsv"
+    parallel = tmp_path / "parallel.tsv"
+    rows = stream_merge_files(releases, str(streamed), "type", type_label, column_mode, chunksize=64)
+    assert parallel_merge_files(releases, str(parallel), "type", type_label, column_mode, chunksize=64,
+                                split_size=1024) == rows == 1000
+    assert filecmp.cmp(streamed, parallel, shallow=False)
+
+
+def test_parallel_merge_matches_stream_merge_for_parquet(releases, tmp_path):
+    streamed = tmp_path / "streamed"
+    parallel = tmp_path / "parallel"
+    stream_merge_files(releases, str(streamed), "type", type_label, output_format="parquet")
+    parallel_merge_files(releases, str(parallel), "type", type_label, output_format="parquet", split_size=1024)
+    # The older release has no scientific_name column; its rows are written with nulls there
+    assert pd.read_parquet(streamed)["scientific_name"].isna().sum() == 600
+    read = lambda path: pd.read_parquet(path).astype(str).sort_values("target_acc").reset_index(drop=True)
+    pd.testing.assert_frame_equal(read(streamed), read(parallel))
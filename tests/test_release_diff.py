@@ -0,0 +1,36 @@
+import csv
+import filecmp
+
+from opentrakr.ncbi_tsv_merge import merge_metadata, update_merged_output
+from opentrakr.release_diff import diff_releases
+
+ROWS = [["target_acc", "PDS_acc", "serovar", "isolation_source"]] + [
+    [f"PDT{i:09d}.1", f"PDS{i % 7:09d}.1", "Typhimurium", "chicken breast\nraw" if i % 50 == 0 else "feces"]
+    for i in range(1000)
+]
+
+
+def write_release(folder, release):
+    folder.mkdir()
+    path = folder / f"PDG000000002.{release}.metadata.tsv"
+    with open(path, "w", newline="") as file:
+        csv.writer(file, delimiter="\t", lineterminator="\n").writerows(ROWS)
+    return path
+
+
+def test_identical_rows_across_releases_are_unchanged(tmp_path):
+    old = write_release(tmp_path / "old", 1000)
+    new = write_release(tmp_path / "new", 1001)
+
+    summary = diff_releases(str(old.parent), str(new.parent), str(tmp_path / "diff.tsv"))
+    assert summary == {"added": 0, "removed": 0, "changed": 0, "reassigned": 0}
+
+    merged = tmp_path / "merged.tsv"
+    merge_metadata(str(old.parent), str(merged), streaming=True, incremental=True)
+    summary = update_merged_output([str(new)], str(merged))
+    assert summary["copied"] == 1000
+    assert summary["changed"] == summary["added"] == summary["removed"] == 0
+
+    full = tmp_path / "full.tsv"
+    merge_metadata(str(new.parent), str(full), streaming=True)
+    assert filecmp.cmp(merged, full, shallow=False)